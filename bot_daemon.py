@@ -0,0 +1,65 @@
+# Bot de Telegram sin interfaz:  python -m bot_daemon   (o:  pythonw bot_daemon.py desde el autostart)
+# No construye MainWindow ni QApplication: lee token, ACL y opciones del mismo almacén que la app
+# (QSettings de QtCore) y ejecuta el ciclo asyncio de TelegramBot en el hilo principal.
+# SIGTERM / SIGINT (y SIGBREAK en Windows) detienen el bot de forma ordenada.
+
+import argparse
+import multiprocessing
+import signal
+import sys
+
+from PyQt6.QtCore import QSettings
+
+from engine import _ts, maybe_update_ytdlp_async
+from telegram_bot import TelegramBot, bot_settings_from
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m bot_daemon",
+        description="Ejecuta solo el bot de Telegram con la configuración guardada por la app.")
+    parser.add_argument("--ffmpeg", default=None, help="ruta a ffmpeg (por defecto: imageio-ffmpeg)")
+    parser.add_argument("--no-update", action="store_true", help="no actualizar yt-dlp al arrancar")
+    parser.add_argument("--force", action="store_true",
+                        help="arrancar aunque el bot esté deshabilitado en la configuración")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="procesos de descarga (0 = hilos; por defecto: el valor guardado en la app)")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    settings = QSettings("BitStation", "MultimediaDownloader")
+    config = bot_settings_from(settings)
+    if args.workers is not None:
+        config["worker_processes"] = max(0, args.workers)
+
+    enabled = settings.value("telegram/enabled", False, type=bool)
+    if not config["token"] or not (enabled or args.force):
+        print(f"[{_ts()}] [DAEMON] Bot no habilitado o token vacío. Saliendo.")
+        return 0
+
+    if not args.no_update:
+        maybe_update_ytdlp_async()
+    ffmpeg_path = args.ffmpeg
+    if not ffmpeg_path:
+        import imageio_ffmpeg
+        ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
+
+    bot = TelegramBot(ffmpeg_path=ffmpeg_path,
+                      dest_video_path=settings.value("videoPath", "", type=str),
+                      **config)
+
+    def on_signal(signum, frame):
+        print(f"[{_ts()}] [DAEMON] Señal {signal.Signals(signum).name} recibida. Deteniendo bot...")
+        bot.stop()
+
+    for name in ("SIGTERM", "SIGINT", "SIGBREAK"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), on_signal)
+
+    print(f"[{_ts()}] [DAEMON] Bot en marcha (Ctrl+C o SIGTERM para salir).")
+    bot.run()
+    return 0
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
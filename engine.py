@@ -0,0 +1,892 @@
+# Motor de descargas sin Qt: opciones de yt-dlp, selección de formato, reanudación,
+# planificación por host y movimiento final. Lo comparten la app (main.py) y el modo
+# por lotes sin interfaz (headless.py). No debe importar PyQt6 ni telegram.
+
+import sys
+import os
+import copy
+import ipaddress
+import re
+import json
+import stat
+import time
+import shutil
+import subprocess
+import threading
+from collections import Counter, OrderedDict, deque
+from datetime import datetime
+from typing import Optional
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode, unquote
+
+import requests
+import yt_dlp
+
+# ------------------------------ Utilidades ------------------------------
+
+def _ts():
+    return datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+def _safe_rmtree(path, retries=10, delay=0.2):
+    def onerror(func, p, exc_info):
+        try:
+            os.chmod(p, stat.S_IWRITE)
+        except Exception:
+            pass
+        try:
+            func(p)
+        except Exception:
+            pass
+
+    for _ in range(retries):
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path, onerror=onerror)
+            return True
+        except (PermissionError, OSError):
+            time.sleep(delay)
+    return not os.path.isdir(path)
+
+def _safe_move(src_path, dst_dir):
+    os.makedirs(dst_dir, exist_ok=True)
+    base = os.path.basename(src_path)
+    name, ext = os.path.splitext(base)
+    candidate = os.path.join(dst_dir, base)
+    n = 1
+    while os.path.exists(candidate):
+        candidate = os.path.join(dst_dir, f"{name} ({n}){ext}")
+        n += 1
+    return shutil.move(src_path, candidate)
+
+def _app_data_dir() -> str:
+    # Fuera de la carpeta de la app: el updater borra todo salvo venv/update_temp
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(base, "BitStation", "MultimediaDownloader")
+
+def _creation_flags():
+    return subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+
+# --- Actualización en segundo plano de yt-dlp ---
+def maybe_update_ytdlp_async():
+    def _worker():
+        try:
+            print(f"[{_ts()}] [YTDLP] Comprobando actualización de yt-dlp (en segundo plano)...")
+            subprocess.run(
+                [sys.executable, "-m", "pip", "install", "-U", "yt-dlp"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                creationflags=_creation_flags(), check=False, encoding="utf-8"
+            )
+            print(f"[{_ts()}] [YTDLP] Verificación/actualización completada.")
+        except Exception as e:
+            print(f"[{_ts()}] [YTDLP] No se pudo actualizar automáticamente: {e}")
+    threading.Thread(target=_worker, daemon=True).start()
+
+URL_REGEX = r'https?://[^\s/$.?#].[^\s]*'
+TEMP_DOWNLOADS_DIR = os.path.join(os.getcwd(), "temp_downloads")
+HEADLESS_TEMP_DIRNAME = "_cli"  # parciales del modo por lotes (temp_downloads/_cli/<id>)
+BOT_TEMP_DIRNAME = "_tg"        # descargas del bot en disco (temp_downloads/_tg/<id>); las limpia el bot
+RESUME_STATE_FILE = ".bitstation_resume.json"  # checkpoint de pausa dentro de temp_downloads/<uuid>
+RESUME_CHECKPOINT_INTERVAL = 1.0  # segundos entre escrituras del checkpoint
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp', '.tmp')
+MEDIA_EXTS = {'.mp3', '.m4a', '.aac', '.opus', '.wav', '.flac', '.mp4', '.mkv', '.webm', '.mov', '.ts', '.m4v'}
+APP_DATA_DIR = _app_data_dir()
+DEFAULT_MAX_PARALLEL_DOWNLOADS = 3
+MAX_PARALLEL_DOWNLOADS_LIMIT = 16
+
+# Tope de descargas simultáneas por sitio (editable en la pestaña General).
+# Los hosts que no aparecen aquí (CDNs directos, etc.) usan DEFAULT_HOST_CONCURRENCY.
+HOST_CONCURRENCY_LIMITS = {
+    "youtube.com": 2,
+    "tiktok.com": 2,
+    "facebook.com": 2,
+    "instagram.com": 2,
+}
+DEFAULT_HOST_CONCURRENCY = 4
+# Dominios cortos/alternativos que cuentan contra el cupo del sitio principal
+HOST_ALIASES = {
+    "youtu.be": "youtube.com",
+    "youtube-nocookie.com": "youtube.com",
+    "googlevideo.com": "youtube.com",
+    "fb.watch": "facebook.com",
+    "fbcdn.net": "facebook.com",
+    "tiktokcdn.com": "tiktok.com",
+    "cdninstagram.com": "instagram.com",
+}
+# Segundos niveles bajo los que se registran dominios (sin tirar de la Public Suffix List):
+# en estos ccTLD el dominio del sitio son las tres últimas etiquetas (bbc.co.uk, globo.com.br)
+SECOND_LEVEL_SUFFIXES = {
+    "ac", "co", "com", "edu", "gob", "gov", "gv", "ltd", "me", "mil", "ne", "net", "nic",
+    "nom", "or", "org", "plc", "sch",
+}
+SECOND_LEVEL_CCTLDS = {
+    "ar", "at", "au", "br", "cn", "co", "cr", "ec", "eg", "es", "gt", "hk", "id", "il", "in",
+    "jp", "ke", "kr", "mx", "my", "ng", "nz", "pe", "ph", "pk", "pl", "py", "sa", "sg", "th",
+    "tr", "tw", "ua", "uk", "uy", "ve", "vn", "za",
+}
+
+# --- Compatibilidad y headers ---
+COMMON_UA = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+             "(KHTML, like Gecko) Chrome/124.0 Safari/537.36")
+COMMON_HEADERS = {
+    "User-Agent": COMMON_UA,
+    "Accept-Language": "es-ES,es;q=0.9,en;q=0.8",
+}
+
+# Sin forzar 480p
+EXTRACTOR_ARGS = {
+    "facebook": {"locale": ["es_ES"]},
+    "tiktok": {"webpage_url": ["1"]},
+}
+
+# Parámetros de seguimiento que no cambian el contenido en ningún sitio; se quitan al canonizar URLs.
+# Los genéricos (s, t, ref...) pueden ser firma, token o selector en un CDN: solo se quitan por host.
+TRACKING_PARAMS = {'si', 'feature', 'igshid', 'igsh', 'fbclid', 'gclid', 'dclid', 'msclkid', 'mibextid'}
+HOST_TRACKING_PARAMS = {
+    "youtube.com": {'t', 'pp', 'ab_channel'},  # t = segundo de inicio: mismo vídeo
+    "x.com": {'s', 't', 'ref_src', 'ref_url'},
+    "twitter.com": {'s', 't', 'ref_src', 'ref_url'},
+    "tiktok.com": {'is_from_webapp', 'sender_device', 'sender_web_id', 'share_app_id', '_r', '_t', 'refer', 't'},
+}
+
+# Mejor combinación nativa
+FORMAT_FALLBACK = "bv*+ba/b"
+BEST_QUALITY_ID = "bestvideo+bestaudio/best"  # valor del combo "Mejor Calidad"
+
+def base_ytdlp_opts(ffmpeg_path: str):
+    return {
+        "ffmpeg_location": ffmpeg_path,
+        "http_headers": COMMON_HEADERS,
+        "extractor_args": EXTRACTOR_ARGS,
+        "retries": 10,
+        "fragment_retries": 10,
+        "concurrent_fragment_downloads": 4,
+        "nocheckcertificate": False,
+        "quiet": True,
+        "no_warnings": True,
+        "merge_output_format": "mp4",
+        "noprogress": True,
+        "geo_bypass": True,
+    }
+
+class DownloadPausedException(Exception):
+    pass
+
+# ---------------------------- Planificación por host ----------------------------
+
+def host_key(url: str) -> str:
+    """Dominio 'registrable' de la URL (www.youtube.com, m.youtube.com, youtu.be -> youtube.com)."""
+    try:
+        host = (urlparse(url).hostname or "").lower().rstrip(".")
+    except ValueError:
+        host = ""
+    if not host:
+        return ""
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+        return host  # IP literal
+    except ValueError:
+        pass
+    labels = host.split(".")
+    keep = 2
+    if len(labels) >= 3 and labels[-1] in SECOND_LEVEL_CCTLDS and labels[-2] in SECOND_LEVEL_SUFFIXES:
+        keep = 3  # bbc.co.uk, no co.uk
+    key = ".".join(labels[-keep:])
+    return HOST_ALIASES.get(key, key)
+
+def canonical_url(url: str) -> str:
+    """URL normalizada para usarla como clave: esquema/host en minúsculas, sin www./m.,
+    sin fragmento, sin parámetros de seguimiento y con la query ordenada."""
+    try:
+        p = urlparse(url.strip())
+    except ValueError:
+        return url.strip()
+    host = (p.hostname or "").lower().rstrip(".")
+    for prefix in ("www.", "m.", "mobile."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    netloc = host + (f":{p.port}" if p.port else "")
+    drop = TRACKING_PARAMS | HOST_TRACKING_PARAMS.get(host_key(url), set())
+    query = sorted((k, v) for k, v in parse_qsl(p.query, keep_blank_values=True)
+                   if k.lower() not in drop and not k.lower().startswith("utm_"))
+    path = p.path.rstrip("/") or "/"
+    return urlunparse(((p.scheme or "https").lower(), netloc, path, "", urlencode(query), ""))
+
+class HostScheduler:
+    """Cola FIFO por host con tope de concurrencia por sitio y turno rotativo entre hosts.
+
+    Los trabajos son dicts con 'url'; se les añade 'host'. Quien consume la cola
+    lleva la cuenta de lo que está activo y la pasa a pop_ready().
+    """
+    def __init__(self, limits=None, default_limit=DEFAULT_HOST_CONCURRENCY):
+        self.limits = dict(HOST_CONCURRENCY_LIMITS if limits is None else limits)
+        self.default_limit = default_limit
+        self._queues = OrderedDict()  # host -> deque de jobs (orden = turno)
+
+    def limit_for(self, host: str) -> int:
+        return max(1, int(self.limits.get(host, self.default_limit)))
+
+    def push(self, job: dict):
+        host = job.setdefault('host', host_key(job.get('url', "")))
+        self._queues.setdefault(host, deque()).append(job)
+
+    def pop_ready(self, busy: Counter) -> Optional[dict]:
+        """Primer trabajo de un host por debajo de su tope; ese host pasa al final del turno."""
+        for host, queue in list(self._queues.items()):
+            if busy.get(host, 0) >= self.limit_for(host):
+                continue
+            job = queue.popleft()
+            if queue:
+                self._queues.move_to_end(host)
+            else:
+                del self._queues[host]
+            return job
+        return None
+
+    def remove(self, predicate):
+        for host in list(self._queues):
+            kept = deque(j for j in self._queues[host] if not predicate(j))
+            if kept:
+                self._queues[host] = kept
+            else:
+                del self._queues[host]
+
+    def clear(self):
+        self._queues.clear()
+
+    def __iter__(self):
+        for queue in self._queues.values():
+            yield from queue
+
+    def __len__(self):
+        return sum(len(q) for q in self._queues.values())
+
+# ---------------------------- Helpers de formatos ----------------------------
+
+_height_regex = re.compile(r'(?:(\d+)\s*[pP])|(?:\d+\s*[xX]\s*(\d+))')
+
+def _get_height(fmt: dict) -> Optional[int]:
+    h = fmt.get('height')
+    if isinstance(h, int) and h > 0:
+        return h
+    res = fmt.get('resolution') or fmt.get('format_note') or ""
+    m = _height_regex.search(str(res))
+    if m:
+        return int(m.group(1) or m.group(2))
+    return None
+
+def _filesize_of(fmt: dict) -> Optional[int]:
+    return fmt.get('filesize') or fmt.get('filesize_approx')
+
+def build_format_selection(want_audio: bool, want_video: bool, format_id: Optional[str] = None):
+    """Devuelve (format_selection, job_type) con fallbacks seguros
+    (evita "Requested format is not available")."""
+    fmt_id = (format_id or "").strip()
+
+    if want_audio and not want_video:
+        # Audio solo -> permitimos caer a "best" y luego extraemos audio con FFmpeg
+        return "bestaudio/best", 'audio'
+    if want_video and not want_audio:
+        # Video solo -> intentamos id elegido o bestvideo; si no existe, caemos a "best" (combinado)
+        if '+' in fmt_id:
+            fmt_id = fmt_id.split('+', 1)[0].strip()
+        if not fmt_id or fmt_id == BEST_QUALITY_ID:
+            return "bestvideo/best", 'video'
+        return f"{fmt_id}/best", 'video'
+    # Ambos ("ambos" se gestiona como salida de video final)
+    if fmt_id and '+' in fmt_id:
+        return fmt_id, 'video'
+    if fmt_id:
+        return f"{fmt_id}+bestaudio/best", 'video'
+    return BEST_QUALITY_ID, 'video'
+
+SIZE_PROBE_LIMIT = 8  # HEAD máximos por elección de formato (solo para formatos sin tamaño conocido)
+
+def pick_format_under_budget(formats, budget: int, probe=None):
+    """Mejor formato (video+audio o combinado) cuyo tamaño cabe en budget bytes.
+
+    Recorre de mayor a menor altura y tbr (a igual altura, mp4+m4a primero). El tamaño sale
+    de filesize/filesize_approx o, si falta, de probe(url) (HEAD) para descargas HTTP directas.
+    Devuelve (format_spec, bytes, height) o None si nada cabe.
+    """
+    sizes, probes = {}, [0]
+
+    def size_of(f):
+        fid = f['format_id']
+        if fid not in sizes:
+            size = _filesize_of(f)
+            if (not size and probe and probes[0] < SIZE_PROBE_LIMIT and f.get('url')
+                    and (f.get('protocol') or 'https') in ('http', 'https')):
+                probes[0] += 1
+                size = probe(f['url'])
+            sizes[fid] = int(size) if size else None
+        return sizes[fid]
+
+    videos, audios, muxed = [], [], []
+    for f in formats or []:
+        if not f.get('format_id') or f.get('ext') == 'mhtml':
+            continue
+        vcodec, acodec = f.get('vcodec'), f.get('acodec')
+        if vcodec == 'none' and acodec == 'none':
+            continue
+        if vcodec == 'none':
+            audios.append(f)
+        elif acodec == 'none':
+            videos.append(f)
+        else:
+            muxed.append(f)  # incluye formatos sin codecs declarados (enlaces directos)
+
+    audios.sort(key=lambda a: (a.get('ext') == 'm4a', a.get('abr') or a.get('tbr') or 0), reverse=True)
+    candidates = [(f, None) for f in muxed] + [(v, audios) for v in videos if audios]
+    candidates.sort(key=lambda c: (_get_height(c[0]) or 0, c[0].get('ext') == 'mp4', c[0].get('tbr') or 0),
+                    reverse=True)
+
+    for f, pair_audios in candidates:
+        size = size_of(f)
+        if not size or size > budget:
+            continue
+        if pair_audios is None:
+            return f['format_id'], size, _get_height(f)
+        for a in pair_audios:
+            a_size = size_of(a)
+            if a_size and size + a_size <= budget:
+                return f"{f['format_id']}+{a['format_id']}", size + a_size, _get_height(f)
+    return None
+
+def build_download_opts(ffmpeg_path: str, format_selection: str, job_type: str, temp_dir: str) -> dict:
+    ydl_opts = base_ytdlp_opts(ffmpeg_path) | {
+        'format': format_selection,
+        'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
+        'nocolor': True,
+        'hls_prefer_native': True,
+        'continuedl': True,
+        'nooverwrites': False,
+        # Peticiones Range por bloques: la reanudación continúa en el último byte del .part
+        'http_chunk_size': 10 * 1024 * 1024,
+    }
+
+    # Audio solo -> extraer audio (soluciona TikTok/otros cuando no hay pista separada)
+    if job_type == 'audio':
+        ydl_opts |= {
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': '0',
+            }],
+            'keepvideo': False,
+        }
+    return ydl_opts
+
+# ---------------------------- Reanudación ----------------------------
+
+def _read_resume_state(temp_dir) -> dict:
+    try:
+        with open(os.path.join(temp_dir, RESUME_STATE_FILE), "r", encoding="utf-8") as f:
+            state = json.load(f)
+        return state if isinstance(state, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def _write_resume_state(temp_dir, state: dict):
+    # Escritura atómica: un corte a mitad no deja un JSON truncado
+    path = os.path.join(temp_dir, RESUME_STATE_FILE)
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[{_ts()}] [DL] No se pudo guardar el checkpoint de reanudación: {e}")
+
+def prepare_job_dir(temp_dir: str, format_selection: str) -> int:
+    """Crea/reutiliza la carpeta temporal del trabajo y devuelve el % ya descargado.
+
+    Se conservan .part/.ytdl y los streams ya completos (bv+ba); solo se descartan
+    si cambió el formato, porque el parcial no sería del mismo archivo.
+    """
+    resume_percent = 0
+    if os.path.isdir(temp_dir):
+        state = _read_resume_state(temp_dir)
+        if state.get('format') and state.get('format') != format_selection:
+            print(f"[{_ts()}] [DL] Formato cambiado ({state.get('format')} -> {format_selection}). Descartando parciales.")
+            if not _safe_rmtree(temp_dir):
+                print(f"[{_ts()}] [DL] No se pudo limpiar el directorio temporal anterior: {temp_dir}")
+        else:
+            resume_percent = int(state.get('percent') or 0)
+    os.makedirs(temp_dir, exist_ok=True)
+    return resume_percent
+
+class ResumeTracker:
+    """Checkpoint de pausa: bytes/fragmentos por archivo del intento actual.
+
+    yt-dlp reanuda por sí mismo desde el .part (Range) y el .ytdl (fragmentos);
+    esto deja constancia en disco para la UI, el JobStore y los reinicios.
+    """
+    def __init__(self, job: dict, format_selection: Optional[str]):
+        self.temp_dir = job.get('temp_dir')
+        self.state = _read_resume_state(self.temp_dir) if self.temp_dir else {}
+        self.state.update({'url': job.get('url'), 'format': format_selection})
+        self.state.setdefault('files', {})
+        self._last_save = 0.0
+
+    def track(self, d) -> bool:
+        """Registra un evento de progress_hook. Devuelve True si se escribió el checkpoint."""
+        fn = d.get('filename')
+        if not fn:
+            return False
+        entry = self.state['files'].setdefault(os.path.basename(fn), {})
+        entry.update({
+            'status': d.get('status'),
+            'tmpfilename': os.path.basename(d.get('tmpfilename') or fn),
+            'downloaded_bytes': int(d.get('downloaded_bytes') or 0),
+            'total_bytes': d.get('total_bytes') or d.get('total_bytes_estimate'),
+            'fragment_index': d.get('fragment_index'),
+            'fragment_count': d.get('fragment_count'),
+        })
+        total = entry['total_bytes']
+        if total:
+            self.state['percent'] = int(entry['downloaded_bytes'] * 100 / total)
+        now = time.monotonic()
+        if d.get('status') == 'finished' or now - self._last_save >= RESUME_CHECKPOINT_INTERVAL:
+            self._last_save = now
+            self.save()
+            return True
+        return False
+
+    def save(self):
+        if self.temp_dir and os.path.isdir(self.temp_dir):
+            self.state['updated'] = time.time()
+            _write_resume_state(self.temp_dir, self.state)
+
+    def totals(self):
+        """(bytes_done, bytes_total|None, percent) sumando todos los streams del trabajo."""
+        files = self.state['files'].values()
+        bytes_done = sum(f.get('downloaded_bytes') or 0 for f in files)
+        totals = [f.get('total_bytes') for f in files]
+        bytes_total = int(sum(totals)) if totals and all(totals) else None
+        return bytes_done, bytes_total, int(self.state.get('percent') or 0)
+
+# ---------------------------- Descarga ----------------------------
+
+_ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
+def hook_percent(d) -> Optional[int]:
+    """Porcentaje de un evento 'downloading' de yt-dlp (o None si no se puede leer)."""
+    percent_str = _ansi_escape.sub('', d.get('_percent_str', '0.0%').strip())
+    try:
+        return int(float(percent_str.strip('%')))
+    except (ValueError, TypeError):
+        return None
+
+def strip_audio_track(final_file: str, ffmpeg_path: str):
+    """Quita la pista de audio in situ (copia de streams, sin recodificar)."""
+    try:
+        base, ext = os.path.splitext(final_file)
+        tmp_out = base + ".__noaudio__" + ext
+        subprocess.run(
+            [ffmpeg_path, '-y', '-i', final_file, '-c', 'copy', '-an', tmp_out],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            check=False, creationflags=_creation_flags()
+        )
+        if os.path.exists(tmp_out) and os.path.getsize(tmp_out) > 0:
+            try:
+                os.replace(tmp_out, final_file)
+            except Exception:
+                shutil.move(tmp_out, final_file)
+        else:
+            if os.path.exists(tmp_out):
+                try: os.remove(tmp_out)
+                except Exception: pass
+    except Exception as e:
+        print(f"[{_ts()}] [DL] No se pudo eliminar audio: {e}")
+
+# Recompresión a tamaño objetivo (bot de Telegram). Se ejecuta en procesos aparte:
+# pocas a la vez y con hilos repartidos para no dejar sin CPU al resto de la app.
+TRANSCODE_MAX_WORKERS = max(1, min(2, (os.cpu_count() or 2) // 4))
+TRANSCODE_THREADS = max(1, ((os.cpu_count() or 2) - 1) // TRANSCODE_MAX_WORKERS)
+TRANSCODE_AUDIO_KBPS = 96
+TRANSCODE_MIN_VIDEO_KBPS = 120   # por debajo no merece la pena enviar el video
+TRANSCODE_SIZE_MARGIN = 0.92     # contenedor + desvío del control de tasa
+
+_duration_regex = re.compile(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)')
+
+def media_duration(path: str, ffmpeg_path: str) -> Optional[float]:
+    """Duración en segundos leyendo la cabecera con 'ffmpeg -i' (sin ffprobe)."""
+    try:
+        r = subprocess.run([ffmpeg_path, '-hide_banner', '-i', path], stdout=subprocess.DEVNULL,
+                           stderr=subprocess.PIPE, text=True, errors='replace',
+                           check=False, creationflags=_creation_flags())
+        m = _duration_regex.search(r.stderr or "")
+        if m:
+            return int(m.group(1)) * 3600 + int(m.group(2)) * 60 + float(m.group(3))
+    except Exception:
+        pass
+    return None
+
+def transcode_target_kbps(budget: int, duration: float, audio_kbps=TRANSCODE_AUDIO_KBPS) -> int:
+    """Bitrate de video (kbit/s) para que video+audio de 'duration' segundos quepa en 'budget' bytes."""
+    total_kbps = budget * 8 * TRANSCODE_SIZE_MARGIN / 1000 / duration
+    return int(total_kbps - audio_kbps)
+
+def transcode_to_budget(src: str, dst: str, ffmpeg_path: str, budget: int, duration: Optional[float] = None,
+                        threads: int = TRANSCODE_THREADS) -> str:
+    """Recomprime src a H.264/AAC en dos pasadas con el bitrate justo para caber en 'budget' bytes.
+
+    Función de módulo (picklable) pensada para ProcessPoolExecutor. Baja la resolución cuando el
+    bitrate disponible es pequeño. Devuelve dst; lanza RuntimeError si no es posible.
+    """
+    duration = duration or media_duration(src, ffmpeg_path)
+    if not duration or duration <= 0:
+        raise RuntimeError("No se pudo obtener la duración del video")
+    video_kbps = transcode_target_kbps(budget, duration)
+    if video_kbps < TRANSCODE_MIN_VIDEO_KBPS:
+        raise RuntimeError(f"El video es demasiado largo para caber en {budget // (1024*1024)}MB "
+                           f"({video_kbps} kbit/s disponibles)")
+    max_height = 720 if video_kbps >= 1500 else 480 if video_kbps >= 700 else 360
+    passlog = os.path.join(os.path.dirname(dst) or ".", "ffmpeg2pass")
+    common = [ffmpeg_path, '-hide_banner', '-y', '-i', src,
+              '-vf', f"scale=-2:'min({max_height},ih)'", '-c:v', 'libx264', '-preset', 'veryfast',
+              '-b:v', f"{video_kbps}k", '-maxrate', f"{int(video_kbps * 1.5)}k", '-bufsize', f"{video_kbps * 2}k",
+              '-threads', str(max(1, int(threads))), '-passlogfile', passlog]
+    passes = [
+        common + ['-pass', '1', '-an', '-f', 'mp4', os.devnull],
+        common + ['-pass', '2', '-c:a', 'aac', '-b:a', f"{TRANSCODE_AUDIO_KBPS}k",
+                  '-movflags', '+faststart', dst],
+    ]
+    try:
+        for cmd in passes:
+            r = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+                               errors='replace', check=False, creationflags=_creation_flags())
+            if r.returncode != 0:
+                raise RuntimeError(f"ffmpeg terminó con código {r.returncode}: {(r.stderr or '')[-300:].strip()}")
+    finally:
+        for name in os.listdir(os.path.dirname(passlog) or "."):
+            if name.startswith("ffmpeg2pass"):
+                try: os.remove(os.path.join(os.path.dirname(passlog) or ".", name))
+                except Exception: pass
+    if not os.path.exists(dst) or os.path.getsize(dst) == 0:
+        raise RuntimeError("ffmpeg no generó el archivo recomprimido")
+    return dst
+
+# ---------------------------- Caché de extracción ----------------------------
+
+INFO_CACHE_MAX_ENTRIES = 64       # mínimo; la GUI lo sube al número de filas de la tabla
+INFO_CACHE_UNUSED_KEYS = ('automatic_captions', 'subtitles', 'thumbnails', 'heatmap')  # no se descargan y pesan
+INFO_CACHE_DEFAULT_TTL = 30 * 60  # s; sin 'expire' en las URLs de formato
+INFO_CACHE_MARGIN = 120           # s; la descarga tiene que empezar antes de que caduquen
+_EXPIRE_RE = re.compile(r'[?&/]expires?[=/](\d{9,11})')
+
+def info_expiry(info: dict) -> float:
+    """Instante (epoch) en que caducan las URLs firmadas del info_dict: el 'expire' más próximo."""
+    stamps = []
+    for f in info.get('formats') or [info]:
+        for url in (f.get('url'), f.get('manifest_url'), f.get('fragment_base_url')):
+            m = _EXPIRE_RE.search(url or '')
+            if m:
+                stamps.append(int(m.group(1)))
+    return min(stamps) if stamps else time.time() + INFO_CACHE_DEFAULT_TTL
+
+class InfoCache:
+    """LRU de info_dicts (ya saneados, como un --write-info-json) por URL canónica.
+
+    El extractor de formatos de la tabla lo llena y run_download lo consume con
+    process_ie_result: así cada trabajo paga una sola extracción. Tras una importación
+    masiva todas las filas se extraen antes de descargarse, así que el tope sigue al tamaño
+    de la cola (set_capacity) y cada entrada guarda solo lo que la descarga necesita.
+    """
+    def __init__(self, max_entries=INFO_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # url canónica -> (caducidad, info)
+        self._lock = threading.Lock()
+
+    def put(self, url: str, info: dict):
+        if not isinstance(info, dict) or info.get('_type', 'video') != 'video':
+            return  # playlists y redirecciones: se extraen al descargar
+        info = yt_dlp.YoutubeDL.sanitize_info(info, remove_private_keys=True)
+        for name in INFO_CACHE_UNUSED_KEYS:
+            info.pop(name, None)
+        key, expires = canonical_url(url), info_expiry(info) - INFO_CACHE_MARGIN
+        with self._lock:
+            self._entries[key] = (expires, info)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set_capacity(self, max_entries: int):
+        with self._lock:
+            self.max_entries = max(INFO_CACHE_MAX_ENTRIES, int(max_entries))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, url: str) -> Optional[dict]:
+        key = canonical_url(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return copy.deepcopy(entry[1])  # process_ie_result modifica el dict
+
+    def discard(self, url: str):
+        with self._lock:
+            self._entries.pop(canonical_url(url), None)
+
+INFO_CACHE = InfoCache()
+
+def extract_info_cached(url: str, ydl_opts: dict) -> dict:
+    """extract_info(download=False) que deja el resultado en INFO_CACHE para la descarga posterior."""
+    cached = INFO_CACHE.get(url)
+    if cached is not None:
+        return cached
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info_dict = ydl.extract_info(url, download=False)
+    INFO_CACHE.put(url, info_dict)
+    return info_dict
+
+def _is_expired_error(e: Exception) -> bool:
+    msg = str(e)
+    return any(code in msg for code in ('HTTP Error 403', 'HTTP Error 410', '403: Forbidden', '410: Gone'))
+
+# ---------------------------- Enlaces directos ----------------------------
+
+DIRECT_MEDIA_EXTS = {'.mp4', '.m4v', '.mov', '.webm', '.mkv', '.mp3', '.m4a', '.aac', '.ogg', '.opus', '.wav', '.flac'}
+DIRECT_CHUNK_SIZE = 256 * 1024  # bloque de lectura: la pausa se atiende como mucho tras este tamaño
+DIRECT_FORMAT_ID = "direct"     # format_id sintético del combo para enlaces directos
+
+def _probe_http(url: str):
+    """Una petición HEAD (o GET con Range 0-0 si HEAD no da el tamaño).
+    Devuelve (url final, cabeceras, tamaño|None, admite Range) o None si falla."""
+    try:
+        r = requests.head(url, headers=COMMON_HEADERS, allow_redirects=True, timeout=8)
+        cl = r.headers.get('Content-Length') or ''
+        if r.ok and cl.isdigit():
+            return r.url, r.headers, int(cl), r.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    except Exception:
+        pass
+    try:
+        with requests.get(url, headers={**COMMON_HEADERS, "Range": "bytes=0-0"}, stream=True, timeout=8) as r:
+            if not r.ok:
+                return None
+            size = None
+            cr = r.headers.get('Content-Range') or ''
+            if '/' in cr and cr.split('/')[-1].isdigit():
+                size = int(cr.split('/')[-1])
+            elif r.status_code == 200 and (r.headers.get('Content-Length') or '').isdigit():
+                size = int(r.headers['Content-Length'])
+            return r.url, r.headers, size, r.status_code == 206
+    except Exception:
+        return None
+
+def head_content_length(url: str) -> Optional[int]:
+    probe = _probe_http(url)
+    return probe[2] if probe else None
+
+def looks_like_direct_media(url: str) -> bool:
+    # Solo se sondean rutas con extensión de audio/vídeo: las páginas normales no pagan una petición extra
+    try:
+        path = urlparse(url).path
+    except ValueError:
+        return False
+    return os.path.splitext(unquote(path))[1].lower() in DIRECT_MEDIA_EXTS
+
+def probe_direct_media(url: str) -> Optional[dict]:
+    """Si la URL es un archivo de audio/vídeo servido tal cual, sus datos (sin pasar por yt-dlp)."""
+    if not looks_like_direct_media(url):
+        return None
+    probe = _probe_http(url)
+    if probe is None:
+        return None
+    final_url, headers, size, ranges = probe
+    content_type = (headers.get('Content-Type') or '').split(';')[0].strip().lower()
+    ext = os.path.splitext(unquote(urlparse(final_url).path))[1].lower() or os.path.splitext(urlparse(url).path)[1].lower()
+    if not (content_type.startswith(('video/', 'audio/'))
+            or (content_type in ('application/octet-stream', 'binary/octet-stream') and ext in DIRECT_MEDIA_EXTS)):
+        return None
+    name = os.path.basename(unquote(urlparse(final_url).path)) or f"video{ext}"
+    match = re.search(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', headers.get('Content-Disposition') or '', re.I)
+    if match:
+        name = os.path.basename(unquote(match.group(1)))
+    if os.path.splitext(name)[1].lower() not in DIRECT_MEDIA_EXTS:
+        name += ext
+    return {
+        'url': final_url,
+        'size': size,
+        'ranges': ranges,
+        'content_type': content_type,
+        'ext': os.path.splitext(name)[1].lower(),
+        'filename': yt_dlp.utils.sanitize_filename(name),
+    }
+
+def _direct_event(status, filename, tmpfilename, done, total, started, base):
+    """Evento con la forma de los de yt-dlp: sirve a los mismos progress_hook (ResumeTracker, hook_percent)."""
+    elapsed = max(time.monotonic() - started, 1e-6)
+    speed = (done - base) / elapsed
+    percent = done * 100 / total if total else 0.0
+    return {
+        'status': status,
+        'filename': filename,
+        'tmpfilename': tmpfilename,
+        'downloaded_bytes': done,
+        'total_bytes': total,
+        '_percent_str': f"{percent:.1f}%",
+        'speed': speed,
+        'eta': int((total - done) / speed) if total and speed > 0 else None,
+    }
+
+def download_direct(media: dict, temp_dir: str, progress_hook=None) -> str:
+    """Descarga HTTP por bloques a <archivo>.part y lo renombra al terminar.
+
+    Reanuda desde el tamaño del .part con Range si el servidor responde 206; con 200 empieza de cero.
+    Si el hook lanza DownloadPausedException el .part queda en disco para la siguiente vez.
+    """
+    final_path = os.path.join(temp_dir, media['filename'])
+    part_path = final_path + '.part'
+    total = media.get('size')
+    done = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    started = time.monotonic()
+
+    if not (total and done >= total):
+        headers = dict(COMMON_HEADERS)
+        if done:
+            headers['Range'] = f"bytes={done}-"
+        with requests.get(media['url'], headers=headers, stream=True, timeout=(10, 60)) as r:
+            r.raise_for_status()
+            if done and r.status_code != 206:
+                print(f"[{_ts()}] [DL] El servidor no admite Range; se descarga desde el principio.")
+                done = 0
+            if total is None and (r.headers.get('Content-Length') or '').isdigit():
+                total = done + int(r.headers['Content-Length'])
+            base = done
+            with open(part_path, 'ab' if done else 'wb') as f:
+                for chunk in r.iter_content(chunk_size=DIRECT_CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    done += len(chunk)
+                    if progress_hook is not None:
+                        progress_hook(_direct_event('downloading', final_path, part_path, done, total, started, base))
+        if total and done < total:
+            raise yt_dlp.utils.DownloadError(f"Descarga incompleta ({done} de {total} bytes)")
+
+    os.replace(part_path, final_path)
+    if progress_hook is not None:
+        progress_hook(_direct_event('finished', final_path, part_path, done, total or done, started, done))
+    return final_path
+
+def run_download(job: dict, ydl_opts: dict, progress_hook=None) -> str:
+    """Descarga un trabajo en su carpeta temporal.
+
+    Devuelve la ruta del archivo final, o la carpeta temporal si era una playlist.
+    Si el hook lanza DownloadPausedException, se propaga y los parciales quedan en disco.
+    """
+    temp_dir = job.get('temp_dir')
+    direct = probe_direct_media(job['url'])
+    # Audio en mp3: un vídeo directo sigue necesitando la extracción de yt-dlp
+    if direct and temp_dir and (job.get('job_type') != 'audio' or direct['ext'] == '.mp3'):
+        print(f"[{_ts()}] [DL] Enlace directo ({direct['content_type']}); descarga HTTP sin extractor: {direct['filename']}")
+        final_file = download_direct(direct, temp_dir, progress_hook)
+        if job.get('strip_audio'):
+            strip_audio_track(final_file, ydl_opts.get('ffmpeg_location') or _default_ffmpeg())
+        return final_file
+
+    before = set(os.listdir(temp_dir)) if temp_dir and os.path.isdir(temp_dir) else set()
+    if progress_hook is not None:
+        ydl_opts['progress_hooks'] = [progress_hook]
+    cached = INFO_CACHE.get(job['url'])
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info_dict = None
+        if cached is not None:
+            try:
+                info_dict = ydl.process_ie_result(cached, download=True)
+            except yt_dlp.utils.DownloadError as e:
+                if not _is_expired_error(e):
+                    raise
+                # URLs firmadas caducadas antes de lo anunciado: se re-extrae (los parciales se reaprovechan)
+                print(f"[{_ts()}] [DL] Info en caché caducada; re-extrayendo {job['url']}")
+                INFO_CACHE.discard(job['url'])
+        if info_dict is None:
+            info_dict = ydl.extract_info(job['url'], download=True)
+
+    # ¿Playlist?
+    is_playlist = isinstance(info_dict, dict) and (info_dict.get('_type') == 'playlist' or info_dict.get('entries'))
+    if is_playlist:
+        return temp_dir
+
+    # Detectar archivos creados realmente (soporta postprocesadores: extracción de audio, merge, etc.)
+    after = set(os.listdir(temp_dir)) if temp_dir and os.path.isdir(temp_dir) else set()
+    created = [os.path.join(temp_dir, f) for f in sorted(after - before) if f != RESUME_STATE_FILE]
+    files = [
+        p for p in created
+        if os.path.isfile(p) and not p.endswith(PARTIAL_SUFFIXES)
+    ]
+
+    if files:
+        final_file = files[-1]  # el más reciente creado
+    else:
+        # Fallback a prepare_filename, y si no existe, tomamos cualquier media del dir
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl2:
+            cand_path = ydl2.prepare_filename(info_dict)
+        final_file = cand_path if os.path.exists(cand_path) else ""
+        if not final_file:
+            cands = [os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if os.path.splitext(f)[1].lower() in MEDIA_EXTS]
+            if cands:
+                final_file = max(cands, key=lambda p: os.path.getmtime(p))
+
+    # Si el usuario pidió "solo video" pero el sitio solo ofrece stream combinado, quitamos el audio
+    if job.get('strip_audio') and final_file and os.path.exists(final_file):
+        strip_audio_track(final_file, ydl_opts.get('ffmpeg_location') or _default_ffmpeg())
+
+    return final_file
+
+def _default_ffmpeg() -> str:
+    import imageio_ffmpeg
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+def finalize_download(final_result: str, destination_folder: str, message: str = "Completado"):
+    """Mueve el resultado de run_download a su carpeta de destino y limpia el temporal.
+
+    Devuelve (mensaje_de_estado, ruta_final).
+    """
+    final_path = final_result
+    try:
+        if final_result and os.path.exists(final_result) and os.path.isdir(final_result):
+            temp_job_dir = final_result
+            print(f"[{_ts()}] [MOVE] Playlist detectada. Moviendo archivos desde: {temp_job_dir}")
+            moved = 0
+            for name in os.listdir(temp_job_dir):
+                src = os.path.join(temp_job_dir, name)
+                if os.path.isdir(src): continue
+                if name == RESUME_STATE_FILE or name.endswith(PARTIAL_SUFFIXES): continue
+                try:
+                    dst = _safe_move(src, destination_folder)
+                    print(f"[{_ts()}] [MOVE] -> {dst}"); moved += 1
+                except Exception as e:
+                    print(f"[{_ts()}] [MOVE] Error moviendo '{name}': {e}")
+            try:
+                shutil.rmtree(temp_job_dir, ignore_errors=True)
+                print(f"[{_ts()}] [MOVE] Directorio temporal limpiado: {temp_job_dir}")
+            except Exception as e:
+                print(f"[{_ts()}] [MOVE] Error limpiando dir temporal: {e}")
+
+            final_path = destination_folder
+            if moved == 0:
+                message = "Sin archivos"
+        else:
+            final_filepath = final_result
+            if final_filepath and os.path.exists(final_filepath):
+                try:
+                    final_destination_path = _safe_move(final_filepath, destination_folder)
+                    final_path = final_destination_path
+                    print(f"Archivo movido a: {final_destination_path}")
+                    temp_job_dir = os.path.dirname(final_filepath)
+                    shutil.rmtree(temp_job_dir, ignore_errors=True)
+                    print(f"Directorio temporal limpiado: {temp_job_dir}")
+                except Exception as e:
+                    print(f"Error al mover/limpiar el archivo final: {e}")
+                    message = "Error de guardado"
+    except Exception as e:
+        print(f"[{_ts()}] [MOVE] Error general al finalizar: {e}")
+        message = "Error de guardado"
+    return message, final_path
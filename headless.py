@@ -0,0 +1,189 @@
+# Modo por lotes sin interfaz:  python -m headless urls.txt   (o:  cat urls.txt | python -m headless)
+# Usa el mismo motor que la app (engine.py): mismas reglas de formato (audio / video / ambos,
+# FORMAT_FALLBACK), reanudación de parciales y tope por host. No importa PyQt6.
+# Emite un evento JSON por línea en stdout; los mensajes de diagnóstico van a stderr.
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from engine import (
+    _ts, URL_REGEX, TEMP_DOWNLOADS_DIR, DEFAULT_MAX_PARALLEL_DOWNLOADS, DEFAULT_HOST_CONCURRENCY,
+    HOST_CONCURRENCY_LIMITS, HEADLESS_TEMP_DIRNAME, HostScheduler, build_format_selection,
+    build_download_opts, prepare_job_dir, ResumeTracker, DownloadPausedException, hook_percent,
+    run_download, finalize_download,
+)
+
+MODES = {
+    "both": (True, True),
+    "video": (False, True),
+    "audio": (True, False),
+}
+
+def read_urls(source: str) -> list:
+    """URLs de un archivo (o stdin con '-'), en orden y sin duplicados."""
+    if source == "-":
+        text = sys.stdin.read()
+    else:
+        with open(source, "r", encoding="utf-8", errors="replace") as f:
+            text = f.read()
+    return list(dict.fromkeys(re.findall(URL_REGEX, text)))
+
+def job_id_for(url: str) -> str:
+    # Determinista: relanzar el mismo lote reanuda los parciales de temp_downloads/_cli/<id>
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+
+class EventWriter:
+    """Escribe eventos JSONL de forma atómica desde varios hilos."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def emit(self, event: str, **fields):
+        line = json.dumps({"ts": time.time(), "event": event, **fields}, ensure_ascii=False)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+class BatchRunner:
+    def __init__(self, args, events: EventWriter):
+        self.args = args
+        self.events = events
+        self.stop_event = threading.Event()
+        self.want_audio, self.want_video = MODES[args.mode]
+        self.ffmpeg_path = args.ffmpeg
+        if not self.ffmpeg_path:
+            import imageio_ffmpeg
+            self.ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
+        self.temp_root = os.path.join(args.temp_dir, HEADLESS_TEMP_DIRNAME)
+
+    def run(self, urls) -> int:
+        scheduler = HostScheduler(HOST_CONCURRENCY_LIMITS, self.args.per_host)
+        for url in urls:
+            job = {'id': job_id_for(url), 'url': url}
+            scheduler.push(job)
+            self.events.emit("queued", id=job['id'], url=url, host=job['host'])
+
+        results = Counter()
+        workers = max(1, self.args.workers)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dl") as pool:
+            running = {}
+            while True:
+                while len(running) < workers and not self.stop_event.is_set():
+                    busy = Counter(j['host'] for j in running.values())
+                    job = scheduler.pop_ready(busy)
+                    if job is None:
+                        break
+                    running[pool.submit(self.run_job, job)] = job
+                if not running:
+                    break
+                try:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                except KeyboardInterrupt:
+                    # Ctrl+C: se pausan los activos (parciales conservados) y no se lanza nada más
+                    print(f"[{_ts()}] [CLI] Interrumpido. Pausando descargas activas...", file=sys.stderr)
+                    self.stop_event.set()
+                    continue
+                for fut in done:
+                    running.pop(fut)
+                    results[fut.result()] += 1
+
+        self.events.emit("summary", completed=results["completed"], failed=results["error"],
+                         paused=results["paused"], pending=len(scheduler))
+        return 0 if not (results["error"] or results["paused"] or len(scheduler)) else 1
+
+    def run_job(self, job) -> str:
+        url = job['url']
+        format_selection, job_type = build_format_selection(self.want_audio, self.want_video, self.args.format_id)
+        temp_dir = os.path.join(self.temp_root, job['id'])
+        job.update({'temp_dir': temp_dir, 'job_type': job_type,
+                    'strip_audio': (self.want_video and not self.want_audio)})
+        try:
+            # Sin permisos, disco lleno o estado corrupto: falla este trabajo, no el lote
+            resume_percent = prepare_job_dir(temp_dir, format_selection)
+        except Exception as e:
+            self.events.emit("error", id=job['id'], url=url, error=str(e))
+            return "error"
+        self.events.emit("start", id=job['id'], url=url, format=format_selection,
+                         job_type=job_type, resume_percent=resume_percent)
+
+        tracker = ResumeTracker(job, format_selection)
+        last_emit = [0.0]
+
+        def progress_hook(d):
+            if self.stop_event.is_set():
+                raise DownloadPausedException("Download paused by user.")
+            tracker.track(d)
+            now = time.monotonic()
+            if d.get('status') == 'downloading' and now - last_emit[0] >= self.args.progress_interval:
+                last_emit[0] = now
+                bytes_done, bytes_total, _ = tracker.totals()
+                self.events.emit("progress", id=job['id'], percent=hook_percent(d),
+                                 bytes=bytes_done, total=bytes_total,
+                                 speed=d.get('speed'), eta=d.get('eta'))
+
+        try:
+            ydl_opts = build_download_opts(self.ffmpeg_path, format_selection, job_type, temp_dir)
+            final_result = run_download(job, ydl_opts, progress_hook)
+        except DownloadPausedException:
+            tracker.save()
+            self.events.emit("paused", id=job['id'], url=url, percent=tracker.totals()[2])
+            return "paused"
+        except Exception as e:
+            self.events.emit("error", id=job['id'], url=url, error=str(e))
+            return "error"
+
+        destination = self.args.audio_dir if job_type == 'audio' else self.args.video_dir
+        message, final_path = finalize_download(final_result, destination)
+        if message != "Completado":
+            self.events.emit("error", id=job['id'], url=url, error=message)
+            return "error"
+        self.events.emit("done", id=job['id'], url=url, path=final_path)
+        return "completed"
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m headless",
+        description="Descarga por lotes sin interfaz gráfica. Eventos JSONL por stdout.")
+    parser.add_argument("source", nargs="?", default="-",
+                        help="archivo con URLs (cualquier texto; se extraen los enlaces) o '-' para stdin")
+    parser.add_argument("-m", "--mode", choices=sorted(MODES), default="both",
+                        help="qué descargar: ambos (video con audio), solo video o solo audio (mp3)")
+    parser.add_argument("-f", "--format-id", default=None,
+                        help="format_id de yt-dlp, igual que el combo de resolución (por defecto: mejor calidad)")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_MAX_PARALLEL_DOWNLOADS,
+                        help="descargas simultáneas (por defecto: %(default)s)")
+    parser.add_argument("--per-host", type=int, default=DEFAULT_HOST_CONCURRENCY,
+                        help="tope por dominio sin límite propio (por defecto: %(default)s)")
+    parser.add_argument("--video-dir", default=os.path.join(os.getcwd(), "Video"))
+    parser.add_argument("--audio-dir", default=os.path.join(os.getcwd(), "Audio"))
+    parser.add_argument("--temp-dir", default=TEMP_DOWNLOADS_DIR)
+    parser.add_argument("--ffmpeg", default=None, help="ruta a ffmpeg (por defecto: imageio-ffmpeg)")
+    parser.add_argument("--progress-interval", type=float, default=1.0,
+                        help="segundos mínimos entre eventos 'progress' de un mismo trabajo")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    # stdout queda reservado para el JSONL; cualquier print del motor va a stderr
+    events = EventWriter(sys.stdout)
+    sys.stdout = sys.stderr
+    try:
+        urls = read_urls(args.source)
+    except OSError as e:
+        print(f"[{_ts()}] [CLI] No se pudo leer {args.source}: {e}")
+        return 2
+    if not urls:
+        print(f"[{_ts()}] [CLI] No se encontraron URLs.")
+        return 2
+    return BatchRunner(args, events).run(urls)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,74 +3,57 @@
 # auto-check de actualización, ACL WL/BL exclusivas, specs bonitas, guardia de tamaño 45MB, updater ZIP)
 
 import sys
+import multiprocessing
 import subprocess
 import uuid
-import shutil
-import threading
-from datetime import datetime
+import time
+from collections import Counter, deque
+from itertools import islice
 from typing import Optional
 
 from packaging.version import parse as parse_version
 import telegram
-from telegram.ext import Application, MessageHandler, filters
 
 import re
 import os
-import yt_dlp
 import imageio_ffmpeg
 import ctypes
 import requests
 import asyncio
+import csv
 import json
+import sqlite3
 
-from PyQt6.QtCore import Qt, QSize, QThread, QObject, pyqtSignal, QSettings, QTimer
+from PyQt6.QtCore import (
+    Qt, QSize, QRect, QEvent, QThread, QObject, pyqtSignal, QSettings, QTimer,
+    QAbstractTableModel, QModelIndex,
+)
 from PyQt6.QtGui import QIcon, QFont
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QPushButton, QLabel, QLineEdit, QDialog, QFrame, QTableWidget,
-    QTableWidgetItem, QHeaderView, QCheckBox, QComboBox, QStyle,
-    QProgressBar, QFileDialog, QTabWidget, QInputDialog
+    QPushButton, QLabel, QLineEdit, QDialog, QFrame, QTableWidget, QTableView,
+    QTableWidgetItem, QHeaderView, QCheckBox, QComboBox, QStyle, QStyledItemDelegate,
+    QStyleOptionButton, QStyleOptionComboBox, QStyleOptionProgressBar,
+    QFileDialog, QTabWidget, QInputDialog, QSpinBox
 )
 
-import stat
+from engine import (
+    _ts, _safe_rmtree, URL_REGEX, TEMP_DOWNLOADS_DIR, APP_DATA_DIR, HEADLESS_TEMP_DIRNAME, BOT_TEMP_DIRNAME,
+    DEFAULT_MAX_PARALLEL_DOWNLOADS, MAX_PARALLEL_DOWNLOADS_LIMIT, HOST_CONCURRENCY_LIMITS,
+    DEFAULT_HOST_CONCURRENCY, BEST_QUALITY_ID, maybe_update_ytdlp_async,
+    base_ytdlp_opts, host_key, HostScheduler, _get_height, _filesize_of,
+    build_format_selection, build_download_opts, prepare_job_dir, ResumeTracker,
+    DownloadPausedException, hook_percent, run_download, finalize_download,
+    DIRECT_FORMAT_ID, probe_direct_media, extract_info_cached, canonical_url, INFO_CACHE,
+)
+from telegram_bot import (
+    TelegramBot, bot_settings_from, webhook_settings_from, quota_limits_from, DEFAULT_WEBHOOK_PORT, DEFAULT_WEBHOOK_PATH,
+    DEFAULT_BOT_MAX_CONCURRENT, DEFAULT_BOT_MAX_PER_USER, DEFAULT_BOT_WORKER_PROCESSES,
+    DEFAULT_BOT_MEMORY_BUDGET_MB, MEMORY_TEMP_ROOT, DEFAULT_BOT_MAX_PER_MESSAGE, DEFAULT_BOT_PLAYLIST_MAX,
+)
 
 # ------------------------------ Utilidades ------------------------------
 
-def _ts():
-    return datetime.now().strftime("%H:%M:%S.%f")[:-3]
-
-def _safe_rmtree(path, retries=10, delay=0.2):
-    import time as _t
-    def onerror(func, p, exc_info):
-        try:
-            os.chmod(p, stat.S_IWRITE)
-        except Exception:
-            pass
-        try:
-            func(p)
-        except Exception:
-            pass
-
-    for _ in range(retries):
-        try:
-            if os.path.isdir(path):
-                shutil.rmtree(path, onerror=onerror)
-            return True
-        except (PermissionError, OSError):
-            _t.sleep(delay)
-    return not os.path.isdir(path)
-
-def _safe_move(src_path, dst_dir):
-    os.makedirs(dst_dir, exist_ok=True)
-    base = os.path.basename(src_path)
-    name, ext = os.path.splitext(base)
-    candidate = os.path.join(dst_dir, base)
-    n = 1
-    while os.path.exists(candidate):
-        candidate = os.path.join(dst_dir, f"{name} ({n}){ext}")
-        n += 1
-    return shutil.move(src_path, candidate)
-
 def get_current_version():
     try:
         with open("version.txt", "r") as f:
@@ -84,64 +67,14 @@ def get_current_version():
 APP_VERSION = get_current_version()
 GITHUB_USER = "BitStationBusiness"
 GITHUB_REPO = "BitStation_Multimedia_Downloader"
-URL_REGEX = r'https?://[^\s/$.?#].[^\s]*'
-TEMP_DOWNLOADS_DIR = os.path.join(os.getcwd(), "temp_downloads")
-TELEGRAM_SIZE_LIMIT = 45 * 1024 * 1024  # 45 MB
+JOBS_DB_PATH = os.path.join(APP_DATA_DIR, "jobs.sqlite3")
+RESTORE_BATCH_SIZE = 200  # filas restauradas por ciclo del event loop al arrancar
+IMPORT_FILE_EXTS = ('.txt', '.csv')  # listas de enlaces que se pueden soltar sobre la ventana o pasar con --import
+FORMAT_FETCH_MAX_WORKERS = 4  # extracciones de formatos simultáneas; las filas visibles van primero
+FORMAT_FETCH_DEBOUNCE_MS = 150  # agrupa los eventos de scroll antes de repartir huecos
 AUTOSTART_REG_NAME = "BitStation_TelegramBot_AutoStart"  # NUEVO (no se usa con VBS, se mantiene para compat)
 AUTOSTART_VBS_NAME = "BitStation_TelegramBot_AutoStart.vbs"  # NUEVO
 
-# --- Compatibilidad y headers ---
-COMMON_UA = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-             "(KHTML, like Gecko) Chrome/124.0 Safari/537.36")
-COMMON_HEADERS = {
-    "User-Agent": COMMON_UA,
-    "Accept-Language": "es-ES,es;q=0.9,en;q=0.8",
-}
-
-# Sin forzar 480p
-EXTRACTOR_ARGS = {
-    "facebook": {"locale": ["es_ES"]},
-    "tiktok": {"webpage_url": ["1"]},
-}
-
-# Mejor combinación nativa
-FORMAT_FALLBACK = "bv*+ba/b"
-
-def base_ytdlp_opts(ffmpeg_path: str):
-    return {
-        "ffmpeg_location": ffmpeg_path,
-        "http_headers": COMMON_HEADERS,
-        "extractor_args": EXTRACTOR_ARGS,
-        "retries": 10,
-        "fragment_retries": 10,
-        "concurrent_fragment_downloads": 4,
-        "nocheckcertificate": False,
-        "quiet": True,
-        "no_warnings": True,
-        "merge_output_format": "mp4",
-        "noprogress": True,
-        "geo_bypass": True,
-    }
-
-# --- Actualización en segundo plano de yt-dlp ---
-def maybe_update_ytdlp_async():
-    def _worker():
-        try:
-            print(f"[{_ts()}] [YTDLP] Comprobando actualización de yt-dlp (en segundo plano)...")
-            creation_flags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
-            subprocess.run(
-                [sys.executable, "-m", "pip", "install", "-U", "yt-dlp"],
-                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-                creationflags=creation_flags, check=False, encoding="utf-8"
-            )
-            print(f"[{_ts()}] [YTDLP] Verificación/actualización completada.")
-        except Exception as e:
-            print(f"[{_ts()}] [YTDLP] No se pudo actualizar automáticamente: {e}")
-    threading.Thread(target=_worker, daemon=True).start()
-
-class DownloadPausedException(Exception):
-    pass
-
 def get_system_info():
     info = {"cpu": "No detectado", "ram": "No detectada", "gpu": "No detectada", "cuda": "None"}
     creation_flags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
@@ -216,22 +149,90 @@ def get_system_info():
         print(f"Error al obtener la información del sistema: {e}")
     return info
 
-# ---------------------------- Helpers de formatos ----------------------------
+# ------------------------------ Persistencia ------------------------------
+
+class JobStore:
+    """Cola de descargas persistente (SQLite en modo WAL).
+
+    Guarda lo necesario para reconstruir la tabla y reanudar tras un cierre,
+    cuelgue o reinicio: URL, selección de formato, estado, bytes y carpeta temporal.
+    Solo se usa desde el hilo de la GUI (los workers llegan por señales).
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            uuid             TEXT PRIMARY KEY,
+            position         INTEGER NOT NULL,
+            url              TEXT NOT NULL,
+            download_type    TEXT NOT NULL,
+            format_id        TEXT,
+            format_selection TEXT,
+            job_type         TEXT,
+            state            TEXT NOT NULL DEFAULT 'En cola',
+            percent          INTEGER NOT NULL DEFAULT 0,
+            bytes_done       INTEGER NOT NULL DEFAULT 0,
+            bytes_total      INTEGER,
+            temp_dir         TEXT,
+            final_path       TEXT,
+            error            TEXT,
+            created_at       REAL NOT NULL,
+            updated_at       REAL NOT NULL
+        )
+    """
+    COLUMNS = ('position', 'url', 'download_type', 'format_id', 'format_selection', 'job_type', 'state',
+               'percent', 'bytes_done', 'bytes_total', 'temp_dir', 'final_path', 'error')
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(self.SCHEMA)
+
+    def add(self, job_uuid, url, download_type, temp_dir):
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO jobs (uuid, position, url, download_type, temp_dir, created_at, updated_at) "
+            "VALUES (?, (SELECT COALESCE(MAX(position), -1) + 1 FROM jobs), ?, ?, ?, ?, ?)",
+            (job_uuid, url, download_type, temp_dir, now, now))
+
+    def add_many(self, jobs):
+        """Alta en bloque de (uuid, url, download_type, temp_dir) en una sola transacción."""
+        now = time.time()
+        with self.conn:
+            self.conn.execute("BEGIN")
+            base = self.conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM jobs").fetchone()[0]
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO jobs (uuid, position, url, download_type, temp_dir, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(job_uuid, base + i, url, download_type, temp_dir, now, now)
+                 for i, (job_uuid, url, download_type, temp_dir) in enumerate(jobs)])
+
+    def update(self, job_uuid, **fields):
+        fields = {k: v for k, v in fields.items() if k in self.COLUMNS}
+        if not fields:
+            return
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        self.conn.execute(f"UPDATE jobs SET {assignments}, updated_at = ? WHERE uuid = ?",
+                          (*fields.values(), time.time(), job_uuid))
+
+    def checkpoint(self, job_uuid, bytes_done, bytes_total, percent):
+        self.update(job_uuid, bytes_done=int(bytes_done), bytes_total=bytes_total, percent=int(percent))
 
-_height_regex = re.compile(r'(?:(\d+)\s*[pP])|(?:\d+\s*[xX]\s*(\d+))')
+    def delete(self, job_uuid):
+        self.conn.execute("DELETE FROM jobs WHERE uuid = ?", (job_uuid,))
 
-def _get_height(fmt: dict) -> Optional[int]:
-    h = fmt.get('height')
-    if isinstance(h, int) and h > 0:
-        return h
-    res = fmt.get('resolution') or fmt.get('format_note') or ""
-    m = _height_regex.search(str(res))
-    if m:
-        return int(m.group(1) or m.group(2))
-    return None
+    def load(self) -> list:
+        return [dict(r) for r in self.conn.execute("SELECT * FROM jobs ORDER BY position")]
 
-def _filesize_of(fmt: dict) -> Optional[int]:
-    return fmt.get('filesize') or fmt.get('filesize_approx')
+    def unfinished_uuids(self) -> set:
+        return {r[0] for r in self.conn.execute("SELECT uuid FROM jobs WHERE state != 'Completado'")}
+
+    def close(self):
+        try:
+            self.conn.close()
+        except sqlite3.Error:
+            pass
 
 # ---------------------------- Workers --------------------------------
 
@@ -254,97 +255,50 @@ class UpdateCheckerWorker(QObject):
         self.update_check_finished.emit(update_info)
 
 class FormatFetcherWorker(QObject):
-    formats_fetched = pyqtSignal(int, list)
-    error = pyqtSignal(int, str)
+    formats_fetched = pyqtSignal(str, list)  # uuid del trabajo, formatos
+    error = pyqtSignal(str, str)
     finished = pyqtSignal()
-    def __init__(self, row, url, ydl_opts):
+    def __init__(self, job_uuid, url, ydl_opts):
         super().__init__()
-        self.row, self.url, self.ydl_opts = row, url, ydl_opts
+        self.job_uuid, self.url, self.ydl_opts = job_uuid, url, ydl_opts
+        self.cancelled = False  # fila borrada: yt-dlp no se puede interrumpir, se descarta el resultado
     def run(self):
         try:
-            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
-                info_dict = ydl.extract_info(self.url, download=False)
-            self.formats_fetched.emit(self.row, info_dict.get('formats', []))
+            # Enlace directo a un archivo: basta la petición HEAD, no hay nada que extraer
+            direct = probe_direct_media(self.url)
+            if direct:
+                formats = [{'format_id': DIRECT_FORMAT_ID, 'ext': direct['ext'].lstrip('.'),
+                            'filesize': direct['size'], 'direct': True}]
+            else:
+                formats = extract_info_cached(self.url, self.ydl_opts).get('formats', [])
+            if not self.cancelled:
+                self.formats_fetched.emit(self.job_uuid, formats)
         except Exception as e:
-            self.error.emit(self.row, str(e))
+            if not self.cancelled:
+                self.error.emit(self.job_uuid, str(e))
         finally:
             self.finished.emit()
 
 class DownloadWorker(QObject):
     finished = pyqtSignal(dict, str, str)
-    progress = pyqtSignal(int, int)
+    progress = pyqtSignal(str, int)  # uuid, porcentaje
     error = pyqtSignal(dict, str)
     paused = pyqtSignal(dict)
+    checkpoint = pyqtSignal(str, object, object, int)  # uuid, bytes_done, bytes_total, percent
     def __init__(self, job, options):
         super().__init__()
         self.job, self.ydl_opts = job, options
         self.is_running = True
+        self.tracker = ResumeTracker(job, options.get('format'))
 
     def run(self):
-        final_result = ""
-        temp_dir = self.job.get('temp_dir')
-        before = set(os.listdir(temp_dir)) if temp_dir and os.path.isdir(temp_dir) else set()
         try:
-            self.ydl_opts['progress_hooks'] = [self.progress_hook]
-            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
-                info_dict = ydl.extract_info(self.job['url'], download=True)
-
-            # ¿Playlist?
-            is_playlist = isinstance(info_dict, dict) and (info_dict.get('_type') == 'playlist' or info_dict.get('entries'))
-            if is_playlist:
-                final_result = temp_dir
-            else:
-                # Detectar archivos creados realmente (soporta postprocesadores: extracción de audio, merge, etc.)
-                after = set(os.listdir(temp_dir)) if temp_dir and os.path.isdir(temp_dir) else set()
-                created = [os.path.join(temp_dir, f) for f in sorted(after - before)]
-                files = [
-                    p for p in created
-                    if os.path.isfile(p) and not p.endswith(('.part', '.ytdl', '.temp', '.tmp'))
-                ]
-
-                if files:
-                    final_file = files[-1]  # el más reciente creado
-                else:
-                    # Fallback a prepare_filename, y si no existe, tomamos cualquier media del dir
-                    with yt_dlp.YoutubeDL(self.ydl_opts) as ydl2:
-                        cand_path = ydl2.prepare_filename(info_dict)
-                    final_file = cand_path if os.path.exists(cand_path) else ""
-                    if not final_file:
-                        media_exts = {'.mp3','.m4a','.aac','.opus','.wav','.flac','.mp4','.mkv','.webm','.mov','.ts','.m4v'}
-                        cands = [os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if os.path.splitext(f)[1].lower() in media_exts]
-                        if cands:
-                            final_file = max(cands, key=lambda p: os.path.getmtime(p))
-
-                # Si el usuario pidió "solo video" pero el sitio solo ofrece stream combinado, quitamos el audio
-                if self.job.get('strip_audio') and final_file and os.path.exists(final_file):
-                    try:
-                        ffmpeg_path = self.ydl_opts.get('ffmpeg_location') or imageio_ffmpeg.get_ffmpeg_exe()
-                        base, ext = os.path.splitext(final_file)
-                        tmp_out = base + ".__noaudio__" + ext
-                        creation_flags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
-                        subprocess.run(
-                            [ffmpeg_path, '-y', '-i', final_file, '-c', 'copy', '-an', tmp_out],
-                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-                            check=False, creationflags=creation_flags
-                        )
-                        if os.path.exists(tmp_out) and os.path.getsize(tmp_out) > 0:
-                            try:
-                                os.replace(tmp_out, final_file)
-                            except Exception:
-                                shutil.move(tmp_out, final_file)
-                        else:
-                            if os.path.exists(tmp_out):
-                                try: os.remove(tmp_out)
-                                except Exception: pass
-                    except Exception as e:
-                        print(f"[{_ts()}] [DL] No se pudo eliminar audio: {e}")
-
-                final_result = final_file
-
+            final_result = run_download(self.job, self.ydl_opts, self.progress_hook)
             if self.is_running:
                 self.finished.emit(self.job, "Completado", final_result)
 
         except DownloadPausedException:
+            self.save_checkpoint()
             self.paused.emit(self.job)
         except Exception as e:
             if self.is_running:
@@ -354,15 +308,20 @@ class DownloadWorker(QObject):
     def progress_hook(self, d):
         if not self.is_running:
             raise DownloadPausedException("Download paused by user.")
+        if self.tracker.track(d):
+            self.emit_checkpoint()
         if d['status'] == 'downloading':
-            percent_str = d.get('_percent_str', '0.0%').strip()
-            ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-            percent_str = ansi_escape.sub('', percent_str)
-            try:
-                percent = int(float(percent_str.strip('%')))
-                self.progress.emit(self.job['row'], percent)
-            except (ValueError, TypeError):
-                pass
+            percent = hook_percent(d)
+            if percent is not None:
+                self.progress.emit(self.job['uuid'], percent)
+
+    def save_checkpoint(self):
+        self.tracker.save()
+        self.emit_checkpoint()
+
+    def emit_checkpoint(self):
+        bytes_done, bytes_total, percent = self.tracker.totals()
+        self.checkpoint.emit(self.job.get('uuid', ""), bytes_done, bytes_total, percent)
 
     def stop(self):
         self.is_running = False
@@ -394,348 +353,31 @@ class ApiValidatorWorker(QObject):
 # --------------------- Telegram Bot Worker (ciclo de vida robusto) ---------------------
 
 class TelegramBotWorker(QObject):
+    """Envoltorio Qt de TelegramBot (telegram_bot.py) para alojarlo en un QThread de la GUI."""
     finished = pyqtSignal()
-    def __init__(self, token, whitelist, blacklist, whitelist_enabled, blacklist_enabled, ffmpeg_path, dest_video_path):
+    def __init__(self, *args, **kwargs):
         super().__init__()
-        self.token = token
-        self.whitelist = [str(x) for x in whitelist]
-        self.blacklist = [str(x) for x in blacklist]
-        self.whitelist_enabled = whitelist_enabled
-        self.blacklist_enabled = blacklist_enabled
-        self.ffmpeg_path = ffmpeg_path
-        self.dest_video_path = dest_video_path  # compat
-        self.application = None
-        self.is_running = True
-        self.loop = None
-        self.stop_event = None
-
-        # estado de guardia de tamaño
-        self._dl_files = {}  # filename -> {'downloaded': int, 'total': Optional[int]}
-
-    # ----- utilidades específicas del bot -----
-    def _topic_kwargs(self, update):
-        try:
-            tid = getattr(update.message, "message_thread_id", None)
-        except Exception:
-            tid = None
-        return {"message_thread_id": tid} if tid else {}
-
-    def _is_playlist(self, url: str) -> bool:
-        lower = url.lower()
-        if "playlist?" in lower or "list=" in lower:
-            return True
-        ydl_opts = base_ytdlp_opts(self.ffmpeg_path) | {"extract_flat": "in_playlist"}
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-            if isinstance(info, dict) and (info.get("_type") == "playlist" or info.get("entries")):
-                return True
-        except Exception:
-            pass
-        return False
-
-    def _head_content_length(self, url: str) -> Optional[int]:
-        try:
-            r = requests.head(url, headers=COMMON_HEADERS, allow_redirects=True, timeout=8)
-            cl = r.headers.get('Content-Length') or r.headers.get('content-length')
-            if cl and cl.isdigit():
-                return int(cl)
-        except Exception:
-            pass
-        try:
-            r = requests.get(url, headers={**COMMON_HEADERS, "Range": "bytes=0-0"}, stream=True, timeout=8)
-            cr = r.headers.get('Content-Range') or r.headers.get('content-range')
-            if cr and '/' in cr:
-                total = cr.split('/')[-1]
-                if total.isdigit():
-                    return int(total)
-        except Exception:
-            pass
-        return None
-
-    def _estimate_download_size(self, url):
-        ydl_opts = base_ytdlp_opts(self.ffmpeg_path) | {
-            'format': FORMAT_FALLBACK,
-            'skip_download': True,
-            'noplaylist': True
-        }
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-
-            if 'requested_formats' in info and info['requested_formats']:
-                total = 0
-                for f in info['requested_formats']:
-                    size = f.get('filesize') or f.get('filesize_approx')
-                    if not size:
-                        f_url = f.get('url')
-                        if f_url:
-                            size = self._head_content_length(f_url)
-                    if size:
-                        total += int(size)
-                    else:
-                        return None
-                return total or None
-
-            size = info.get('filesize') or info.get('filesize_approx')
-            if not size:
-                i_url = info.get('url')
-                if i_url:
-                    size = self._head_content_length(i_url)
-            return int(size) if size else None
-
-        except Exception:
-            return None
-
-    def _progress_hook_guard(self, d):
-        if not self.is_running:
-            raise yt_dlp.utils.DownloadError("Detenido por el usuario/bot desactivado")
-
-        if d.get('status') != 'downloading':
-            return
-
-        fn = d.get('filename') or ""
-        downloaded = int(d.get('downloaded_bytes') or 0)
-        total = d.get('total_bytes') or d.get('total_bytes_estimate') or None
-
-        self._dl_files[fn] = {'downloaded': downloaded, 'total': int(total) if total else None}
-
-        sum_downloaded = sum(v['downloaded'] for v in self._dl_files.values())
-        sum_totals_known = sum(v['total'] for v in self._dl_files.values() if v['total'] is not None)
-
-        if sum_totals_known and sum_totals_known > TELEGRAM_SIZE_LIMIT:
-            raise yt_dlp.utils.DownloadError("El archivo final supera 45MB (estimado)")
-        if sum_downloaded > TELEGRAM_SIZE_LIMIT:
-            raise yt_dlp.utils.DownloadError("El archivo final supera 45MB durante la descarga")
-
-    def _download_video_blocking(self, url, temp_dir):
-        os.makedirs(temp_dir, exist_ok=True)
-        before = set(os.listdir(temp_dir))
-
-        self._dl_files = {}
-
-        ydl_opts = base_ytdlp_opts(self.ffmpeg_path) | {
-            'format': FORMAT_FALLBACK,
-            'outtmpl': os.path.join(temp_dir, '%(title)s - %(id)s.%(ext)s'),
-            'progress_hooks': [self._progress_hook_guard],
-            'noplaylist': True
-        }
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                _ = ydl.extract_info(url, download=True)
-        except yt_dlp.utils.DownloadError as e:
-            msg = str(e)
-            if ("Requested format is not available" in msg) or ("not available" in msg and "format" in msg.lower()):
-                retry_opts = base_ytdlp_opts(self.ffmpeg_path) | {
-                    'format': 'b',
-                    'outtmpl': os.path.join(temp_dir, '%(title)s - %(id)s.%(ext)s'),
-                    'progress_hooks': [self._progress_hook_guard],
-                    'noplaylist': True
-                }
-                with yt_dlp.YoutubeDL(retry_opts) as ydl:
-                    _ = ydl.extract_info(url, download=True)
-            else:
-                raise
-
-        after = set(os.listdir(temp_dir))
-        created = [os.path.join(temp_dir, f) for f in sorted(after - before)]
-        final_files = [p for p in created if os.path.isfile(p) and not p.endswith(('.part', '.ytdl', '.temp'))]
-        return final_files
-
-    # ------------------------------------------
+        self.bot = TelegramBot(*args, **kwargs)
 
     def run(self):
-        """Hilo dedicado con su propio event loop y parada graceful (sin run_polling)."""
-        self.loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(self.loop)
-
-        async def lifecycle():
-            try:
-                self.stop_event = asyncio.Event()
-                self.application = Application.builder().token(self.token).build()
-                self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
-
-                # init + start + polling manual
-                await self.application.initialize()
-                await self.application.start()
-                await self.application.updater.start_polling()
-
-                # esperar señal de stop
-                await self.stop_event.wait()
-
-                # detener ordenadamente
-                await self.application.updater.stop()
-                await self.application.stop()
-                await self.application.shutdown()
-            except Exception as e:
-                print(f"[{_ts()}] [ERROR Telegram lifecycle] {e}")
-
         try:
-            self.loop.run_until_complete(lifecycle())
+            self.bot.run()
         finally:
-            try:
-                pending = [t for t in asyncio.all_tasks(loop=self.loop) if not t.done()]
-                for t in pending:
-                    t.cancel()
-                if pending:
-                    self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
-            except Exception:
-                pass
-            try:
-                self.loop.run_until_complete(self.loop.shutdown_asyncgens())
-            except Exception:
-                pass
-            try:
-                if not self.loop.is_closed():
-                    self.loop.close()
-            except Exception:
-                pass
-            print(f"[{_ts()}] [BOT] Loop cerrado. run() termina.")
             self.finished.emit()
 
-    async def handle_message(self, update, context):
-        if not self.is_running:
-            return
-
-        chat = update.effective_chat
-        msg  = update.effective_message
-        user = update.effective_user
-
-        chat_id   = chat.id
-        thread_id = getattr(msg, "message_thread_id", None)
-        text      = msg.text or ""
-
-        print(f"[{_ts()}] [BOT] Incoming text chat_id={chat_id} type={chat.type} thread_id={thread_id} user_id={user.id}")
-        print(f"[{_ts()}] [BOT] ACL estado: WL={self.whitelist_enabled} BL={self.blacklist_enabled}")
-        print(f"[{_ts()}] [BOT] ACL membership: in_WL={str(user.id) in self.whitelist} in_BL={str(user.id) in self.blacklist}")
-
-        if self.whitelist_enabled:
-            if str(user.id) not in self.whitelist:
-                await context.bot.send_message(chat_id, "❌ No tienes permiso para usar este bot.", **self._topic_kwargs(update))
-                return
-        elif self.blacklist_enabled:
-            if str(user.id) in self.blacklist:
-                await context.bot.send_message(chat_id, "❌ Tienes el acceso restringido.", **self._topic_kwargs(update))
-                return
+    @property
+    def is_running(self):
+        return self.bot.is_running
 
-        urls = re.findall(URL_REGEX, text)
-        if not urls:
-            print(f"[{_ts()}] [BOT] No se detectaron URLs en el mensaje.")
-            return
-        url = urls[0]
-
-        is_playlist = await asyncio.to_thread(self._is_playlist, url)
-        if is_playlist:
-            print(f"[{_ts()}] [BOT] Playlist detectada. Rechazando (versión gratuita).")
-            await context.bot.send_message(
-                chat_id,
-                "⚠️ *Playlists no disponibles en el bot de Telegram (versión gratuita).* "
-                "Descarga playlists desde la *app de Windows*. Envíame un enlace de un solo video.",
-                parse_mode="Markdown",
-                **self._topic_kwargs(update),
-            )
-            return
-
-        # === Estimación previa ===
-        est_bytes = await asyncio.to_thread(self._estimate_download_size, url)
-        if est_bytes is not None:
-            if est_bytes > TELEGRAM_SIZE_LIMIT:
-                est_mb = est_bytes / (1024*1024)
-                print(f"[{_ts()}] [BOT] Rechazado (~{est_mb:.1f}MB > 45MB) chat_id={chat_id} thread_id={thread_id}")
-                await context.bot.send_message(
-                    chat_id,
-                    f"⛔ El video pesa ~{est_mb:.1f} MB, supera el límite de 45 MB. No se descargará.",
-                    **self._topic_kwargs(update),
-                )
-                return
-        else:
-            await context.bot.send_message(
-                chat_id,
-                "ℹ️ No pude estimar el tamaño previamente; intentaré descargar y cancelaré si supera 45 MB.",
-                **self._topic_kwargs(update),
-            )
+    def set_limits(self, max_concurrent, max_per_user, memory_budget_mb=None, max_per_message=None,
+                   playlist_max_entries=None):
+        self.bot.set_limits(max_concurrent, max_per_user, memory_budget_mb, max_per_message, playlist_max_entries)
 
-        print(f"[{_ts()}] [BOT] Aceptado. Iniciando descarga chat_id={chat_id} thread_id={thread_id}")
-
-        tg_temp_dir = os.path.join(TEMP_DOWNLOADS_DIR, "_tg", uuid.uuid4().hex)
-        await context.bot.send_message(chat_id, "✅ Link recibido. Descargando…", **self._topic_kwargs(update))
-
-        filepaths = []
-        try:
-            filepaths = await asyncio.to_thread(self._download_video_blocking, url, tg_temp_dir)
-
-            if not self.is_running:
-                print(f"[{_ts()}] [BOT] Bot desactivado durante descarga. Abortando envío.")
-                return
-
-            if not filepaths:
-                await context.bot.send_message(
-                    chat_id, "😕 No se generó ningún archivo final (posible error o excede 45MB).",
-                    **self._topic_kwargs(update),
-                )
-                return
-
-            path = filepaths[0]
-            if os.path.getsize(path) > TELEGRAM_SIZE_LIMIT:
-                await context.bot.send_message(
-                    chat_id, "⛔ El archivo final supera 45MB. No puedo enviarlo por Telegram.",
-                    **self._topic_kwargs(update),
-                )
-                return
-
-            print(f"[{_ts()}] [BOT] Enviando video chat_id={chat_id} thread_id={thread_id}")
-            with open(path, 'rb') as video_file:
-                await context.bot.send_video(chat_id, video=video_file, supports_streaming=True, **self._topic_kwargs(update))
-
-        except yt_dlp.utils.DownloadError as e:
-            msg_err = str(e)
-            print(f"[{_ts()}] [BOT] DownloadError: {msg_err}")
-            if "45MB" in msg_err or "45mb" in msg_err or "supera 45MB" in msg_err.lower():
-                await context.bot.send_message(
-                    chat_id,
-                    "⛔ El archivo final supera 45 MB. No puedo enviarlo por Telegram.",
-                    **self._topic_kwargs(update),
-                )
-            elif ("facebook" in msg_err.lower() or "facebook" in url.lower()) and "Cannot parse data" in msg_err:
-                await context.bot.send_message(
-                    chat_id,
-                    "😕 Facebook devolvió una página que requiere inicio de sesión o no es pública. "
-                    "Prueba con un enlace público (p. ej. fb.watch/… o /videos/…) "
-                    "o descárgalo desde la app de Windows.",
-                    **self._topic_kwargs(update),
-                )
-            else:
-                await context.bot.send_message(
-                    chat_id,
-                    "😕 Error del extractor. Probé máxima compatibilidad.\n"
-                    "Si persiste, actualiza yt-dlp y vuelve a intentar.",
-                    **self._topic_kwargs(update),
-                )
-        except Exception as e:
-            print(f"[{_ts()}] [BOT] Error general en handle_message: {e}")
-            await context.bot.send_message(chat_id, f"😕 Error al procesar: {str(e)[:1000]}", **self._topic_kwargs(update))
-        finally:
-            try:
-                _safe_rmtree(tg_temp_dir)
-                print(f"[{_ts()}] [BOT] Limpieza temporal Telegram -> {tg_temp_dir}")
-            except Exception as e:
-                print(f"[{_ts()}] [BOT] Error limpiando temporales Telegram: {e}")
+    def set_quotas(self, limits):
+        self.bot.set_quotas(limits)
 
     def stop(self):
-        """Parada robusta: detiene polling y ciclo, y libera el hilo siempre."""
-        print(f"[BOT WORKER] Stop requested.")
-        self.is_running = False
-        try:
-            if self.loop and not self.loop.is_closed():
-                # Señales explícitas para salir rápido
-                if self.stop_event is not None:
-                    self.loop.call_soon_threadsafe(self.stop_event.set)
-                if self.application:
-                    asyncio.run_coroutine_threadsafe(self.application.updater.stop(), self.loop)
-                    asyncio.run_coroutine_threadsafe(self.application.stop(), self.loop)
-                    asyncio.run_coroutine_threadsafe(self.application.shutdown(), self.loop)
-        except Exception as e:
-            print(f"[BOT WORKER] stop error: {e}")
+        self.bot.stop()
 
 # ------------------------------ GUI -----------------------------------
 
@@ -804,6 +446,46 @@ class SettingsWindow(QDialog):
         layout.addWidget(self.audio_path_display)
         layout.addWidget(audio_folder_button)
 
+        # Número de descargas simultáneas del planificador
+        layout.addSpacing(20)
+        parallel_layout = QHBoxLayout()
+        parallel_label = QLabel("Descargas simultáneas:")
+        self.parallel_spin = QSpinBox()
+        self.parallel_spin.setRange(1, MAX_PARALLEL_DOWNLOADS_LIMIT)
+        self.parallel_spin.setValue(self.main_window.max_parallel_downloads)
+        self.parallel_spin.valueChanged.connect(self.main_window.set_max_parallel_downloads)
+        parallel_layout.addWidget(parallel_label)
+        parallel_layout.addWidget(self.parallel_spin)
+        parallel_layout.addSpacing(15)
+        per_host_label = QLabel("Máx. por sitio:")
+        self.per_host_spin = QSpinBox()
+        self.per_host_spin.setRange(1, MAX_PARALLEL_DOWNLOADS_LIMIT)
+        self.per_host_spin.setValue(self.main_window.download_queue.default_limit)
+        self.per_host_spin.valueChanged.connect(self.main_window.set_default_host_limit)
+        parallel_layout.addWidget(per_host_label)
+        parallel_layout.addWidget(self.per_host_spin)
+        parallel_layout.addStretch()
+        layout.addLayout(parallel_layout)
+
+        # Topes específicos por dominio (youtube.com, tiktok.com, ...)
+        host_header_layout = QHBoxLayout()
+        host_header_layout.addWidget(QLabel("Límites por dominio:"))
+        host_header_layout.addStretch()
+        add_host_button = QPushButton("+"); remove_host_button = QPushButton("-")
+        add_host_button.setFixedSize(25, 25); remove_host_button.setFixedSize(25, 25)
+        add_host_button.clicked.connect(self.add_host_limit)
+        remove_host_button.clicked.connect(self.remove_host_limit)
+        host_header_layout.addWidget(add_host_button); host_header_layout.addWidget(remove_host_button)
+        layout.addLayout(host_header_layout)
+        self.host_limits_table = QTableWidget(0, 2)
+        self.host_limits_table.setHorizontalHeaderLabels(["Dominio", "Máx."])
+        self.host_limits_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.host_limits_table.setMaximumHeight(120)
+        for host, limit in sorted(self.main_window.download_queue.limits.items()):
+            self._append_host_limit_row(host, limit)
+        self.host_limits_table.itemChanged.connect(self.save_host_limits)
+        layout.addWidget(self.host_limits_table)
+
         separator = QFrame(); separator.setFrameShape(QFrame.Shape.HLine); separator.setFrameShadow(QFrame.Shadow.Sunken)
         layout.addSpacing(12); layout.addWidget(separator); layout.addSpacing(10)
 
@@ -901,6 +583,40 @@ class SettingsWindow(QDialog):
         api_layout.addWidget(self.api_status_label)
         layout.addWidget(self.telegram_api_group)
 
+        # Servidor Bot API propio (telegram-bot-api --local en este equipo): hasta 2 GB, subida por ruta
+        local_api_layout = QHBoxLayout()
+        local_api_layout.addWidget(QLabel("Servidor Bot API local:"))
+        self.local_api_input = QLineEdit()
+        self.local_api_input.setPlaceholderText("http://localhost:8081  (vacío = api.telegram.org, 45 MB)")
+        self.local_api_input.setToolTip("Servidor telegram-bot-api en modo --local en este mismo equipo.\n"
+                                        "Permite enviar archivos de hasta 2 GB leyéndolos directamente del disco.")
+        self.local_api_input.editingFinished.connect(self.save_local_api_url)
+        local_api_layout.addWidget(self.local_api_input)
+        layout.addLayout(local_api_layout)
+
+        # Webhook: Telegram empuja los updates a un receptor propio (detrás de un proxy HTTPS)
+        self.webhook_cb = QCheckBox("Modo webhook (en lugar de polling)")
+        layout.addWidget(self.webhook_cb)
+        self.webhook_group = QWidget()
+        webhook_layout = QHBoxLayout(self.webhook_group)
+        webhook_layout.setContentsMargins(0, 0, 0, 0)
+        self.webhook_url_input = QLineEdit()
+        self.webhook_url_input.setPlaceholderText("URL pública HTTPS, p. ej. https://midominio/telegram")
+        self.webhook_port_spin = QSpinBox()
+        self.webhook_port_spin.setRange(1, 65535)
+        self.webhook_path_input = QLineEdit()
+        self.webhook_path_input.setFixedWidth(110)
+        self.webhook_secret_input = QLineEdit()
+        self.webhook_secret_input.setEchoMode(QLineEdit.EchoMode.Password)
+        self.webhook_secret_input.setPlaceholderText("secreto (auto)")
+        webhook_layout.addWidget(self.webhook_url_input)
+        webhook_layout.addWidget(QLabel("Puerto:"))
+        webhook_layout.addWidget(self.webhook_port_spin)
+        webhook_layout.addWidget(QLabel("Ruta:"))
+        webhook_layout.addWidget(self.webhook_path_input)
+        webhook_layout.addWidget(self.webhook_secret_input)
+        layout.addWidget(self.webhook_group)
+
         separator = QFrame(); separator.setFrameShape(QFrame.Shape.HLine); separator.setFrameShadow(QFrame.Shadow.Sunken)
         layout.addWidget(separator)
 
@@ -909,6 +625,71 @@ class SettingsWindow(QDialog):
         self.autostart_cb.stateChanged.connect(self.on_autostart_toggled)
         layout.addWidget(self.autostart_cb)
 
+        # Descargas simultáneas del bot (el resto espera en cola FIFO)
+        bot_limits_layout = QHBoxLayout()
+        bot_limits_layout.addWidget(QLabel("Descargas simultáneas:"))
+        self.bot_concurrent_spin = QSpinBox()
+        self.bot_concurrent_spin.setRange(1, MAX_PARALLEL_DOWNLOADS_LIMIT)
+        bot_limits_layout.addWidget(self.bot_concurrent_spin)
+        bot_limits_layout.addSpacing(15)
+        bot_limits_layout.addWidget(QLabel("Por usuario:"))
+        self.bot_per_user_spin = QSpinBox()
+        self.bot_per_user_spin.setRange(1, MAX_PARALLEL_DOWNLOADS_LIMIT)
+        bot_limits_layout.addWidget(self.bot_per_user_spin)
+        bot_limits_layout.addSpacing(15)
+        bot_limits_layout.addWidget(QLabel("Procesos:"))
+        self.bot_workers_spin = QSpinBox()
+        self.bot_workers_spin.setRange(0, MAX_PARALLEL_DOWNLOADS_LIMIT)
+        self.bot_workers_spin.setSpecialValueText("Hilos")
+        self.bot_workers_spin.setToolTip("Procesos de descarga del bot (0 = hilos en el mismo proceso). "
+                                         "Se aplica reiniciando el bot.")
+        bot_limits_layout.addWidget(self.bot_workers_spin)
+        bot_limits_layout.addSpacing(15)
+        bot_limits_layout.addWidget(QLabel("RAM clips (MB):"))
+        self.bot_memory_spin = QSpinBox()
+        self.bot_memory_spin.setRange(0, 4096)
+        self.bot_memory_spin.setSingleStep(32)
+        self.bot_memory_spin.setSpecialValueText("No")
+        self.bot_memory_spin.setToolTip("Memoria para bajar y enviar clips pequeños sin escribir en disco "
+                                        "(0 = desactivado). Requiere tmpfs (/dev/shm).")
+        self.bot_memory_spin.setEnabled(MEMORY_TEMP_ROOT is not None)
+        bot_limits_layout.addWidget(self.bot_memory_spin)
+        bot_limits_layout.addStretch()
+        layout.addLayout(bot_limits_layout)
+
+        # Mensajes con varios enlaces y playlists (se envían en grupos de hasta 10 vídeos)
+        bot_batch_layout = QHBoxLayout()
+        bot_batch_layout.addWidget(QLabel("Enlaces a la vez por mensaje:"))
+        self.bot_per_message_spin = QSpinBox()
+        self.bot_per_message_spin.setRange(1, MAX_PARALLEL_DOWNLOADS_LIMIT)
+        bot_batch_layout.addWidget(self.bot_per_message_spin)
+        bot_batch_layout.addSpacing(15)
+        bot_batch_layout.addWidget(QLabel("Vídeos por playlist:"))
+        self.bot_playlist_spin = QSpinBox()
+        self.bot_playlist_spin.setRange(1, 100)
+        bot_batch_layout.addWidget(self.bot_playlist_spin)
+        bot_batch_layout.addStretch()
+        layout.addLayout(bot_batch_layout)
+
+        # Cuotas (0 = sin límite); se recuperan de forma continua y se conservan entre reinicios
+        quota_layout = QHBoxLayout()
+        self.quota_spins = {}
+        for key, label, maximum in (
+            ("telegram/quota_user_requests_per_min", "Cuota por usuario: peticiones/min", 1000),
+            ("telegram/quota_user_mb_per_day", "MB/día", 1_000_000),
+            ("telegram/quota_chat_requests_per_min", "Por chat: peticiones/min", 1000),
+            ("telegram/quota_chat_mb_per_day", "MB/día", 1_000_000),
+        ):
+            spin = QSpinBox()
+            spin.setRange(0, maximum)
+            spin.setSpecialValueText("∞")
+            quota_layout.addWidget(QLabel(label + ":"))
+            quota_layout.addWidget(spin)
+            quota_layout.addSpacing(10)
+            self.quota_spins[key] = spin
+        quota_layout.addStretch()
+        layout.addLayout(quota_layout)
+
         lists_layout = QHBoxLayout()
         # Whitelist
         whitelist_group = QVBoxLayout()
@@ -982,6 +763,45 @@ class SettingsWindow(QDialog):
         except Exception as e:
             print(f"[AUTOSTART] Error al aplicar autostart: {e}")
 
+    # --- Límites de concurrencia por dominio ---
+    def _append_host_limit_row(self, host, limit):
+        row_count = self.host_limits_table.rowCount()
+        self.host_limits_table.insertRow(row_count)
+        self.host_limits_table.setItem(row_count, 0, QTableWidgetItem(host))
+        self.host_limits_table.setItem(row_count, 1, QTableWidgetItem(str(limit)))
+
+    def add_host_limit(self):
+        text, ok = QInputDialog.getText(self, "Añadir dominio", "Dominio o URL (p. ej. vimeo.com):")
+        if not ok or not text.strip():
+            return
+        text = text.strip()
+        host = host_key(text if "://" in text else f"https://{text}")
+        if not host:
+            return
+        self.host_limits_table.blockSignals(True)
+        self._append_host_limit_row(host, self.main_window.download_queue.default_limit)
+        self.host_limits_table.blockSignals(False)
+        self.save_host_limits()
+
+    def remove_host_limit(self):
+        selected_rows = self.host_limits_table.selectionModel().selectedRows()
+        for index in sorted(selected_rows, key=lambda i: i.row(), reverse=True):
+            self.host_limits_table.removeRow(index.row())
+        self.save_host_limits()
+
+    def save_host_limits(self, *_):
+        limits = {}
+        for row in range(self.host_limits_table.rowCount()):
+            host_item = self.host_limits_table.item(row, 0)
+            limit_item = self.host_limits_table.item(row, 1)
+            if not host_item or not limit_item or not host_item.text().strip():
+                continue
+            try:
+                limits[host_item.text().strip().lower()] = max(1, int(limit_item.text()))
+            except ValueError:
+                continue
+        self.main_window.set_host_limits(limits)
+
     def add_id_to_list(self, table):
         user_id, ok = QInputDialog.getText(self, "Añadir ID", "Introduce el User ID de Telegram:")
         if ok and user_id.strip():
@@ -1072,6 +892,33 @@ class SettingsWindow(QDialog):
         self.enable_whitelist_cb.blockSignals(False)
         self.enable_blacklist_cb.blockSignals(False)
 
+        self.local_api_input.setText(settings.value("telegram/local_api_url", "", type=str))
+        self.webhook_cb.setChecked(settings.value("telegram/webhook_enabled", False, type=bool))
+        self.webhook_url_input.setText(settings.value("telegram/webhook_url", "", type=str))
+        self.webhook_port_spin.setValue(settings.value("telegram/webhook_port", DEFAULT_WEBHOOK_PORT, type=int))
+        self.webhook_path_input.setText(settings.value("telegram/webhook_path", DEFAULT_WEBHOOK_PATH, type=str))
+        self.webhook_secret_input.setText(settings.value("telegram/webhook_secret", "", type=str))
+        self.webhook_group.setVisible(self.webhook_cb.isChecked())
+        self.webhook_cb.stateChanged.connect(self.save_webhook_settings)
+        for widget in (self.webhook_url_input, self.webhook_path_input, self.webhook_secret_input):
+            widget.editingFinished.connect(self.save_webhook_settings)
+        self.webhook_port_spin.editingFinished.connect(self.save_webhook_settings)
+        self.bot_concurrent_spin.setValue(settings.value("telegram/max_concurrent", DEFAULT_BOT_MAX_CONCURRENT, type=int))
+        self.bot_per_user_spin.setValue(settings.value("telegram/max_per_user", DEFAULT_BOT_MAX_PER_USER, type=int))
+        self.bot_concurrent_spin.valueChanged.connect(self.save_bot_limits)
+        self.bot_per_user_spin.valueChanged.connect(self.save_bot_limits)
+        self.bot_memory_spin.setValue(settings.value("telegram/memory_budget_mb", DEFAULT_BOT_MEMORY_BUDGET_MB, type=int))
+        self.bot_memory_spin.valueChanged.connect(self.save_bot_limits)
+        self.bot_per_message_spin.setValue(settings.value("telegram/max_per_message", DEFAULT_BOT_MAX_PER_MESSAGE, type=int))
+        self.bot_playlist_spin.setValue(settings.value("telegram/playlist_max_entries", DEFAULT_BOT_PLAYLIST_MAX, type=int))
+        self.bot_per_message_spin.valueChanged.connect(self.save_bot_limits)
+        self.bot_playlist_spin.valueChanged.connect(self.save_bot_limits)
+        for key, spin in self.quota_spins.items():
+            spin.setValue(settings.value(key, 0, type=int))
+            spin.editingFinished.connect(self.save_bot_limits)
+        self.bot_workers_spin.setValue(settings.value("telegram/worker_processes", DEFAULT_BOT_WORKER_PROCESSES, type=int))
+        self.bot_workers_spin.editingFinished.connect(self.save_bot_workers)
+
         for user_id in json.loads(settings.value("telegram/whitelist", "[]", type=str)):
             self.add_id_to_list_silent(self.whitelist_table, user_id)
         for user_id in json.loads(settings.value("telegram/blacklist", "[]", type=str)):
@@ -1094,6 +941,59 @@ class SettingsWindow(QDialog):
 
         self.save_telegram_settings()
 
+    def save_local_api_url(self):
+        settings = self.main_window.settings
+        url = self.local_api_input.text().strip().rstrip("/")
+        if url == settings.value("telegram/local_api_url", "", type=str):
+            return
+        settings.setValue("telegram/local_api_url", url)
+        print(f"[{_ts()}] [SETTINGS] Servidor Bot API: {url or 'api.telegram.org'}")
+        # El servidor se fija al construir la Application: hay que reiniciar el bot
+        if settings.value("telegram/enabled", False, type=bool) and self.main_window.telegram_thread:
+            self.main_window.restart_telegram_bot()
+
+    def save_webhook_settings(self, *_):
+        settings = self.main_window.settings
+        self.webhook_group.setVisible(self.webhook_cb.isChecked())
+        values = {
+            "telegram/webhook_enabled": self.webhook_cb.isChecked(),
+            "telegram/webhook_url": self.webhook_url_input.text().strip(),
+            "telegram/webhook_port": self.webhook_port_spin.value(),
+            "telegram/webhook_path": self.webhook_path_input.text().strip() or DEFAULT_WEBHOOK_PATH,
+            "telegram/webhook_secret": self.webhook_secret_input.text().strip(),
+        }
+        before = self.main_window.webhook_settings() if self.main_window.telegram_thread else None
+        for key, value in values.items():
+            settings.setValue(key, value)
+        after = self.main_window.webhook_settings()  # genera el secreto si quedó vacío
+        self.webhook_secret_input.setText(settings.value("telegram/webhook_secret", "", type=str))
+        # Polling/webhook y el puerto se fijan al arrancar: reinicio solo si algo cambió
+        if settings.value("telegram/enabled", False, type=bool) and self.main_window.telegram_thread:
+            if before != after:
+                self.main_window.restart_telegram_bot()
+
+    def save_bot_limits(self, *_):
+        settings = self.main_window.settings
+        settings.setValue("telegram/max_concurrent", self.bot_concurrent_spin.value())
+        settings.setValue("telegram/max_per_user", self.bot_per_user_spin.value())
+        settings.setValue("telegram/memory_budget_mb", self.bot_memory_spin.value())
+        settings.setValue("telegram/max_per_message", self.bot_per_message_spin.value())
+        settings.setValue("telegram/playlist_max_entries", self.bot_playlist_spin.value())
+        for key, spin in self.quota_spins.items():
+            settings.setValue(key, spin.value())
+        self.main_window.apply_telegram_limits()
+
+    def save_bot_workers(self):
+        settings = self.main_window.settings
+        workers = self.bot_workers_spin.value()
+        if workers == settings.value("telegram/worker_processes", DEFAULT_BOT_WORKER_PROCESSES, type=int):
+            return
+        settings.setValue("telegram/worker_processes", workers)
+        print(f"[{_ts()}] [SETTINGS] Procesos de descarga del bot: {workers or 'ninguno (hilos)'}")
+        # El pool de procesos se crea con el bot: hay que reiniciarlo
+        if settings.value("telegram/enabled", False, type=bool) and self.main_window.telegram_thread:
+            self.main_window.restart_telegram_bot()
+
     def add_id_to_list_silent(self, table, user_id):
         row_count = table.rowCount()
         table.insertRow(row_count)
@@ -1148,6 +1048,311 @@ class SettingsWindow(QDialog):
             self.main_window.set_audio_path(folder)
             self.audio_path_display.setText(folder)
 
+# --------------------------- Tabla de descargas ---------------------------
+
+QUEUEABLE_STATES = ("En cola", "Detenido", "Error")
+JOB_ROW_HEIGHT = 32
+
+class JobRecord:
+    """Una fila de la tabla de descargas. La vista no guarda widgets por fila: los
+    delegados pintan solo lo visible a partir de estos registros."""
+    __slots__ = ('uuid', 'url', 'want_audio', 'want_video', 'state', 'label', 'percent',
+                 'formats', 'format_id', 'formats_status', 'format_selection', 'job_type')
+
+    def __init__(self, job_uuid, url, download_type='video', state="En cola", percent=0, format_id=None):
+        self.uuid, self.url = job_uuid, url
+        self.want_audio = download_type in ('audio', 'ambos')
+        self.want_video = download_type in ('video', 'ambos')
+        self.state = state      # En cola / Descargando / Detenido / Error / mensaje final
+        self.label = state      # texto de la barra; admite %p% como QProgressBar
+        self.percent = percent
+        self.formats = [("Mejor Calidad", BEST_QUALITY_ID)]  # entradas (texto, format_id) del combo
+        self.format_id = format_id
+        self.formats_status = 'pending'  # pending / ready / error / fixed
+        self.format_selection = None
+        self.job_type = None
+
+    @property
+    def completed(self) -> bool:
+        return self.state == "Completado"
+
+    @property
+    def download_type(self) -> str:
+        if self.want_audio and self.want_video:
+            return 'ambos'
+        return 'audio' if self.want_audio else 'video'
+
+    def current_format(self):
+        """(texto, format_id) elegido en el combo: el guardado si está en la lista, si no el primero."""
+        for entry in self.formats:
+            if entry[1] == self.format_id and entry[1] is not None:
+                return entry
+        return self.formats[0]
+
+    def keep_saved_format(self):
+        """Trabajo restaurado: si la lista del combo no trae el format_id guardado se añade, para que
+        reanudar no cambie de resolución (y no descarte los parciales) sin que lo pida el usuario."""
+        if self.format_id and all(entry[1] != self.format_id for entry in self.formats):
+            self.formats.append((f"Guardado ({self.format_id})", self.format_id))
+
+class JobTableModel(QAbstractTableModel):
+    """Modelo de la tabla de descargas: lista de JobRecord con índices uuid -> fila y URL canónica."""
+    HEADERS = ('#', 'Link', 'Estado', 'Formato', 'Resolución', 'Eliminar')
+    COL_NUM, COL_URL, COL_STATE, COL_TYPE, COL_FORMAT, COL_DELETE = range(6)
+    RecordRole = Qt.ItemDataRole.UserRole + 1
+
+    download_type_changed = pyqtSignal(str, str)  # uuid, 'audio' | 'video' | 'ambos'
+    format_id_changed = pyqtSignal(str, object)   # uuid, format_id
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._records = []
+        self._rows = {}    # uuid -> fila
+        self._urls = Counter()  # canonical_url -> nº de filas: detecta duplicados en O(1)
+
+    # --- interfaz de QAbstractTableModel ---
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._records)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        rec, col = self._records[index.row()], index.column()
+        if role == self.RecordRole:
+            return rec
+        if role == Qt.ItemDataRole.DisplayRole:
+            if col == self.COL_NUM:
+                return str(index.row() + 1)
+            if col == self.COL_URL:
+                return rec.url
+            if col == self.COL_STATE:
+                return rec.label.replace("%p%", str(rec.percent))
+            if col == self.COL_FORMAT:
+                return rec.current_format()[0]
+        elif role == Qt.ItemDataRole.ToolTipRole and col == self.COL_URL:
+            return rec.url
+        elif role == Qt.ItemDataRole.TextAlignmentRole and col == self.COL_NUM:
+            return Qt.AlignmentFlag.AlignCenter
+        return None
+
+    def flags(self, index):
+        flags = Qt.ItemFlag.ItemIsEnabled
+        if index.isValid() and index.column() == self.COL_FORMAT and self._records[index.row()].formats_status == 'ready':
+            flags |= Qt.ItemFlag.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if not index.isValid() or role != Qt.ItemDataRole.EditRole:
+            return False
+        rec = self._records[index.row()]
+        if index.column() == self.COL_FORMAT:
+            rec.format_id = value
+            self.dataChanged.emit(index, index)
+            self.format_id_changed.emit(rec.uuid, value)
+            return True
+        if index.column() == self.COL_TYPE:
+            rec.want_audio, rec.want_video = value
+            self.dataChanged.emit(index, index)
+            self.download_type_changed.emit(rec.uuid, rec.download_type)
+            return True
+        return False
+
+    # --- acceso para MainWindow: por uuid, que no cambia al borrar o reordenar filas ---
+    def record(self, row) -> JobRecord:
+        return self._records[row]
+
+    def records(self):
+        return self._records
+
+    def get(self, job_uuid) -> Optional[JobRecord]:
+        row = self._rows.get(job_uuid)
+        return None if row is None else self._records[row]
+
+    def row_of(self, job_uuid) -> int:
+        return self._rows.get(job_uuid, -1)
+
+    def has_url(self, url) -> bool:
+        return self._urls[canonical_url(url)] > 0
+
+    def append(self, records):
+        if not records:
+            return
+        first = len(self._records)
+        self.beginInsertRows(QModelIndex(), first, first + len(records) - 1)
+        for offset, rec in enumerate(records):
+            self._rows[rec.uuid] = first + offset
+            self._urls[canonical_url(rec.url)] += 1
+        self._records.extend(records)
+        self.endInsertRows()
+
+    def remove(self, job_uuids):
+        """Quita varias filas: un beginRemoveRows por tramo contiguo y un solo reindexado."""
+        rows = sorted((self._rows[u] for u in set(job_uuids) if u in self._rows), reverse=True)
+        if not rows:
+            return
+        start = end = rows[0]
+        for row in rows[1:] + [None]:
+            if row is not None and row == start - 1:
+                start = row
+                continue
+            self.beginRemoveRows(QModelIndex(), start, end)
+            for rec in self._records[start:end + 1]:
+                del self._rows[rec.uuid]
+                key = canonical_url(rec.url)
+                self._urls[key] -= 1
+                if self._urls[key] <= 0:
+                    del self._urls[key]
+            del self._records[start:end + 1]
+            self.endRemoveRows()
+            start = end = row
+        for i in range(rows[-1], len(self._records)):
+            self._rows[self._records[i].uuid] = i
+
+    def refresh(self, job_uuid, *columns):
+        row = self._rows.get(job_uuid)
+        if row is None:
+            return
+        for col in columns:
+            idx = self.index(row, col)
+            self.dataChanged.emit(idx, idx)
+
+    def set_progress(self, job_uuid, percent):
+        rec = self.get(job_uuid)
+        if rec is not None and rec.percent != percent:
+            rec.percent = percent
+            self.refresh(job_uuid, self.COL_STATE)
+
+    def set_state(self, job_uuid, state, label=None, percent=None):
+        rec = self.get(job_uuid)
+        if rec is None:
+            return
+        rec.state, rec.label = state, (label or state)
+        if percent is not None:
+            rec.percent = percent
+        self.refresh(job_uuid, self.COL_STATE)
+
+    def set_formats(self, job_uuid, formats, status='ready'):
+        rec = self.get(job_uuid)
+        if rec is None:
+            return
+        rec.formats, rec.formats_status = list(formats), status
+        rec.keep_saved_format()
+        self.refresh(job_uuid, self.COL_FORMAT)
+
+def _cell_style(option):
+    return option.widget.style() if option.widget else QApplication.style()
+
+class ProgressDelegate(QStyledItemDelegate):
+    """Pinta la barra de progreso de la columna Estado."""
+    def paint(self, painter, option, index):
+        rec = index.data(JobTableModel.RecordRole)
+        bar = QStyleOptionProgressBar()
+        bar.rect = option.rect.adjusted(2, 4, -2, -4)
+        bar.minimum, bar.maximum, bar.progress = 0, 100, rec.percent
+        bar.text = rec.label.replace("%p%", str(rec.percent))
+        bar.textVisible = True
+        bar.textAlignment = Qt.AlignmentFlag.AlignCenter
+        bar.state = QStyle.StateFlag.State_Enabled | QStyle.StateFlag.State_Horizontal
+        _cell_style(option).drawControl(QStyle.ControlElement.CE_ProgressBar, bar, painter, option.widget)
+
+class DownloadTypeDelegate(QStyledItemDelegate):
+    """Casillas Audio / Video de la columna Formato, pintadas y conmutadas sin widgets."""
+    LABELS = ("Audio", "Video")
+
+    def _boxes(self, rect):
+        half = rect.width() // 2
+        return (QRect(rect.x() + 5, rect.y(), half - 5, rect.height()),
+                QRect(rect.x() + half, rect.y(), rect.width() - half - 5, rect.height()))
+
+    def paint(self, painter, option, index):
+        rec = index.data(JobTableModel.RecordRole)
+        style = _cell_style(option)
+        for rect, text, checked in zip(self._boxes(option.rect), self.LABELS, (rec.want_audio, rec.want_video)):
+            box = QStyleOptionButton()
+            box.rect, box.text = rect, text
+            box.state = QStyle.StateFlag.State_Enabled | (QStyle.StateFlag.State_On if checked else QStyle.StateFlag.State_Off)
+            style.drawControl(QStyle.ControlElement.CE_CheckBox, box, painter, option.widget)
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() != QEvent.Type.MouseButtonRelease or event.button() != Qt.MouseButton.LeftButton:
+            return False
+        rec = index.data(JobTableModel.RecordRole)
+        for i, rect in enumerate(self._boxes(option.rect)):
+            if rect.contains(event.position().toPoint()):
+                flags = [rec.want_audio, rec.want_video]
+                flags[i] = not flags[i]
+                return model.setData(index, tuple(flags))
+        return False
+
+    def sizeHint(self, option, index):
+        return QSize(150, JOB_ROW_HEIGHT)
+
+class FormatComboDelegate(QStyledItemDelegate):
+    """Columna Resolución: se pinta como un combo y solo crea un QComboBox real al editarla."""
+    def paint(self, painter, option, index):
+        rec = index.data(JobTableModel.RecordRole)
+        combo = QStyleOptionComboBox()
+        combo.rect = option.rect.adjusted(2, 3, -2, -3)
+        combo.currentText = rec.current_format()[0]
+        if rec.formats_status == 'ready':
+            combo.state = QStyle.StateFlag.State_Enabled
+        style = _cell_style(option)
+        style.drawComplexControl(QStyle.ComplexControl.CC_ComboBox, combo, painter, option.widget)
+        style.drawControl(QStyle.ControlElement.CE_ComboBoxLabel, combo, painter, option.widget)
+
+    def editorEvent(self, event, model, option, index):
+        if (event.type() == QEvent.Type.MouseButtonRelease and event.button() == Qt.MouseButton.LeftButton
+                and index.flags() & Qt.ItemFlag.ItemIsEditable):
+            self.parent().edit(index)
+            return True
+        return False
+
+    def createEditor(self, parent, option, index):
+        editor = QComboBox(parent)
+        for text, format_id in index.data(JobTableModel.RecordRole).formats:
+            editor.addItem(text, format_id)
+        editor.activated.connect(lambda _i, e=editor: (self.commitData.emit(e), self.closeEditor.emit(e)))
+        QTimer.singleShot(0, editor.showPopup)
+        return editor
+
+    def setEditorData(self, editor, index):
+        editor.setCurrentIndex(max(0, editor.findData(index.data(JobTableModel.RecordRole).current_format()[1])))
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.currentData())
+
+    def updateEditorGeometry(self, editor, option, index):
+        editor.setGeometry(option.rect)
+
+class DeleteButtonDelegate(QStyledItemDelegate):
+    """Botón ❌ de la columna Eliminar; emite la fila pulsada."""
+    clicked = pyqtSignal(int)
+    SIZE = 28
+
+    def _button(self, rect):
+        return QRect(rect.center().x() - self.SIZE // 2, rect.center().y() - self.SIZE // 2, self.SIZE, self.SIZE)
+
+    def paint(self, painter, option, index):
+        button = QStyleOptionButton()
+        button.rect, button.text = self._button(option.rect), "❌"
+        button.state = QStyle.StateFlag.State_Enabled | QStyle.StateFlag.State_Raised
+        _cell_style(option).drawControl(QStyle.ControlElement.CE_PushButton, button, painter, option.widget)
+
+    def editorEvent(self, event, model, option, index):
+        if (event.type() == QEvent.Type.MouseButtonRelease and event.button() == Qt.MouseButton.LeftButton
+                and self._button(option.rect).contains(event.position().toPoint())):
+            self.clicked.emit(index.row())
+            return True
+        return False
+
 # ------------------------------ MainWindow ----------------------------
 
 class MainWindow(QMainWindow):
@@ -1162,9 +1367,18 @@ class MainWindow(QMainWindow):
         maybe_update_ytdlp_async()
 
         self.download_modes = ['Ambos', 'Audio', 'Video']; self.current_download_mode_index = 0
-        self.is_downloading = False; self.active_thread = None; self.active_worker = None; self.download_queue = []
-        self.active_format_fetchers = {}; self.active_downloads = {}
-        self.download_info = {}
+        self.is_downloading = False
+        self.download_queue = HostScheduler(self.load_host_limits(), self.settings.value(
+            "downloads/max_per_host", DEFAULT_HOST_CONCURRENCY, type=int))
+        self.active_format_fetchers = {}; self.active_downloads = {}  # fetchers: uuid -> (hilo, worker)
+        self.pending_format_fetches = {}  # uuid -> url, a la espera de hueco y de ser visible
+        self.job_store = JobStore(JOBS_DB_PATH)
+        self.jobs = JobTableModel(self)
+        self.jobs.download_type_changed.connect(lambda u, t: self.job_store.update(u, download_type=t))
+        self.jobs.format_id_changed.connect(lambda u, f: self.job_store.update(u, format_id=f))
+        # Se leen ya (antes de que un pegado añada filas nuevas) y se insertan por lotes
+        self._pending_restore = deque(self.job_store.load()); self._resume_uuids = set()
+        self._deferred_imports = []  # (urls, download_type) llegados antes de acabar la restauración
         self.system_info = get_system_info(); self.update_info = {}
 
         self.telegram_thread = None
@@ -1173,7 +1387,9 @@ class MainWindow(QMainWindow):
 
         self.setWindowTitle("BitStation Multimedia Downloader"); self.setWindowIcon(QIcon("BitStation.ico")); self.setGeometry(100, 100, 900, 600)
         self.setup_ui(); self.setup_connections(); self.check_for_updates()
+        self.setAcceptDrops(True)  # soltar enlaces o listas .txt/.csv
         self.toggle_telegram_bot()
+        QTimer.singleShot(0, self.restore_jobs)
 
     def setup_ui(self):
         central_widget = QWidget(); self.setCentralWidget(central_widget); main_layout = QVBoxLayout(central_widget)
@@ -1197,16 +1413,33 @@ class MainWindow(QMainWindow):
         self.master_download_button = QPushButton(); self.master_download_button.setFixedSize(QSize(40, 35)); self.update_master_download_icon()
         search_layout.addWidget(self.search_bar); search_layout.addWidget(self.master_download_button)
 
-        self.table = QTableWidget(); self.table.setColumnCount(6)
-        self.table.setHorizontalHeaderLabels(['#', 'Link', 'Estado', 'Formato', 'Resolución', 'Eliminar'])
+        # Modelo/vista: sin widgets por fila, con filas de alto fijo (nada de ResizeToContents
+        # sobre miles de filas) y delegados que pintan barra, casillas, combo y botón
+        self.table = QTableView(); self.table.setModel(self.jobs)
+        self.table.setSelectionMode(QTableView.SelectionMode.NoSelection)
+        self.table.setEditTriggers(QTableView.EditTrigger.NoEditTriggers)
+        self.table.setWordWrap(False)
+        self.table.verticalHeader().hide()
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.table.verticalHeader().setDefaultSectionSize(JOB_ROW_HEIGHT)
         header = self.table.horizontalHeader()
-        header.setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents)
-        header.setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
-        header.setSectionResizeMode(2, QHeaderView.ResizeMode.ResizeToContents)
-        header.setSectionResizeMode(3, QHeaderView.ResizeMode.ResizeToContents)
-        header.setSectionResizeMode(4, QHeaderView.ResizeMode.ResizeToContents)
-        header.setSectionResizeMode(5, QHeaderView.ResizeMode.ResizeToContents)
-        self.table.setSelectionMode(QTableWidget.SelectionMode.NoSelection)
+        header.setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        header.setSectionResizeMode(JobTableModel.COL_URL, QHeaderView.ResizeMode.Stretch)
+        for col, width in ((JobTableModel.COL_NUM, 45), (JobTableModel.COL_STATE, 190), (JobTableModel.COL_TYPE, 150),
+                           (JobTableModel.COL_FORMAT, 170), (JobTableModel.COL_DELETE, 70)):
+            header.resizeSection(col, width)
+        self.delete_delegate = DeleteButtonDelegate(self.table)
+        self.delete_delegate.clicked.connect(self.delete_row)
+        self.table.setItemDelegateForColumn(JobTableModel.COL_STATE, ProgressDelegate(self.table))
+        self.table.setItemDelegateForColumn(JobTableModel.COL_TYPE, DownloadTypeDelegate(self.table))
+        self.table.setItemDelegateForColumn(JobTableModel.COL_FORMAT, FormatComboDelegate(self.table))
+        self.table.setItemDelegateForColumn(JobTableModel.COL_DELETE, self.delete_delegate)
+        # Formatos bajo demanda: al hacer scroll o redimensionar se extraen antes las filas que pasan a verse
+        self.format_fetch_timer = QTimer(self); self.format_fetch_timer.setSingleShot(True)
+        self.format_fetch_timer.setInterval(FORMAT_FETCH_DEBOUNCE_MS)
+        self.format_fetch_timer.timeout.connect(self.start_pending_format_fetches)
+        self.table.verticalScrollBar().valueChanged.connect(lambda _v: self.format_fetch_timer.start())
+        self.table.viewport().installEventFilter(self)
 
         main_layout.addLayout(top_controls_layout); main_layout.addWidget(self.prompt_label)
         main_layout.addLayout(search_layout); main_layout.addWidget(self.table)
@@ -1303,6 +1536,8 @@ class MainWindow(QMainWindow):
         default_audio_path = os.path.join(os.getcwd(), "Audio")
         self.video_path = self.settings.value("videoPath", defaultValue=default_video_path)
         self.audio_path = self.settings.value("audioPath", defaultValue=default_audio_path)
+        self.max_parallel_downloads = self.settings.value(
+            "downloads/max_parallel", DEFAULT_MAX_PARALLEL_DOWNLOADS, type=int)
         os.makedirs(self.video_path, exist_ok=True)
         os.makedirs(self.audio_path, exist_ok=True)
 
@@ -1318,6 +1553,37 @@ class MainWindow(QMainWindow):
         os.makedirs(self.audio_path, exist_ok=True)
         self.settings.setValue("audioPath", path)
 
+    def set_max_parallel_downloads(self, value):
+        # Setter usado por SettingsWindow; si hay lote en curso, ocupa los huecos nuevos
+        self.max_parallel_downloads = max(1, min(int(value), MAX_PARALLEL_DOWNLOADS_LIMIT))
+        self.settings.setValue("downloads/max_parallel", self.max_parallel_downloads)
+        if self.is_downloading:
+            self.start_next_download()
+
+    def load_host_limits(self):
+        limits = dict(HOST_CONCURRENCY_LIMITS)
+        try:
+            saved = json.loads(self.settings.value("downloads/host_limits", "", type=str) or "null")
+            if isinstance(saved, dict):
+                limits = {str(h): int(v) for h, v in saved.items()}
+        except (ValueError, TypeError):
+            pass
+        return limits
+
+    def set_host_limits(self, limits):
+        # Setter usado por SettingsWindow
+        self.download_queue.limits = dict(limits)
+        self.settings.setValue("downloads/host_limits", json.dumps(self.download_queue.limits))
+        if self.is_downloading:
+            self.start_next_download()
+
+    def set_default_host_limit(self, value):
+        # Setter usado por SettingsWindow: tope para dominios sin límite propio
+        self.download_queue.default_limit = max(1, int(value))
+        self.settings.setValue("downloads/max_per_host", self.download_queue.default_limit)
+        if self.is_downloading:
+            self.start_next_download()
+
     def toggle_download_mode(self):
         self.current_download_mode_index = (self.current_download_mode_index + 1) % len(self.download_modes)
         mode_text = self.download_modes[self.current_download_mode_index]
@@ -1326,7 +1592,9 @@ class MainWindow(QMainWindow):
     def toggle_master_download(self):
         if self.is_downloading:
             self.is_downloading = False; self.update_master_download_icon()
-            if self.active_worker: self.active_worker.stop()
+            self.download_queue.clear()
+            for _thread, worker in list(self.active_downloads.values()):
+                worker.stop()
         else:
             self.build_download_queue()
             if self.download_queue:
@@ -1339,209 +1607,125 @@ class MainWindow(QMainWindow):
 
     def build_download_queue(self):
         self.download_queue.clear()
-        for row in range(self.table.rowCount()):
-            progress_bar = self.table.cellWidget(row, 2)
-            if progress_bar and (progress_bar.format() in ["En cola", "Detenido", "Error"]):
-                self.download_queue.append({'row': row})
+        for rec in self.jobs.records():
+            if rec.uuid in self.active_downloads:
+                continue  # aún deteniéndose; se reanudará en el próximo lote
+            if rec.state in QUEUEABLE_STATES:
+                self.download_queue.push({'uuid': rec.uuid, 'url': rec.url})
 
     def start_next_download(self):
-        if not self.is_downloading or not self.download_queue:
-            self.is_downloading = False; self.update_master_download_icon(); return
-        job_base = self.download_queue.pop(0)
-        self.start_download_for_job(job_base['row'])
-
-    def start_download_for_job(self, row):
-        progress_bar = self.table.cellWidget(row, 2)
-        if progress_bar and progress_bar.format() == "Detenido":
-            print(f"Reanudando trabajo para la fila {row+1}. Limpiando progreso previo.")
-            job_uuid = self.download_info[row].get('uuid')
-            if job_uuid:
-                temp_job_dir = os.path.join(TEMP_DOWNLOADS_DIR, job_uuid)
-                if os.path.isdir(temp_job_dir):
-                    try: shutil.rmtree(temp_job_dir)
-                    except OSError as e: print(f"No se pudo limpiar el directorio temporal anterior: {e}")
-
-        format_widget = self.table.cellWidget(row, 3)
-        checkboxes = format_widget.findChildren(QCheckBox)
-        want_audio = checkboxes[0].isChecked()
-        want_video = checkboxes[1].isChecked()
-
-        if want_audio and want_video:
-            job_type = 'video'     # "ambos" se gestiona como salida de video final
-        elif want_audio:
-            job_type = 'audio'
-        else:
-            job_type = 'video'
-
-        combo_res = self.table.cellWidget(row, 4)
-        format_id = combo_res.currentData()
-        fmt_id = (format_id or "").strip() if format_id else ""
-
-        # === Selección de formato con fallbacks seguros (evita "Requested format is not available") ===
-        if want_audio and not want_video:
-            # Audio solo -> permitimos caer a "best" y luego extraemos audio con FFmpeg
-            format_selection = "bestaudio/best"
-        elif want_video and not want_audio:
-            # Video solo -> intentamos id elegido o bestvideo; si no existe, caemos a "best" (combinado)
-            if '+' in fmt_id:
-                fmt_id = fmt_id.split('+', 1)[0].strip()
-            if not fmt_id or fmt_id == "bestvideo+bestaudio/best":
-                format_selection = "bestvideo/best"
-            else:
-                format_selection = f"{fmt_id}/best"
-        else:
-            # Ambos
-            if fmt_id and '+' in fmt_id:
-                format_selection = fmt_id
-            elif fmt_id:
-                format_selection = f"{fmt_id}+bestaudio/best"
-            else:
-                format_selection = "bestvideo+bestaudio/best"
-        # === FIN selección de formato ===
+        """Ocupa los huecos libres (hasta max_parallel_downloads), respetando el tope de cada host."""
+        while self.is_downloading and len(self.active_downloads) < self.max_parallel_downloads:
+            busy = Counter(worker.job.get('host') for _thread, worker in self.active_downloads.values())
+            job_base = self.download_queue.pop_ready(busy)
+            if job_base is None:
+                break  # lo pendiente pertenece a hosts que ya están en su tope
+            if self.jobs.get(job_base['uuid']) is None:
+                continue  # fila borrada mientras esperaba turno: se descarta aquí, no al borrar
+            self.start_download_for_job(job_base['uuid'])
+        if not self.active_downloads and not self.download_queue:
+            self.is_downloading = False; self.update_master_download_icon()
+
+    def start_download_for_job(self, job_uuid):
+        rec = self.jobs.get(job_uuid)
+        row = self.jobs.row_of(job_uuid)
+        resuming = rec.state == "Detenido"
+        want_audio, want_video = rec.want_audio, rec.want_video
+
+        format_id = rec.current_format()[1]
+        format_selection, job_type = build_format_selection(want_audio, want_video, format_id)
 
         if not format_selection:
-            self.on_download_error({'row': row}, "Formato inválido")
+            self.on_download_error({'uuid': job_uuid}, "Formato inválido")
             return
 
-        self.download_info[row]['format_selection'] = format_selection
-        self.download_info[row]['job_type'] = job_type
+        rec.format_selection, rec.job_type = format_selection, job_type
 
-        job_uuid = self.download_info[row]['uuid']
         temp_job_dir = os.path.join(TEMP_DOWNLOADS_DIR, job_uuid)
-        os.makedirs(temp_job_dir, exist_ok=True)
 
-        url = self.table.item(row, 1).text()
+        # Reanudación: prepare_job_dir conserva los parciales salvo que cambie el formato
+        resume_percent = prepare_job_dir(temp_job_dir, format_selection)
+        if resuming:
+            print(f"Reanudando trabajo para la fila {row+1} desde ~{resume_percent}% (parciales conservados).")
 
-        if isinstance(progress_bar, QProgressBar):
-            progress_bar.setFormat(f"Descargando {job_type}... %p%")
-            progress_bar.setValue(0)
+        url = rec.url
+        self.jobs.set_state(job_uuid, "Descargando", f"Descargando {job_type}... %p%", resume_percent)
 
-        ydl_opts = base_ytdlp_opts(self.ffmpeg_path) | {
-            'format': format_selection,
-            'outtmpl': os.path.join(temp_job_dir, '%(title)s.%(ext)s'),
-            'nocolor': True,
-            'hls_prefer_native': True,
-            'continuedl': True,
-            'nooverwrites': False,
-        }
+        self.job_store.update(job_uuid, state="Descargando", format_id=format_id,
+                              format_selection=format_selection, job_type=job_type,
+                              temp_dir=temp_job_dir, error=None)
 
-        # Audio solo -> extraer audio (soluciona TikTok/otros cuando no hay pista separada)
-        if job_type == 'audio':
-            ydl_opts |= {
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '0',
-                }],
-                'keepvideo': False,
-            }
+        ydl_opts = build_download_opts(self.ffmpeg_path, format_selection, job_type, temp_job_dir)
 
         # Pasamos flags al worker para poder quitar audio si el video vino combinado
         job = {
-            'row': row, 'url': url, 'uuid': job_uuid, 'temp_dir': temp_job_dir,
-            'job_type': job_type, 'strip_audio': (want_video and not want_audio)
+            'uuid': job_uuid, 'url': url, 'temp_dir': temp_job_dir,
+            'job_type': job_type, 'strip_audio': (want_video and not want_audio),
+            'host': host_key(url),
         }
 
-        self.active_thread = QThread(self)
-        self.active_worker = DownloadWorker(job, ydl_opts)
-        self.active_worker.moveToThread(self.active_thread)
+        thread = QThread(self)
+        worker = DownloadWorker(job, ydl_opts)
+        worker.moveToThread(thread)
+
+        thread.started.connect(worker.run)
+        worker.progress.connect(self.update_download_progress)
+        worker.finished.connect(self.on_download_finished)
+        worker.error.connect(self.on_download_error)
+        worker.paused.connect(self.on_download_paused)
+        worker.checkpoint.connect(self.on_download_checkpoint)
+        worker.finished.connect(thread.quit)
+        worker.error.connect(thread.quit)
+        worker.paused.connect(thread.quit)
+        thread.finished.connect(thread.deleteLater)
+        worker.finished.connect(worker.deleteLater)
 
-        self.active_thread.started.connect(self.active_worker.run)
-        self.active_worker.progress.connect(self.update_download_progress)
-        self.active_worker.finished.connect(self.on_download_finished)
-        self.active_worker.error.connect(self.on_download_error)
-        self.active_worker.paused.connect(self.on_download_paused)
-        self.active_worker.finished.connect(self.active_thread.quit)
-        self.active_worker.error.connect(self.active_thread.quit)
-        self.active_worker.paused.connect(self.active_thread.quit)
-        self.active_thread.finished.connect(self.active_thread.deleteLater)
-        self.active_worker.finished.connect(self.active_worker.deleteLater)
+        self.active_downloads[job_uuid] = (thread, worker)
+        thread.start()
 
-        self.active_downloads[row] = (self.active_thread, self.active_worker)
-        self.active_thread.start()
 
+    def update_download_progress(self, job_uuid, percent):
+        self.jobs.set_progress(job_uuid, percent)
 
-    def update_download_progress(self, row, percent):
-        widget = self.table.cellWidget(row, 2)
-        if isinstance(widget, QProgressBar):
-            widget.setValue(percent)
+    def on_download_checkpoint(self, job_uuid, bytes_done, bytes_total, percent):
+        self.job_store.checkpoint(job_uuid, bytes_done or 0, bytes_total, percent)
 
     def on_download_finished(self, job, message, final_result):
-        row = job['row']
-        if row in self.active_downloads:
-            del self.active_downloads[row]
-
-        job_type = self.download_info[row].get('job_type', 'video')
+        job_uuid = job['uuid']
+        self.active_downloads.pop(job_uuid, None)
+        rec = self.jobs.get(job_uuid)
+        if rec is None:
+            self.start_next_download()
+            return  # fila eliminada mientras terminaba
+
+        job_type = rec.job_type or 'video'
         destination_folder = self.audio_path if job_type == 'audio' else self.video_path
 
-        try:
-            if final_result and os.path.exists(final_result) and os.path.isdir(final_result):
-                temp_job_dir = final_result
-                print(f"[{_ts()}] [MOVE] Playlist detectada. Moviendo archivos desde: {temp_job_dir}")
-                moved = 0
-                for name in os.listdir(temp_job_dir):
-                    src = os.path.join(temp_job_dir, name)
-                    if os.path.isdir(src): continue
-                    if name.endswith(('.part', '.ytdl', '.temp')): continue
-                    try:
-                        dst = _safe_move(src, destination_folder)
-                        print(f"[{_ts()}] [MOVE] -> {dst}"); moved += 1
-                    except Exception as e:
-                        print(f"[{_ts()}] [MOVE] Error moviendo '{name}': {e}")
-                try:
-                    shutil.rmtree(temp_job_dir, ignore_errors=True)
-                    print(f"[{_ts()}] [MOVE] Directorio temporal limpiado: {temp_job_dir}")
-                except Exception as e:
-                    print(f"[{_ts()}] [MOVE] Error limpiando dir temporal: {e}")
+        message, final_path = finalize_download(final_result, destination_folder, message)
 
-                if moved == 0:
-                    message = "Sin archivos"
-            else:
-                final_filepath = final_result
-                if final_filepath and os.path.exists(final_filepath):
-                    try:
-                        final_destination_path = _safe_move(final_filepath, destination_folder)
-                        print(f"Archivo movido a: {final_destination_path}")
-                        temp_job_dir = os.path.dirname(final_filepath)
-                        shutil.rmtree(temp_job_dir, ignore_errors=True)
-                        print(f"Directorio temporal limpiado: {temp_job_dir}")
-                    except Exception as e:
-                        print(f"Error al mover/limpiar el archivo final: {e}")
-                        message = "Error de guardado"
-        except Exception as e:
-            print(f"[{_ts()}] [MOVE] Error general al finalizar: {e}")
-            message = "Error de guardado"
+        self.jobs.set_state(job_uuid, message, percent=100)
+        self.job_store.update(job_uuid, state=message, percent=100, final_path=final_path)
 
-        widget = self.table.cellWidget(row, 2)
-        if isinstance(widget, QProgressBar):
-            widget.setValue(100); widget.setFormat(message)
-        if row in self.download_info:
-            self.download_info[row]['completed'] = (message == "Completado")
-
-        self.active_thread = None; self.active_worker = None
         self.start_next_download()
 
     def on_download_paused(self, job):
-        row = job['row']
-        print(f"La descarga en la fila {row+1} fue pausada por el usuario.")
-        if row in self.active_downloads:
-            thread, worker = self.active_downloads.pop(row)
-            thread.quit(); thread.wait()
-        widget = self.table.cellWidget(row, 2)
-        if isinstance(widget, QProgressBar):
-            widget.setFormat("Detenido")
-        self.active_thread = None; self.active_worker = None
+        job_uuid = job['uuid']
+        if job_uuid not in self.active_downloads:
+            return  # fila eliminada mientras se detenía
+        print(f"La descarga en la fila {self.jobs.row_of(job_uuid)+1} fue pausada por el usuario.")
+        thread, worker = self.active_downloads.pop(job_uuid)
+        thread.quit(); thread.wait()
+        self.jobs.set_state(job_uuid, "Detenido")
+        self.job_store.update(job_uuid, state="Detenido")
+        self.start_next_download()
 
     def on_download_error(self, job, error_message):
-        row = job['row']
-        if row in self.active_downloads:
-            del self.active_downloads[row]
-        widget = self.table.cellWidget(row, 2)
-        if isinstance(widget, QProgressBar):
-            widget.setFormat("Error")
-        print(f"Error en la fila {row+1}: {error_message}")
-        self.download_queue = [q_job for q_job in self.download_queue if q_job['row'] != row]
-        self.active_thread = None; self.active_worker = None
+        job_uuid = job['uuid']
+        self.active_downloads.pop(job_uuid, None)
+        if self.jobs.get(job_uuid) is not None:
+            self.jobs.set_state(job_uuid, "Error")
+            self.job_store.update(job_uuid, state="Error", error=str(error_message)[:1000])
+        print(f"Error en la fila {self.jobs.row_of(job_uuid)+1}: {error_message}")
         self.start_next_download()
 
     def apply_telegram_acl_settings(self):
@@ -1551,12 +1735,24 @@ class MainWindow(QMainWindow):
         bl = json.loads(self.settings.value("telegram/blacklist", "[]", type=str))
         wl_enabled = self.settings.value("telegram/whitelist_enabled", False, type=bool)
         bl_enabled = self.settings.value("telegram/blacklist_enabled", False, type=bool)
-        self.telegram_worker.whitelist = [str(x) for x in wl]
-        self.telegram_worker.blacklist = [str(x) for x in bl]
-        self.telegram_worker.whitelist_enabled = wl_enabled
-        self.telegram_worker.blacklist_enabled = bl_enabled
+        self.telegram_worker.bot.set_acl(wl, bl, wl_enabled, bl_enabled)
         print(f"[{_ts()}] [BOT] ACL actualizada: wl_enabled={wl_enabled} ({len(wl)} ids) bl_enabled={bl_enabled} ({len(bl)} ids)")
 
+    def webhook_settings(self) -> Optional[dict]:
+        return webhook_settings_from(self.settings)
+
+    def apply_telegram_limits(self, *_):
+        max_total = self.settings.value("telegram/max_concurrent", DEFAULT_BOT_MAX_CONCURRENT, type=int)
+        max_per_user = self.settings.value("telegram/max_per_user", DEFAULT_BOT_MAX_PER_USER, type=int)
+        memory_mb = self.settings.value("telegram/memory_budget_mb", DEFAULT_BOT_MEMORY_BUDGET_MB, type=int)
+        per_message = self.settings.value("telegram/max_per_message", DEFAULT_BOT_MAX_PER_MESSAGE, type=int)
+        playlist_max = self.settings.value("telegram/playlist_max_entries", DEFAULT_BOT_PLAYLIST_MAX, type=int)
+        if self.telegram_worker:
+            self.telegram_worker.set_limits(max_total, max_per_user, memory_mb, per_message, playlist_max)
+            self.telegram_worker.set_quotas(quota_limits_from(self.settings))
+            print(f"[{_ts()}] [BOT] Topes actualizados: {max_total} simultáneas, {max_per_user} por usuario, "
+                  f"{memory_mb}MB de RAM para clips")
+
     # --- NUEVO helper: ruta del .vbs en carpeta Startup ---
     def _startup_vbs_path(self) -> str:
         appdata = os.environ.get("APPDATA", "")
@@ -1578,7 +1774,7 @@ class MainWindow(QMainWindow):
         """
         Crea/borra un .vbs en la carpeta Startup que:
           - espera a que haya red (ping a 1.1.1.1),
-          - arranca la app con --autostart-bot,
+          - arranca solo el bot (bot_daemon.py, sin GUI),
           - ejecuta oculto (sin ventanas ni popups).
         """
         if sys.platform != "win32":
@@ -1602,8 +1798,9 @@ class MainWindow(QMainWindow):
             if not os.path.exists(pythonw):
                 pythonw = sys.executable  # fallback
 
-            script_path = os.path.realpath(sys.argv[0])
-            workdir = os.path.dirname(script_path)
+            # El autostart lanza solo el bot (bot_daemon.py), sin cargar la GUI
+            workdir = os.path.dirname(os.path.realpath(sys.argv[0]))
+            script_path = os.path.join(workdir, "bot_daemon.py")
 
             def vbs_quote(s: str) -> str:
                 # Genera un literal de VBScript con comillas dobles escapadas
@@ -1626,7 +1823,7 @@ class MainWindow(QMainWindow):
                 f"pythonw = {vbs_quote(pythonw)}\r\n"
                 f"script  = {vbs_quote(script_path)}\r\n\r\n"
                 "sh.CurrentDirectory = workdir\r\n"
-                "Dim cmd : cmd = dq & pythonw & dq & \" \" & dq & script & dq & \" --autostart-bot\"\r\n"
+                "Dim cmd : cmd = dq & pythonw & dq & \" \" & dq & script & dq\r\n"
                 "sh.Run cmd, 0, False\r\n"
             )
 
@@ -1649,16 +1846,10 @@ class MainWindow(QMainWindow):
             self._start_telegram_bot()
 
     def _start_telegram_bot(self):
-        whitelist = json.loads(self.settings.value("telegram/whitelist", "[]", type=str))
-        blacklist = json.loads(self.settings.value("telegram/blacklist", "[]", type=str))
-        wl_enabled = self.settings.value("telegram/whitelist_enabled", False, type=bool)
-        bl_enabled = self.settings.value("telegram/blacklist_enabled", False, type=bool)
-
         self.telegram_thread = QThread()
         self.telegram_worker = TelegramBotWorker(
-            self.settings.value("telegram/token", "", type=str),
-            whitelist, blacklist, wl_enabled, bl_enabled,
-            self.ffmpeg_path, self.video_path
+            ffmpeg_path=self.ffmpeg_path, dest_video_path=self.video_path,
+            **bot_settings_from(self.settings),
         )
         self.telegram_worker.moveToThread(self.telegram_thread)
 
@@ -1740,16 +1931,14 @@ class MainWindow(QMainWindow):
     def closeEvent(self, event):
         print("[MAIN] Solicitud de cierre de la aplicación.")
         self.is_downloading = False
-        if self.active_worker: self.active_worker.stop()
-        if self.active_thread: self.active_thread.quit(); self.active_thread.wait()
-
-        if os.path.isdir(TEMP_DOWNLOADS_DIR):
-            print("[MAIN] Limpiando carpetas de descarga temporales...")
-            try:
-                shutil.rmtree(TEMP_DOWNLOADS_DIR)
-                print(" -> Limpieza completada.")
-            except OSError as e:
-                print(f" -> Error en la limpieza final: {e}")
+        self.download_queue.clear()
+        self.pending_format_fetches.clear()
+        for _thread, worker in list(self.active_downloads.values()):
+            worker.stop()
+        for thread, worker in list(self.active_downloads.values()):
+            thread.quit(); thread.wait()
+            # Cierre ordenado = pausa: se reanudará a mano (un cuelgue deja 'Descargando' y se reanuda solo)
+            self.job_store.update(worker.job['uuid'], state="Detenido")
 
         if self.telegram_thread and self.telegram_thread.isRunning():
             print("[MAIN] Deteniendo bot de Telegram antes de cerrar...")
@@ -1760,6 +1949,20 @@ class MainWindow(QMainWindow):
                 print(f"[MAIN] Error al solicitar stop del bot: {e}")
             self.telegram_thread.wait(15000)
 
+        # Solo se borran temporales huérfanos; los parciales de trabajos pendientes se conservan.
+        # _cli y _tg son del modo por lotes y del bot (que limpia lo suyo al parar): pueden seguir vivos
+        if os.path.isdir(TEMP_DOWNLOADS_DIR):
+            print("[MAIN] Limpiando carpetas de descarga temporales huérfanas...")
+            keep = self.job_store.unfinished_uuids() | {HEADLESS_TEMP_DIRNAME, BOT_TEMP_DIRNAME}
+            for name in os.listdir(TEMP_DOWNLOADS_DIR):
+                if name in keep:
+                    continue
+                path = os.path.join(TEMP_DOWNLOADS_DIR, name)
+                if os.path.isdir(path) and not _safe_rmtree(path):
+                    print(f" -> No se pudo eliminar: {path}")
+            print(" -> Limpieza completada.")
+        self.job_store.close()
+
         print("[MAIN] Guardando configuración final...")
         self.settings.sync()
         event.accept()
@@ -1767,67 +1970,203 @@ class MainWindow(QMainWindow):
     def handle_paste(self, text):
         urls = re.findall(URL_REGEX, text)
         if urls:
-            mode = self.download_modes[self.current_download_mode_index]
-            for url in urls:
-                # Evitar agregar enlaces duplicados en la lista
-                if any(info.get('url') == url for info in self.download_info.values()):
-                    continue
-                if mode == 'Audio':
-                    self.add_link_to_table(url, download_type='audio')
-                elif mode == 'Video':
-                    self.add_link_to_table(url, download_type='video')
-                elif mode == 'Ambos':
-                    self.add_link_to_table(url, download_type='ambos')
+            self.import_urls(urls)
             self.search_bar.blockSignals(True); self.search_bar.clear(); self.search_bar.blockSignals(False)
 
-    def add_link_to_table(self, link_text, download_type='video'):
-        row_position = self.table.rowCount()
-        job_uuid = uuid.uuid4().hex
-        self.download_info[row_position] = {
-            'uuid': job_uuid, 'url': link_text,
-            'format_selection': None, 'job_type': None, 'completed': False,
-        }
+    def current_download_type(self) -> str:
+        return {'Audio': 'audio', 'Video': 'video'}.get(self.download_modes[self.current_download_mode_index], 'ambos')
+
+    def import_urls(self, urls, download_type=None) -> int:
+        """Alta en bloque: dedup por URL canónica (contra la tabla y dentro del lote), una sola
+        transacción en JobStore y una sola inserción en el modelo. Devuelve las filas añadidas."""
+        if self._pending_restore:
+            # Aún se restaura la tabla: se importa al terminar para no duplicar trabajos guardados
+            self._deferred_imports.append((list(urls), download_type))
+            return 0
+        download_type = download_type or self.current_download_type()
+        seen, records = set(), []
+        for url in urls:
+            key = canonical_url(url)
+            if key in seen or self.jobs.has_url(url):
+                continue
+            seen.add(key)
+            records.append(self.new_job_record(url, download_type))
+        if not records:
+            return 0
+        self.job_store.add_many([(rec.uuid, rec.url, download_type, os.path.join(TEMP_DOWNLOADS_DIR, rec.uuid))
+                                 for rec in records])
+        self.table.setUpdatesEnabled(False)
+        try:
+            self.add_jobs(records)
+        finally:
+            self.table.setUpdatesEnabled(True)
+        if len(records) > 1:
+            print(f"[{_ts()}] [IMPORT] {len(records)} enlaces añadidos ({len(urls) - len(records)} duplicados omitidos).")
+        return len(records)
 
-        self.table.insertRow(row_position)
-        item_num = QTableWidgetItem(str(row_position + 1))
-        item_num.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.table.setItem(row_position, 0, item_num)
-        self.table.setItem(row_position, 1, QTableWidgetItem(link_text))
-        progress_bar = QProgressBar(); progress_bar.setFormat("En cola")
-        self.table.setCellWidget(row_position, 2, progress_bar)
-        self.table.setCellWidget(row_position, 3, self.create_format_widget(download_type))
-        combo = QComboBox(); combo.addItem("Mejor Calidad", "bestvideo+bestaudio/best"); combo.setEnabled(False)
-        self.table.setCellWidget(row_position, 4, combo)
-        self.table.setCellWidget(row_position, 5, self.create_delete_widget())
-
-        if download_type in ('video', 'ambos'):
-            self.fetch_formats_for_row(row_position, link_text)
+    def import_file(self, path) -> int:
+        """Importa los enlaces de un .txt/.csv (uno por línea o en cualquier columna)."""
+        try:
+            with open(path, encoding='utf-8-sig', errors='replace', newline='') as f:
+                if path.lower().endswith('.csv'):
+                    # Celda a celda: la regex de URL se comería las columnas siguientes
+                    sample = f.read(4096); f.seek(0)
+                    try:
+                        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+                    except csv.Error:
+                        dialect = csv.excel
+                    urls = [u for row in csv.reader(f, dialect) for cell in row for u in re.findall(URL_REGEX, cell)]
+                else:
+                    urls = re.findall(URL_REGEX, f.read())
+        except OSError as e:
+            print(f"[{_ts()}] [IMPORT] No se pudo leer {path}: {e}")
+            return 0
+        print(f"[{_ts()}] [IMPORT] {len(urls)} enlaces en {os.path.basename(path)}")
+        return self.import_urls(urls)
+
+    def dragEnterEvent(self, event):
+        mime = event.mimeData()
+        if mime.hasUrls() or mime.hasText():
+            event.acceptProposedAction()
+
+    def dropEvent(self, event):
+        mime = event.mimeData()
+        links = []
+        for qurl in mime.urls():
+            path = qurl.toLocalFile()
+            if path and os.path.splitext(path)[1].lower() in IMPORT_FILE_EXTS:
+                self.import_file(path)
+            elif not qurl.isLocalFile():
+                links.append(qurl.toString())
+        if not mime.hasUrls() and mime.hasText():
+            links = re.findall(URL_REGEX, mime.text())
+        if links:
+            self.import_urls(links)
+        event.acceptProposedAction()
+
+    def new_job_record(self, link_text, download_type='video', restored=None) -> JobRecord:
+        """Registro de una fila nueva (lo persiste quien lo inserta). Con `restored` (registro
+        de JobStore) los trabajos ya completados no se re-extraen."""
+        if restored:
+            rec = JobRecord(restored['uuid'], link_text, download_type, restored['state'],
+                            restored['percent'] or 0, restored.get('format_id'))
         else:
-            combo.clear(); combo.addItem("N/A"); combo.setEnabled(False)
+            rec = JobRecord(uuid.uuid4().hex, link_text, download_type)
+
+        if download_type not in ('video', 'ambos'):
+            rec.formats, rec.formats_status = [("N/A", None)], 'fixed'
+        elif rec.completed:
+            rec.formats, rec.formats_status = [(rec.format_id or "Mejor Calidad", None)], 'fixed'
+        elif restored:
+            rec.keep_saved_format()
+        return rec
+
+    def add_jobs(self, records):
+        """Inserta las filas de una vez; los formatos se piden cuando la fila se ve."""
+        self.jobs.append(records)
+        INFO_CACHE.set_capacity(self.jobs.rowCount())  # que ninguna fila pierda su extracción antes de descargarse
+        for rec in records:
+            if rec.formats_status == 'pending':
+                self.pending_format_fetches[rec.uuid] = rec.url
+        self.format_fetch_timer.start()
+
+    def restore_jobs(self):
+        """Reconstruye la tabla desde JobStore por lotes para no congelar el arranque."""
+        records = self._pending_restore
+        if not records:
+            self._run_deferred_imports()
+            return
+        for rec in records:
+            if rec['state'] == "Descargando":
+                # El proceso murió a mitad de descarga: los parciales siguen en temp_dir
+                rec['state'] = "Detenido"
+                self._resume_uuids.add(rec['uuid'])
+        print(f"[{_ts()}] [RESTORE] Restaurando {len(records)} trabajos guardados...")
+        self._restore_next_batch()
+
+    def _restore_next_batch(self):
+        if not self._pending_restore:
+            return
+        batch = [self._pending_restore.popleft() for _ in range(min(RESTORE_BATCH_SIZE, len(self._pending_restore)))]
+        self.add_jobs([self.new_job_record(rec['url'], rec['download_type'], restored=rec) for rec in batch])
+        if self._pending_restore:
+            QTimer.singleShot(0, self._restore_next_batch)
+            return
+        self._run_deferred_imports()
+        resume, self._resume_uuids = self._resume_uuids, set()
+        if resume and not self.is_downloading:
+            # Solo lo que estaba descargándose: lo pausado a mano o con error espera al usuario
+            for rec in self.jobs.records():
+                if rec.uuid in resume:
+                    self.download_queue.push({'uuid': rec.uuid, 'url': rec.url})
+            if self.download_queue:
+                print(f"[{_ts()}] [RESTORE] Reanudando {len(self.download_queue)} trabajos interrumpidos por un cierre inesperado.")
+                self.is_downloading = True; self.update_master_download_icon(); self.start_next_download()
+
+    def _run_deferred_imports(self):
+        imports, self._deferred_imports = self._deferred_imports, []
+        for urls, download_type in imports:
+            self.import_urls(urls, download_type)
+
+    def visible_row_range(self):
+        top = self.table.rowAt(0)
+        bottom = self.table.rowAt(self.table.viewport().height() - 1)
+        last = self.jobs.rowCount() - 1
+        return max(top, 0), (last if bottom < 0 else bottom)
+
+    def start_pending_format_fetches(self):
+        """Reparte los huecos libres del pool: primero las filas visibles con formatos pendientes y,
+        cuando no queda ninguna, las de fuera de pantalla por orden de llegada."""
+        free = FORMAT_FETCH_MAX_WORKERS - len(self.active_format_fetchers)
+        if free <= 0 or not self.pending_format_fetches:
+            return
+        first, last = self.visible_row_range()
+        for row in range(first, last + 1):
+            job_uuid = self.jobs.record(row).uuid
+            url = self.pending_format_fetches.pop(job_uuid, None)
+            if url is None:
+                continue
+            self.start_format_fetcher(job_uuid, url)
+            free -= 1
+            if free <= 0:
+                return
+        # Cada fetch que termina vuelve a llamar aquí: lo que entre en pantalla pasa delante
+        for job_uuid in list(islice(self.pending_format_fetches, free)):
+            self.start_format_fetcher(job_uuid, self.pending_format_fetches.pop(job_uuid))
 
-    def fetch_formats_for_row(self, row, url):
+    def eventFilter(self, obj, event):
+        # Al agrandar la ventana entran filas nuevas en pantalla
+        if obj is self.table.viewport() and event.type() == QEvent.Type.Resize:
+            self.format_fetch_timer.start()
+        return super().eventFilter(obj, event)
+
+    def start_format_fetcher(self, job_uuid, url):
         ydl_opts = base_ytdlp_opts(self.ffmpeg_path) | {'nocolor': True}
-        thread = QThread(self); worker = FormatFetcherWorker(row, url, ydl_opts)
+        thread = QThread(self); worker = FormatFetcherWorker(job_uuid, url, ydl_opts)
 
-        worker.moveToThread(thread); self.active_format_fetchers[row] = (thread, worker)
+        worker.moveToThread(thread); self.active_format_fetchers[job_uuid] = (thread, worker)
         thread.started.connect(worker.run)
         worker.formats_fetched.connect(self.on_formats_fetched)
         worker.error.connect(self.on_formats_error)
         worker.finished.connect(thread.quit)
         worker.finished.connect(worker.deleteLater)
-        thread.finished.connect(lambda r=row: self.cleanup_format_fetcher(r))
+        thread.finished.connect(lambda u=job_uuid: self.cleanup_format_fetcher(u))
+        thread.finished.connect(thread.deleteLater)
         thread.start()
 
-    def cleanup_format_fetcher(self, row):
-        if row in self.active_format_fetchers:
-            del self.active_format_fetchers[row]
+    def cleanup_format_fetcher(self, job_uuid):
+        self.active_format_fetchers.pop(job_uuid, None)
+        self.start_pending_format_fetches()
 
-    def on_formats_fetched(self, row, formats):
-        combo = self.table.cellWidget(row, 4)
-        if not combo:
+    def on_formats_fetched(self, job_uuid, formats):
+        if self.jobs.get(job_uuid) is None:
+            return
+        if len(formats) == 1 and formats[0].get('direct'):
+            f = formats[0]
+            size_str = f" ~{f['filesize']/(1024*1024):.1f}MB" if f.get('filesize') else ""
+            self.jobs.set_formats(job_uuid, [(f"Archivo directo ({f.get('ext', 'N/A')}){size_str}", BEST_QUALITY_ID)])
             return
-        combo.clear(); combo.setEnabled(True)
-        combo.addItem("Mejor Calidad", "bestvideo+bestaudio/best")
+        entries = [("Mejor Calidad", BEST_QUALITY_ID)]
 
         def sort_key(f):
             h = _get_height(f) or 0
@@ -1851,137 +2190,77 @@ class MainWindow(QMainWindow):
             display_text = f"{height}p ({ext}){size_str}"
             format_id = f.get('format_id')
             if format_id:
-                combo.addItem(display_text, format_id)
-
-        if combo.count() == 1:
-            combo.addItem("360p", "18")  # fallback clásico
-
-    def on_formats_error(self, row, error_message):
-        combo = self.table.cellWidget(row, 4)
-        if combo:
-            combo.clear(); combo.addItem("Error")
-        print(f"Error al obtener formatos para la fila {row+1}: {error_message}")
-
-    def create_format_widget(self, download_type):
-        widget = QWidget(); layout = QHBoxLayout(widget); layout.setContentsMargins(5, 0, 5, 0)
-        cb_audio = QCheckBox("Audio"); cb_video = QCheckBox("Video")
-        if download_type == 'audio':
-            cb_audio.setChecked(True); cb_video.setChecked(False)
-        elif download_type == 'video':
-            cb_audio.setChecked(False); cb_video.setChecked(True)
-        elif download_type == 'ambos':
-            cb_audio.setChecked(True); cb_video.setChecked(True)
-        layout.addWidget(cb_audio); layout.addWidget(cb_video)
-        return widget
-
-    def create_delete_widget(self):
-        widget = QWidget(); layout = QHBoxLayout(widget); layout.setContentsMargins(0, 0, 0, 0)
-        layout.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        delete_button = QPushButton("❌"); delete_button.setFixedSize(QSize(28, 28))
-        delete_button.clicked.connect(self.delete_row); layout.addWidget(delete_button)
-        return widget
-
-    def delete_row(self):
-        button = self.sender()
-        if not button:
-            return
-        parent_widget = button.parent()
-        if not parent_widget:
-            return
-        row = self.table.indexAt(parent_widget.pos()).row()
-        if row < 0:
-            return
+                entries.append((display_text, format_id))
 
-        # Si la fila a eliminar está en descarga activa, detenerla
-        if row in self.active_downloads:
-            thread, worker = self.active_downloads.pop(row)
-            try:
-                worker.stop()
-            except Exception:
-                pass
-            thread.quit()
-            thread.wait(5000)
-
-        # Cancelar fetch de formatos si está en progreso para esta fila
-        if row in self.active_format_fetchers:
-            f_thread, f_worker = self.active_format_fetchers.pop(row)
-            f_thread.quit()
-            f_thread.wait()
-
-        # Remover de cola de descarga pendiente si aplica
-        self.download_queue = [job for job in self.download_queue if job.get('row') != row]
-
-        # Si había entradas de cola con índices mayores, ajustar sus índices -1
-        for job in self.download_queue:
-            if job['row'] > row:
-                job['row'] -= 1
-
-        # Si la descarga activa eliminada, continuar con la siguiente si corresponde
-        if self.is_downloading and not self.active_thread:
-            # Nota: active_thread es None significa que la descarga activa fue detenida arriba
-            if self.download_queue:
-                self.start_next_download()
-            else:
-                self.is_downloading = False
-                self.update_master_download_icon()
-
-        # Eliminar información de la fila y limpiar temporales si no completado
-        if row in self.download_info:
-            info = self.download_info[row]
-            job_uuid = info.get('uuid')
-            was_completed = info.get('completed', False)
-            if not was_completed and job_uuid:
+        if len(entries) == 1:
+            entries.append(("360p", "18"))  # fallback clásico
+
+        # Trabajo restaurado: current_format() vuelve a elegir la resolución guardada si está
+        self.jobs.set_formats(job_uuid, entries)
+
+    def on_formats_error(self, job_uuid, error_message):
+        self.jobs.set_formats(job_uuid, [("Error", None)], 'error')
+        print(f"Error al obtener formatos para la fila {self.jobs.row_of(job_uuid)+1}: {error_message}")
+
+    def delete_row(self, row):
+        if 0 <= row < self.jobs.rowCount():
+            self.delete_jobs([self.jobs.record(row).uuid])
+
+    def delete_jobs(self, job_uuids):
+        """Elimina trabajos por uuid. Nada se renumera: la cola descarta al sacarlos los que
+        ya no existen y el modelo reindexa una sola vez."""
+        for job_uuid in job_uuids:
+            rec = self.jobs.get(job_uuid)
+            if rec is None:
+                continue
+
+            # Si está en descarga activa, detenerla (espera a que suelte los parciales)
+            if job_uuid in self.active_downloads:
+                thread, worker = self.active_downloads.pop(job_uuid)
+                try:
+                    worker.stop()
+                except Exception:
+                    pass
+                thread.quit()
+                thread.wait(5000)
+
+            # Cancelar el fetch de formatos sin bloquear: el pendiente se descarta y el que está
+            # dentro de yt-dlp termina por su cuenta (sigue ocupando su hueco hasta entonces)
+            self.pending_format_fetches.pop(job_uuid, None)
+            if job_uuid in self.active_format_fetchers:
+                self.active_format_fetchers[job_uuid][1].cancelled = True
+
+            # Limpiar temporales si no estaba completado
+            if not rec.completed:
                 temp_job_dir = os.path.join(TEMP_DOWNLOADS_DIR, job_uuid)
                 if os.path.isdir(temp_job_dir):
                     print(f"Limpiando directorio de trabajo temporal: {temp_job_dir}")
                     ok = _safe_rmtree(temp_job_dir)
                     print(" -> Directorio temporal eliminado con éxito." if ok else " -> No se pudo eliminar.")
-            # Eliminar entrada de info
-            del self.download_info[row]
-
-            # Ajustar índices de download_info para filas posteriores
-            new_download_info = {}
-            for r, info_val in sorted(self.download_info.items()):
-                if r < row:
-                    new_download_info[r] = info_val
-                else:
-                    new_download_info[r - 1] = info_val
-            self.download_info = new_download_info
-
-            # Ajustar referencias en active_downloads
-            new_active_downloads = {}
-            for r, tup in list(self.active_downloads.items()):
-                if r < row:
-                    new_active_downloads[r] = tup
-                elif r > row:
-                    new_active_downloads[r - 1] = tup
-            self.active_downloads = new_active_downloads
-
-            # Ajustar referencias en active_format_fetchers
-            new_active_format_fetchers = {}
-            for r, tup in list(self.active_format_fetchers.items()):
-                if r < row:
-                    new_active_format_fetchers[r] = tup
-                elif r > row:
-                    new_active_format_fetchers[r - 1] = tup
-                    # Actualizar el atributo 'row' del worker de formatos
-                    try:
-                        tup[1].row = r - 1
-                    except Exception:
-                        pass
-            self.active_format_fetchers = new_active_format_fetchers
+            self.job_store.delete(job_uuid)
 
-        # Remover la fila de la tabla y actualizar numeración
-        self.table.removeRow(row)
-        for i in range(row, self.table.rowCount()):
-            num_item = self.table.item(i, 0)
-            if num_item:
-                num_item.setText(str(i+1))
+        # La numeración (#) la calcula el modelo
+        self.jobs.remove(job_uuids)
+        INFO_CACHE.set_capacity(self.jobs.rowCount())
+
+        # El hueco liberado (si la fila descargaba) lo ocupa el siguiente de la cola
+        if self.is_downloading:
+            self.start_next_download()
+        # Las filas que suben pueden entrar en pantalla
+        self.format_fetch_timer.start()
 
 
 # ----------------------------- Main -----------------------------------
 
 if __name__ == "__main__":
+    # Necesario para ProcessPoolExecutor en el ejecutable congelado (Windows)
+    multiprocessing.freeze_support()
+
+    # Arranque oculto del bot (autostart): sin ventana ni QApplication, solo el daemon
+    if "--autostart-bot" in sys.argv:
+        import bot_daemon
+        sys.exit(bot_daemon.main([a for a in sys.argv[1:] if a != "--autostart-bot"]))
+
     # En Windows: fija AppUserModelID para icono consistente en la barra de tareas
     if sys.platform == "win32":
         try:
@@ -2003,22 +2282,12 @@ if __name__ == "__main__":
 
     # Crea la ventana principal
     window = MainWindow()
+    window.show()
 
-    # Soporte de arranque oculto para el bot (NUEVO)
-    AUTOSTART_BOT_ONLY = ("--autostart-bot" in sys.argv)
-
-    if AUTOSTART_BOT_ONLY:
-        # No mostramos la ventana; solo dejamos correr el loop Qt para el hilo del bot
-        should_run = (
-            window.settings.value("telegram/enabled", False, type=bool)
-            and bool(window.settings.value("telegram/token", "", type=str))
-        )
-        if not should_run:
-            print("[AUTOSTART] Bot no habilitado o token vacío. Saliendo.")
-            QTimer.singleShot(0, app.quit)
-        # Si sí debe correr, simplemente no llamamos a window.show()
-    else:
-        window.show()
+    # --import lista.txt (repetible): añade los enlaces del archivo a la cola
+    for i, arg in enumerate(sys.argv[:-1]):
+        if arg == "--import":
+            window.import_file(sys.argv[i + 1])
 
     # Ejecuta el loop de eventos
     sys.exit(app.exec())
@@ -0,0 +1,1565 @@
+# Bot de Telegram sin Qt: lo usan la GUI (TelegramBotWorker en main.py) y el daemon (bot_daemon.py).
+# La configuración se lee del mismo almacén (QSettings) con bot_settings_from().
+
+import os
+import re
+import copy
+import uuid
+import time
+import json
+import pickle
+import hmac
+import secrets
+import sqlite3
+import asyncio
+import itertools
+import contextlib
+import threading
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from datetime import timedelta
+from pathlib import Path
+
+import psutil
+import yt_dlp
+import telegram
+from telegram import Update
+from telegram.ext import Application, BaseRateLimiter, MessageHandler, filters
+
+from engine import (
+    _ts, _safe_rmtree, URL_REGEX, TEMP_DOWNLOADS_DIR, BOT_TEMP_DIRNAME, APP_DATA_DIR, FORMAT_FALLBACK,
+    base_ytdlp_opts, canonical_url, head_content_length, pick_format_under_budget,
+    TRANSCODE_MAX_WORKERS, TRANSCODE_MIN_VIDEO_KBPS, transcode_target_kbps, transcode_to_budget,
+)
+
+TELEGRAM_SIZE_LIMIT = 45 * 1024 * 1024  # 45 MB
+LOCAL_API_SIZE_LIMIT = 2000 * 1024 * 1024  # servidor Bot API propio (telegram-bot-api --local): 2 GB
+LOCAL_API_TIMEOUT = 600  # s; con el servidor local la subida la hace él antes de responder
+WEBHOOK_LISTEN_HOST = "0.0.0.0"
+DEFAULT_WEBHOOK_PORT = 8443
+DEFAULT_WEBHOOK_PATH = "/telegram"
+WEBHOOK_MAX_BODY = 1024 * 1024  # un update de Telegram nunca se acerca a esto
+# Sin formato nativo < 45MB: se baja una versión modesta y se recomprime (ver transcode_to_budget)
+TRANSCODE_SOURCE_FORMAT = "bv*[height<=720]+ba/b[height<=720]/wv*+ba/w"
+TRANSCODE_SOURCE_LIMIT = 512 * 1024 * 1024  # máximo a descargar para recomprimir
+DEFAULT_BOT_MAX_CONCURRENT = 3  # descargas simultáneas del bot (todas las conversaciones)
+DEFAULT_BOT_MAX_PER_USER = 1    # descargas simultáneas por usuario; el resto espera en cola
+DEFAULT_BOT_WORKER_PROCESSES = 0  # procesos de descarga del bot; 0 = hilos dentro del propio proceso
+MEMORY_CLIP_MAX = 16 * 1024 * 1024  # clips estimados por debajo de esto se bajan a RAM (tmpfs)
+MEMORY_SIZE_MARGIN = 1.25  # holgura sobre la estimación antes de abandonar la RAM
+DEFAULT_BOT_MEMORY_BUDGET_MB = 128  # RAM total para clips en memoria (todas las descargas); 0 = desactivado
+RAM_LIMIT_ERROR = "Supera la reserva en memoria"
+DEFAULT_BOT_MAX_PER_MESSAGE = 4  # enlaces de un mismo mensaje que se descargan a la vez
+DEFAULT_BOT_PLAYLIST_MAX = 10    # entradas de una playlist que el bot descarga como máximo
+MEDIA_GROUP_MAX = 10  # límite de send_media_group
+# Límites de envío de Telegram (~30 mensajes/s en total, ~1/s por chat y ~20/min por grupo)
+TG_GLOBAL_RATE = 25           # peticiones/s del bot, con margen
+TG_CHAT_INTERVAL = 1.0        # s entre mensajes a un mismo chat privado
+TG_GROUP_INTERVAL = 3.0       # s entre mensajes a un grupo o canal
+TG_MAX_RETRIES = 5            # reintentos tras RetryAfter o fallo de red en subidas
+TG_UPLOAD_ENDPOINTS = frozenset({"sendVideo", "sendDocument", "sendMediaGroup"})
+PROGRESS_EDIT_INTERVAL = 5.0  # s mínimos entre ediciones del mensaje de progreso
+TG_FILE_ID_DB_PATH = os.path.join(APP_DATA_DIR, "telegram_file_ids.sqlite3")
+TG_FILE_ID_TTL = 30 * 24 * 3600  # Telegram conserva los file_id mucho tiempo; se refrescan cada 30 días
+TG_FILE_ID_CACHE_MAX = 5000  # entradas; al superarlo se descartan las menos usadas recientemente
+TG_QUOTA_DB_PATH = os.path.join(APP_DATA_DIR, "telegram_quotas.sqlite3")
+
+def _memory_temp_root() -> Optional[str]:
+    """Carpeta en tmpfs (RAM) para los clips pequeños del bot; None si el sistema no tiene una."""
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return os.path.join(shm, f"bitstation_tg_{os.getuid()}")
+    return None
+
+MEMORY_TEMP_ROOT = _memory_temp_root()
+
+def _memory_temp_dir() -> Optional[str]:
+    """Subcarpeta de tmpfs propia de esta instancia (<pid>_<id>): webhook, polling, GUI y
+    bot_daemon pueden convivir con el mismo uid. Al crearla se borran solo las de procesos muertos."""
+    if not MEMORY_TEMP_ROOT:
+        return None
+    if os.path.isdir(MEMORY_TEMP_ROOT):
+        for name in os.listdir(MEMORY_TEMP_ROOT):
+            pid = name.split("_", 1)[0]
+            if not (pid.isdigit() and psutil.pid_exists(int(pid))):
+                _safe_rmtree(os.path.join(MEMORY_TEMP_ROOT, name))  # restos que ocupan RAM
+    return os.path.join(MEMORY_TEMP_ROOT, f"{os.getpid()}_{uuid.uuid4().hex[:8]}")
+
+# ------------------------------ Persistencia ------------------------------
+
+class FileIdCache:
+    """file_id de Telegram de los vídeos ya enviados (SQLite en modo WAL).
+
+    Un enlace repetido se reenvía con send_video(file_id) sin extraer, descargar ni subir.
+    Claves: URL canónica y 'extractor:id' (mismo vídeo desde enlaces distintos).
+    Los file_id son de cada bot, así que se guardan por bot_id. Lo usa el hilo del bot.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS file_ids (
+            key        TEXT NOT NULL,
+            bot_id     TEXT NOT NULL,
+            file_id    TEXT NOT NULL,
+            file_size  INTEGER,
+            created_at REAL NOT NULL,
+            last_used  REAL NOT NULL,
+            hits       INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (key, bot_id)
+        )
+    """
+
+    def __init__(self, path: str, ttl=TG_FILE_ID_TTL, max_entries=TG_FILE_ID_CACHE_MAX):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl, self.max_entries = ttl, max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(self.SCHEMA)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS file_ids_last_used ON file_ids (last_used)")
+        self.prune()
+
+    @staticmethod
+    def info_key(info) -> Optional[str]:
+        if not isinstance(info, dict):
+            return None
+        extractor = info.get('extractor_key') or info.get('ie_key') or info.get('extractor')
+        video_id = info.get('id')
+        if not extractor or not video_id:
+            return None
+        return f"{str(extractor).lower()}:{video_id}"
+
+    def get(self, bot_id, *keys) -> Optional[str]:
+        keys = [k for k in keys if k]
+        if not keys:
+            return None
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT key, file_id FROM file_ids WHERE bot_id = ? AND created_at >= ? "
+                f"AND key IN ({', '.join('?' * len(keys))}) LIMIT 1",
+                (bot_id, now - self.ttl, *keys)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE file_ids SET last_used = ?, hits = hits + 1 WHERE key = ? AND bot_id = ?",
+                              (now, row[0], bot_id))
+        return row[1]
+
+    def put(self, bot_id, keys, file_id, file_size=None):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO file_ids (key, bot_id, file_id, file_size, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(k, bot_id, file_id, file_size, now, now) for k in dict.fromkeys(keys) if k])
+        self.prune()
+
+    def invalidate(self, bot_id, file_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM file_ids WHERE bot_id = ? AND file_id = ?", (bot_id, file_id))
+
+    def prune(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM file_ids WHERE created_at < ?", (time.time() - self.ttl,))
+            self.conn.execute(
+                "DELETE FROM file_ids WHERE rowid IN (SELECT rowid FROM file_ids "
+                "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def close(self):
+        try:
+            self.conn.close()
+        except sqlite3.Error:
+            pass
+
+class QuotaStore:
+    """Cuotas del bot por usuario y por chat con cubetas de tokens (SQLite en modo WAL).
+
+    Dos recursos: 'requests' (peticiones por minuto) y 'bytes' (bytes por día). Cada cubeta se
+    rellena de forma continua (capacidad / periodo por segundo), así que no hay un corte a
+    medianoche. Capacidad 0 = sin cuota. El estado sobrevive a reinicios del bot.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS buckets (
+            bucket   TEXT NOT NULL,
+            subject  TEXT NOT NULL,
+            tokens   REAL NOT NULL,
+            updated  REAL NOT NULL,
+            PRIMARY KEY (bucket, subject)
+        )
+    """
+    PERIODS = {'requests': 60.0, 'bytes': 86400.0}
+
+    def __init__(self, path: str, limits=None):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.limits = {}
+        self.set_limits(limits or {})
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(self.SCHEMA)
+        # Tras un día sin uso cualquier cubeta está llena: guardarla no aporta nada
+        with self.lock:
+            self.conn.execute("DELETE FROM buckets WHERE updated < ?", (time.time() - 2 * self.PERIODS['bytes'],))
+
+    def set_limits(self, limits):
+        """limits: {'requests_user', 'requests_chat', 'bytes_user', 'bytes_chat'} -> capacidad."""
+        self.limits = {k: max(0, int(v or 0)) for k, v in limits.items()}
+
+    def _level(self, bucket, subject, now):
+        """(tokens actuales, capacidad, tokens/s) o None si esa cuota está desactivada. Con self.lock."""
+        capacity = self.limits.get(bucket, 0)
+        if not capacity:
+            return None
+        rate = capacity / self.PERIODS[bucket.split('_', 1)[0]]
+        row = self.conn.execute("SELECT tokens, updated FROM buckets WHERE bucket = ? AND subject = ?",
+                                (bucket, subject)).fetchone()
+        tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+        return tokens, capacity, rate
+
+    def _store(self, bucket, subject, tokens, now):
+        self.conn.execute("INSERT OR REPLACE INTO buckets (bucket, subject, tokens, updated) VALUES (?, ?, ?, ?)",
+                          (bucket, subject, tokens, now))
+
+    def _subjects(self, resource, user_id, chat_id):
+        return [(f"{resource}_user", str(user_id)), (f"{resource}_chat", str(chat_id))]
+
+    def take_request(self, user_id, chat_id) -> float:
+        """Consume una petición del usuario y del chat. Devuelve 0 si se permite o los segundos a esperar."""
+        now = time.time()
+        with self.lock:
+            levels = [(b, s, self._level(b, s, now)) for b, s in self._subjects('requests', user_id, chat_id)]
+            levels = [(b, s, lvl) for b, s, lvl in levels if lvl is not None]
+            wait = max([(1 - tokens) / rate for _, _, (tokens, _, rate) in levels if tokens < 1], default=0.0)
+            if wait > 0:
+                return wait
+            for bucket, subject, (tokens, _, _) in levels:
+                self._store(bucket, subject, tokens - 1, now)
+        return 0.0
+
+    def bytes_left(self, user_id, chat_id) -> Optional[int]:
+        """Bytes que aún puede descargar (el menor entre usuario y chat); None si no hay cuota de bytes."""
+        now = time.time()
+        with self.lock:
+            levels = [self._level(b, s, now) for b, s in self._subjects('bytes', user_id, chat_id)]
+        levels = [lvl for lvl in levels if lvl is not None]
+        if not levels:
+            return None
+        return max(0, int(min(tokens for tokens, _, _ in levels)))
+
+    def seconds_until_bytes(self, user_id, chat_id, nbytes) -> float:
+        """Espera hasta que vuelva a haber nbytes (o la cuota entera, si nbytes la supera)."""
+        now = time.time()
+        with self.lock:
+            levels = [self._level(b, s, now) for b, s in self._subjects('bytes', user_id, chat_id)]
+        return max([max(0.0, (min(nbytes, capacity) - tokens) / rate)
+                    for tokens, capacity, rate in (lvl for lvl in levels if lvl is not None)], default=0.0)
+
+    def charge_bytes(self, user_id, chat_id, nbytes):
+        """Descuenta lo descargado (puede quedar en negativo: la siguiente descarga espera a recuperarlo)."""
+        now = time.time()
+        with self.lock:
+            for bucket, subject in self._subjects('bytes', user_id, chat_id):
+                level = self._level(bucket, subject, now)
+                if level is not None:
+                    self._store(bucket, subject, level[0] - nbytes, now)
+
+    def close(self):
+        try:
+            self.conn.close()
+        except sqlite3.Error:
+            pass
+
+# ------------------------------ Descarga (hilo o proceso) ------------------------------
+
+def _is_format_error(e) -> bool:
+    msg = str(e)
+    return ("Requested format is not available" in msg) or ("not available" in msg and "format" in msg.lower())
+
+def _size_guard(d, dl_files, size_limit, size_label, source_limit=None, stopped=None, ram_limit=None):
+    if stopped is not None and stopped():
+        raise yt_dlp.utils.DownloadError("Detenido por el usuario/bot desactivado")
+
+    if d.get('status') != 'downloading':
+        return
+
+    fn = d.get('filename') or ""
+    downloaded = int(d.get('downloaded_bytes') or 0)
+    total = d.get('total_bytes') or d.get('total_bytes_estimate') or None
+
+    # dl_files es propio de cada descarga (filename -> {'downloaded', 'total'}): con descargas
+    # simultáneas cada una suma solo sus pistas
+    dl_files[fn] = {'downloaded': downloaded, 'total': int(total) if total else None}
+
+    sum_downloaded = sum(v['downloaded'] for v in dl_files.values())
+    sum_totals_known = sum(v['total'] for v in dl_files.values() if v['total'] is not None)
+
+    if ram_limit is not None and max(sum_totals_known, sum_downloaded) > ram_limit:
+        # La estimación se quedó corta: el llamador repite la descarga en disco
+        raise yt_dlp.utils.DownloadError(RAM_LIMIT_ERROR)
+    if source_limit is not None:
+        # Descarga para recomprimir: solo se corta si el original es desproporcionado
+        if max(sum_totals_known, sum_downloaded) > source_limit:
+            raise yt_dlp.utils.DownloadError(
+                f"El original supera {source_limit // (1024*1024)}MB; demasiado grande para recomprimir")
+        return
+    if sum_totals_known and sum_totals_known > size_limit:
+        raise yt_dlp.utils.DownloadError(f"El archivo final supera {size_label} (estimado)")
+    if sum_downloaded > size_limit:
+        raise yt_dlp.utils.DownloadError(f"El archivo final supera {size_label} durante la descarga")
+
+def download_media(info, fmt, temp_dir, ffmpeg_path, size_limit, size_label, source_limit=None, stopped=None,
+                   ram_limit=None):
+    """Descarga el info_dict resuelto en temp_dir y devuelve los archivos finales creados.
+    Con source_limit (descarga para recomprimir) el tope es ese en lugar de size_limit;
+    ram_limit corta las descargas en tmpfs que superan su reserva (RAM_LIMIT_ERROR)."""
+    os.makedirs(temp_dir, exist_ok=True)
+    before = set(os.listdir(temp_dir))
+
+    dl_files = {}
+
+    for attempt in (fmt, 'b'):
+        ydl_opts = base_ytdlp_opts(ffmpeg_path) | {
+            'format': attempt,
+            'noplaylist': True,
+            'outtmpl': os.path.join(temp_dir, '%(title)s - %(id)s.%(ext)s'),
+            'progress_hooks': [lambda d: _size_guard(d, dl_files, size_limit, size_label,
+                                                     source_limit, stopped, ram_limit)],
+        }
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                _ = ydl.process_ie_result(copy.deepcopy(info), download=True)
+            break
+        except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError) as e:
+            if attempt == 'b' or not _is_format_error(e):
+                raise yt_dlp.utils.DownloadError(str(e)) from e
+            print(f"[{_ts()}] [BOT] Formato no disponible al descargar, reintentando con 'b'.")
+
+    after = set(os.listdir(temp_dir))
+    created = [os.path.join(temp_dir, f) for f in sorted(after - before)]
+    final_files = [p for p in created if os.path.isfile(p) and not p.endswith(('.part', '.ytdl', '.temp'))]
+    return final_files
+
+_worker_stop = None  # Event compartido con el frontend; lo fija _init_download_worker en cada proceso
+
+def _init_download_worker(stop_flag):
+    global _worker_stop
+    _worker_stop = stop_flag
+
+def download_media_job(info, fmt, temp_dir, ffmpeg_path, size_limit, size_label, source_limit=None, ram_limit=None):
+    """Punto de entrada de los procesos de descarga: mismo resultado y mismos errores que download_media."""
+    stopped = _worker_stop.is_set if _worker_stop is not None else None
+    try:
+        return download_media(info, fmt, temp_dir, ffmpeg_path, size_limit, size_label, source_limit, stopped,
+                              ram_limit)
+    except yt_dlp.utils.DownloadError as e:
+        # Solo el mensaje vuelve al frontend: exc_info (traceback) no se puede serializar
+        raise yt_dlp.utils.DownloadError(str(e)) from None
+
+def picklable_info(info) -> bool:
+    """Algunos extractores dejan callables en el info_dict (fragmentos perezosos): esos se bajan en hilo."""
+    try:
+        pickle.dumps(info, protocol=pickle.HIGHEST_PROTOCOL)
+        return True
+    except Exception:
+        return False
+
+# ------------------------------ Bot ------------------------------
+
+class AccessControl:
+    """Whitelist / blacklist del bot como conjuntos (pertenencia O(1)).
+    set_lists() cambia todo de una vez, así que la GUI puede llamarlo con el bot en marcha."""
+    def __init__(self, whitelist=(), blacklist=(), whitelist_enabled=False, blacklist_enabled=False):
+        self.set_lists(whitelist, blacklist, whitelist_enabled, blacklist_enabled)
+
+    def set_lists(self, whitelist, blacklist, whitelist_enabled, blacklist_enabled):
+        clean = lambda ids: frozenset(str(x).strip() for x in ids if str(x).strip())
+        # Una sola asignación: quien lea a la vez ve la configuración anterior o la nueva, nunca una mezcla
+        self._state = (clean(whitelist), clean(blacklist), bool(whitelist_enabled), bool(blacklist_enabled))
+
+    @property
+    def whitelist_enabled(self) -> bool:
+        return self._state[2]
+
+    @property
+    def blacklist_enabled(self) -> bool:
+        return self._state[3]
+
+    def describe(self, user_id) -> str:
+        whitelist, blacklist, wl_enabled, bl_enabled = self._state
+        uid = str(user_id)
+        return (f"WL={wl_enabled} ({len(whitelist)} ids, in_WL={uid in whitelist}) "
+                f"BL={bl_enabled} ({len(blacklist)} ids, in_BL={uid in blacklist})")
+
+    def denial(self, user_id) -> Optional[str]:
+        """Mensaje de rechazo para el usuario o None si puede usar el bot."""
+        whitelist, blacklist, wl_enabled, bl_enabled = self._state
+        uid = str(user_id)
+        if wl_enabled:
+            return None if uid in whitelist else "❌ No tienes permiso para usar este bot."
+        if bl_enabled and uid in blacklist:
+            return "❌ Tienes el acceso restringido."
+        return None
+
+def _format_wait(seconds) -> str:
+    seconds = max(1, int(seconds + 0.999))
+    if seconds < 90:
+        return f"{seconds} s"
+    if seconds < 5400:
+        return f"{seconds // 60} min"
+    return f"{seconds / 3600:.1f} h"
+
+class BotSlotQueue:
+    """Turnos de descarga del bot: tope global, tope por usuario y cola FIFO.
+
+    Vive en el event loop del bot. Al liberarse un hueco se atiende al primero de la cola
+    que quepa (uno con su tope por usuario lleno no bloquea a los que van detrás).
+    Con user_id=None el turno solo cuenta para el tope global: lo usan los enlaces extra de
+    un mensaje, que ya ocupa el turno de su usuario.
+    """
+    def __init__(self, max_total=DEFAULT_BOT_MAX_CONCURRENT, max_per_user=DEFAULT_BOT_MAX_PER_USER):
+        self.max_total, self.max_per_user = max(1, int(max_total)), max(1, int(max_per_user))
+        self.active = Counter()  # user_id -> descargas en curso
+        self.waiting = deque()   # (user_id, future) en orden de llegada
+
+    def _fits(self, user_id) -> bool:
+        return sum(self.active.values()) < self.max_total and (user_id is None or self.active[user_id] < self.max_per_user)
+
+    def try_acquire(self, user_id) -> bool:
+        if self.waiting or not self._fits(user_id):
+            return False
+        self.active[user_id] += 1
+        return True
+
+    def enqueue(self, user_id) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self.waiting.append((user_id, fut))
+        self._grant()  # por si hay hueco para él aunque otros esperen por su tope de usuario
+        return fut
+
+    def position(self, fut) -> int:
+        for i, (_, f) in enumerate(self.waiting, start=1):
+            if f is fut:
+                return i
+        return 0
+
+    def cancel(self, fut):
+        self.waiting = deque((u, f) for u, f in self.waiting if f is not fut)
+        if fut.done() and not fut.cancelled():
+            # Se le concedió turno justo antes de cancelar: se devuelve
+            self.release(fut.result())
+        self._grant()
+
+    def release(self, user_id):
+        self.active[user_id] -= 1
+        if self.active[user_id] <= 0:
+            del self.active[user_id]
+        self._grant()
+
+    def set_limits(self, max_total, max_per_user):
+        self.max_total, self.max_per_user = max(1, int(max_total)), max(1, int(max_per_user))
+        self._grant()
+
+    def _grant(self):
+        for user_id, fut in list(self.waiting):
+            if fut.done():
+                continue
+            if self._fits(user_id):
+                self.active[user_id] += 1
+                self.waiting.remove((user_id, fut))
+                fut.set_result(user_id)
+
+class WebhookServer:
+    """Receptor HTTP mínimo (asyncio puro) para el modo webhook del bot.
+
+    Acepta POST en 'path', comprueba la cabecera X-Telegram-Bot-Api-Secret-Token y mete el
+    Update en application.update_queue, así llega al mismo handle_message que con polling.
+    Pensado para ir detrás de un proxy inverso con TLS (varias instancias por puerto/ruta).
+    """
+    def __init__(self, application, port, path, secret, host=WEBHOOK_LISTEN_HOST):
+        self.application = application
+        self.host, self.port = host, int(port)
+        self.path = "/" + (path or DEFAULT_WEBHOOK_PATH).strip("/")
+        self.secret = secret or ""
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        print(f"[{_ts()}] [BOT] Webhook escuchando en {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle(self, reader, writer):
+        status = "500 Internal Server Error"
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=10)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length") or 0)
+
+            if target.split("?", 1)[0].rstrip("/") != self.path:
+                status = "404 Not Found"
+            elif method != "POST":
+                status = "405 Method Not Allowed"
+            elif self.secret and not hmac.compare_digest(
+                    headers.get("x-telegram-bot-api-secret-token", ""), self.secret):
+                status = "403 Forbidden"
+            elif length <= 0 or length > WEBHOOK_MAX_BODY:
+                status = "400 Bad Request"
+            else:
+                body = await asyncio.wait_for(reader.readexactly(length), timeout=10)
+                update = Update.de_json(json.loads(body), self.application.bot)
+                await self.application.update_queue.put(update)
+                status = "200 OK"
+        except (ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            status = "400 Bad Request"
+            print(f"[{_ts()}] [BOT] Webhook: petición inválida ({e.__class__.__name__})")
+        except Exception as e:
+            print(f"[{_ts()}] [BOT] Webhook: error procesando update: {e}")
+        try:
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+class MemoryBudget:
+    """RAM reservada por las descargas en tmpfs. Solo se usa desde el loop del bot."""
+    def __init__(self, limit_bytes):
+        self.limit = max(0, int(limit_bytes))
+        self.used = 0
+
+    def reserve(self, nbytes) -> bool:
+        if nbytes <= 0 or self.used + nbytes > self.limit:
+            return False
+        self.used += nbytes
+        return True
+
+    def release(self, nbytes):
+        self.used = max(0, self.used - nbytes)
+
+class FloodControlLimiter(BaseRateLimiter):
+    """Cola de salida hacia la Bot API (rate_limiter de la Application).
+
+    Las peticiones a un mismo chat salen de una en una y espaciadas (TG_CHAT_INTERVAL o
+    TG_GROUP_INTERVAL), todas juntas a TG_GLOBAL_RATE como mucho. Un RetryAfter (429) pausa
+    solo el chat que lo recibió (o todo, si la petición no era de ningún chat) el tiempo que
+    pide Telegram y se reintenta; las subidas también se reintentan con espera exponencial
+    si falla la red.
+    """
+    def __init__(self, global_rate=TG_GLOBAL_RATE, max_retries=TG_MAX_RETRIES):
+        self.global_interval = 1.0 / global_rate
+        self.max_retries = max_retries
+        self._global_lock = None
+        self._global_next = 0.0
+        self._chats = {}  # chat_id -> [asyncio.Lock, próximo instante permitido, pausado hasta]
+        self._global_paused_until = 0.0  # RetryAfter de peticiones sin chat (loop.time())
+
+    async def initialize(self):
+        self._global_lock = asyncio.Lock()
+
+    async def shutdown(self):
+        self._chats.clear()
+
+    def _chat_state(self, chat_id):
+        state = self._chats.get(chat_id)
+        if state is None:
+            if len(self._chats) > 1000:
+                now = asyncio.get_running_loop().time()
+                for key, (lock, next_at, paused_until) in list(self._chats.items()):
+                    if not lock.locked() and max(next_at, paused_until) < now:
+                        del self._chats[key]
+            state = self._chats[chat_id] = [asyncio.Lock(), 0.0, 0.0]
+        return state
+
+    @staticmethod
+    def _chat_interval(chat_id) -> float:
+        # Los ids negativos (o @canal) son grupos y canales
+        try:
+            return TG_GROUP_INTERVAL if int(chat_id) < 0 else TG_CHAT_INTERVAL
+        except (TypeError, ValueError):
+            return TG_GROUP_INTERVAL
+
+    async def _pace_global(self):
+        loop = asyncio.get_running_loop()
+        async with self._global_lock:
+            delay = self._global_next - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._global_next = loop.time() + self.global_interval
+
+    async def _wait_pause(self, state):
+        # Se vuelve a mirar tras cada espera: otro 429 puede haber alargado la pausa
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = max(self._global_paused_until, state[2] if state else 0.0) - loop.time()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def _send(self, callback, args, kwargs, endpoint, max_retries, state=None):
+        loop = asyncio.get_running_loop()
+        for attempt in range(max_retries + 1):
+            await self._wait_pause(state)
+            await self._pace_global()
+            try:
+                return await callback(*args, **kwargs)
+            except telegram.error.RetryAfter as e:
+                if attempt == max_retries:
+                    raise
+                delay = e.retry_after
+                delay = delay.total_seconds() if isinstance(delay, timedelta) else float(delay)
+                print(f"[{_ts()}] [BOT] Límite de Telegram en {endpoint}: esperando {delay:.0f}s "
+                      f"(reintento {attempt + 1}/{max_retries})")
+                until = loop.time() + delay + 0.1
+                if state is None:
+                    self._global_paused_until = max(self._global_paused_until, until)
+                else:
+                    state[2] = max(state[2], until)
+            except (telegram.error.BadRequest, telegram.error.TimedOut):
+                # BadRequest no mejora reintentando; un TimedOut puede haber llegado (duplicaría el vídeo)
+                raise
+            except telegram.error.NetworkError as e:
+                if endpoint not in TG_UPLOAD_ENDPOINTS or attempt == max_retries:
+                    raise
+                delay = min(60, 2 ** attempt)
+                print(f"[{_ts()}] [BOT] Fallo de red subiendo ({e}); reintento en {delay}s")
+                await asyncio.sleep(delay)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        max_retries = rate_limit_args if rate_limit_args is not None else self.max_retries
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            return await self._send(callback, args, kwargs, endpoint, max_retries)
+        state = self._chat_state(chat_id)
+        loop = asyncio.get_running_loop()
+        async with state[0]:
+            delay = state[1] - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await self._send(callback, args, kwargs, endpoint, max_retries, state)
+            finally:
+                state[1] = loop.time() + self._chat_interval(chat_id)
+
+class ProgressMessage:
+    """Mensaje de estado que se edita en lugar de enviar mensajes nuevos (como mucho uno cada interval s)."""
+    def __init__(self, bot, message, interval=PROGRESS_EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = getattr(message, "chat_id", None)
+        self.message_id = getattr(message, "message_id", None)
+        self.text = getattr(message, "text", None)
+        self.interval = interval
+        self._last_edit = time.monotonic()
+
+    async def update(self, text, force=False):
+        if self.message_id is None or text == self.text:
+            return
+        if not force and time.monotonic() - self._last_edit < self.interval:
+            return
+        self.text, self._last_edit = text, time.monotonic()
+        try:
+            await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id)
+        except telegram.error.TelegramError as e:
+            print(f"[{_ts()}] [BOT] No se pudo actualizar el progreso: {e}")
+
+def _dir_size(path) -> int:
+    total = 0
+    try:
+        with os.scandir(path) as it:
+            for f in it:
+                if f.is_file():
+                    total += f.stat().st_size
+    except OSError:
+        pass
+    return total
+
+class InflightDownload:
+    """Descarga en curso compartida por todos los mensajes que piden el mismo vídeo.
+    La carpeta temporal se borra cuando termina el último mensaje que la espera."""
+    __slots__ = ('key', 'temp_dir', 'task', 'waiters', 'send_lock', 'file_id', 'ram_bytes', 'ram_limit')
+
+    def __init__(self, key, temp_dir):
+        self.key = key
+        self.temp_dir = temp_dir
+        self.ram_bytes = 0    # reservado en MemoryBudget mientras la carpeta está en tmpfs
+        self.ram_limit = None  # tope de bytes descargados antes de pasar a disco
+        self.task = None
+        self.waiters = 0
+        self.send_lock = asyncio.Lock()  # el primero sube el archivo; los demás reenvían su file_id
+        self.file_id = None
+
+class MediaItem:
+    """Un vídeo listo para enviar: archivo descargado (con su InflightDownload) o file_id de la caché."""
+    __slots__ = ('url', 'path', 'file_id', 'entry', 'cache_keys', 'progress')
+
+    def __init__(self, url, path=None, file_id=None, entry=None, cache_keys=(), progress=None):
+        self.url = url
+        self.path = path
+        self.file_id = file_id
+        self.entry = entry
+        self.cache_keys = list(cache_keys)
+        self.progress = progress  # ProgressMessage del enlace (solo mensajes de un enlace)
+
+class TelegramBot:
+    """Bot de Telegram completo (descarga, caché, colas, webhook) sin dependencias de Qt.
+    La GUI lo aloja en un QThread (TelegramBotWorker); bot_daemon lo ejecuta en el hilo principal."""
+    def __init__(self, token, whitelist, blacklist, whitelist_enabled, blacklist_enabled, ffmpeg_path, dest_video_path,
+                 max_concurrent=DEFAULT_BOT_MAX_CONCURRENT, max_per_user=DEFAULT_BOT_MAX_PER_USER, local_api_url="",
+                 webhook=None, worker_processes=DEFAULT_BOT_WORKER_PROCESSES,
+                 memory_budget_mb=DEFAULT_BOT_MEMORY_BUDGET_MB, max_per_message=DEFAULT_BOT_MAX_PER_MESSAGE,
+                 playlist_max_entries=DEFAULT_BOT_PLAYLIST_MAX, quotas=None):
+        self.token = token
+        self.acl = AccessControl(whitelist, blacklist, whitelist_enabled, blacklist_enabled)
+        # Cuotas por usuario/chat (peticiones por minuto y bytes por día), persistentes
+        self.quotas = QuotaStore(TG_QUOTA_DB_PATH, quotas)
+        self.ffmpeg_path = ffmpeg_path
+        self.dest_video_path = dest_video_path  # compat
+        self.application = None
+        self.is_running = True
+        self.loop = None
+        self.stop_event = None
+        self._awaiting_stop = False
+
+        # turnos de descarga (se crea dentro del loop del bot)
+        self.max_concurrent, self.max_per_user = max_concurrent, max_per_user
+        self.slots = None
+        # Mensajes con varios enlaces / playlists: ocupan un turno y bajan hasta max_per_message a la vez
+        self.max_per_message, self.playlist_max_entries = max_per_message, playlist_max_entries
+        self._transcode_pool = None  # ProcessPoolExecutor perezoso (recompresión al límite)
+
+        # Procesos de descarga: el frontend (polling/webhook) solo reparte trabajos y responde
+        self.worker_processes = max(0, int(worker_processes or 0))
+        self._download_pool = None
+        self._worker_stop = None  # multiprocessing.Event visto por los procesos (parada)
+
+        # Clips pequeños en tmpfs: de yt-dlp a send_video sin tocar el disco persistente
+        self.memory = MemoryBudget(max(0, memory_budget_mb) * 1024 * 1024)
+        self.memory_dir = _memory_temp_dir()
+
+        # Servidor Bot API local: límite de 2 GB y subida por ruta (el servidor lee el archivo del disco)
+        self.local_api_url = (local_api_url or "").strip().rstrip("/")
+        self.local_mode = bool(self.local_api_url)
+        self.size_limit = LOCAL_API_SIZE_LIMIT if self.local_mode else TELEGRAM_SIZE_LIMIT
+        self.size_label = "2 GB" if self.local_mode else "45 MB"
+
+        # Modo webhook (dict con url/port/path/secret); None = polling
+        self.webhook = webhook if webhook and webhook.get("url") else None
+        self.webhook_server = None
+
+        # file_id ya subidos (reenvío instantáneo de enlaces repetidos)
+        self.bot_id = str(token).split(":", 1)[0]
+        self.file_cache = FileIdCache(TG_FILE_ID_DB_PATH)
+        self._inflight = {}  # id canónico del vídeo -> InflightDownload (solo desde el loop del bot)
+
+    # ----- utilidades específicas del bot -----
+    def _topic_kwargs(self, update):
+        try:
+            tid = getattr(update.message, "message_thread_id", None)
+        except Exception:
+            tid = None
+        return {"message_thread_id": tid} if tid else {}
+
+    def _bot_ydl_opts(self, fmt=FORMAT_FALLBACK, **extra):
+        return base_ytdlp_opts(self.ffmpeg_path) | {'format': fmt, 'noplaylist': True} | extra
+
+    def _extract_info(self, url):
+        """Única extracción por mensaje (sin resolver formatos); el resto del flujo reutiliza este info_dict."""
+        with yt_dlp.YoutubeDL(self._bot_ydl_opts()) as ydl:
+            return ydl.extract_info(url, download=False, process=False)
+
+    @staticmethod
+    def _is_playlist(info) -> bool:
+        # Solo el info_dict decide: con noplaylist, watch?v=…&list=… ya se extrae como un solo vídeo
+        return isinstance(info, dict) and (info.get("_type") in ("playlist", "multi_video") or bool(info.get("entries")))
+
+    _is_format_error = staticmethod(_is_format_error)
+
+    def _resolve_info(self, info):
+        """Selecciona formatos sobre el info_dict ya extraído (sin volver a pedir la página).
+        Devuelve (info resuelto, formato usado); si FORMAT_FALLBACK no encaja, prueba 'b'."""
+        for fmt in (FORMAT_FALLBACK, 'b'):
+            # extract_flat: si la URL redirige a una playlist no se extraen sus entradas
+            opts = self._bot_ydl_opts(fmt, skip_download=True, extract_flat='in_playlist')
+            try:
+                with yt_dlp.YoutubeDL(opts) as ydl:
+                    return ydl.process_ie_result(copy.deepcopy(info), download=False), fmt
+            except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError) as e:
+                if fmt == 'b' or not self._is_format_error(e):
+                    raise yt_dlp.utils.DownloadError(str(e)) from e
+                print(f"[{_ts()}] [BOT] Formato no disponible, reintentando con 'b' (sin re-extraer).")
+
+    _head_content_length = staticmethod(head_content_length)
+
+    def _estimate_download_size(self, info):
+        """Tamaño esperado a partir del info_dict resuelto (HEAD solo si el extractor no lo da)."""
+        try:
+            if 'requested_formats' in info and info['requested_formats']:
+                total = 0
+                for f in info['requested_formats']:
+                    size = f.get('filesize') or f.get('filesize_approx')
+                    if not size:
+                        f_url = f.get('url')
+                        if f_url:
+                            size = self._head_content_length(f_url)
+                    if size:
+                        total += int(size)
+                    else:
+                        return None
+                return total or None
+
+            size = info.get('filesize') or info.get('filesize_approx')
+            if not size:
+                i_url = info.get('url')
+                if i_url:
+                    size = self._head_content_length(i_url)
+            return int(size) if size else None
+
+        except Exception:
+            return None
+
+    def _download_video_blocking(self, info, fmt, temp_dir, size_limit=None, ram_limit=None):
+        """Descarga a partir del info_dict ya resuelto (process_ie_result, sin nueva extracción)."""
+        return download_media(info, fmt, temp_dir, self.ffmpeg_path, self.size_limit, self.size_label,
+                              source_limit=size_limit, stopped=lambda: not self.is_running, ram_limit=ram_limit)
+
+    def _transcode_executor(self) -> ProcessPoolExecutor:
+        # Procesos aparte y pocos a la vez: una ráfaga de recompresiones no frena el polling ni las descargas
+        if self._transcode_pool is None:
+            self._transcode_pool = ProcessPoolExecutor(max_workers=TRANSCODE_MAX_WORKERS)
+        return self._transcode_pool
+
+    def _download_executor(self) -> ProcessPoolExecutor:
+        # Cola local (multiprocessing) hacia N procesos: una descarga pesada (merge, postprocesado)
+        # no compite por el GIL con el loop del bot ni con las demás descargas
+        if self._download_pool is None:
+            self._worker_stop = multiprocessing.Event()
+            self._download_pool = ProcessPoolExecutor(max_workers=self.worker_processes,
+                                                      initializer=_init_download_worker,
+                                                      initargs=(self._worker_stop,))
+            print(f"[{_ts()}] [BOT] {self.worker_processes} procesos de descarga en marcha.")
+        return self._download_pool
+
+    async def _download(self, info, fmt, temp_dir, source_limit=None, ram_limit=None):
+        if self.worker_processes and picklable_info(info):
+            return await asyncio.get_running_loop().run_in_executor(
+                self._download_executor(), download_media_job,
+                info, fmt, temp_dir, self.ffmpeg_path, self.size_limit, self.size_label, source_limit, ram_limit)
+        if self.worker_processes:
+            print(f"[{_ts()}] [BOT] info_dict no serializable; descarga en hilo del frontend.")
+        return await asyncio.to_thread(self._download_video_blocking, info, fmt, temp_dir, source_limit, ram_limit)
+
+    async def _fetch_media(self, info, fmt, temp_dir, transcode=False):
+        if not transcode:
+            return await self._download(info, fmt, temp_dir)
+        source_limit = max(TRANSCODE_SOURCE_LIMIT, 2 * self.size_limit)
+        files = await self._download(info, fmt, temp_dir, source_limit)
+        if not files or os.path.getsize(files[0]) <= self.size_limit:
+            return files
+        src = files[0]
+        dst = os.path.join(temp_dir, os.path.splitext(os.path.basename(src))[0] + " [reducido].mp4")
+        print(f"[{_ts()}] [BOT] Recomprimiendo a {self.size_label}: {os.path.basename(src)} "
+              f"({os.path.getsize(src) / (1024*1024):.1f}MB)")
+        out = await asyncio.get_running_loop().run_in_executor(
+            self._transcode_executor(), transcode_to_budget,
+            src, dst, self.ffmpeg_path, self.size_limit, info.get('duration'))
+        return [out]
+
+    def _reserve_memory(self, entry: InflightDownload, info, est_bytes, transcode=False) -> bool:
+        """Pasa la descarga a tmpfs si es pequeña y cabe en el presupuesto de RAM."""
+        if transcode or self.local_mode or not self.memory_dir or not est_bytes or est_bytes > MEMORY_CLIP_MAX:
+            return False
+        ram_limit = int(est_bytes * MEMORY_SIZE_MARGIN)
+        # Al unir vídeo y audio conviven las pistas y el resultado: pico del doble
+        reserve = ram_limit * (2 if info.get('requested_formats') else 1)
+        if not self.memory.reserve(reserve):
+            return False
+        entry.temp_dir = os.path.join(self.memory_dir, uuid.uuid4().hex)
+        entry.ram_bytes, entry.ram_limit = reserve, ram_limit
+        return True
+
+    async def _fetch_entry(self, entry: InflightDownload, info, fmt, transcode=False):
+        if entry.ram_bytes:
+            try:
+                return await self._download(info, fmt, entry.temp_dir, ram_limit=entry.ram_limit)
+            except yt_dlp.utils.DownloadError as e:
+                if RAM_LIMIT_ERROR not in str(e):
+                    raise
+            print(f"[{_ts()}] [BOT] El clip supera su reserva en RAM; se repite en disco.")
+            _safe_rmtree(entry.temp_dir)
+            self.memory.release(entry.ram_bytes)
+            entry.ram_bytes, entry.ram_limit = 0, None
+            entry.temp_dir = os.path.join(TEMP_DOWNLOADS_DIR, BOT_TEMP_DIRNAME, uuid.uuid4().hex)
+        return await self._fetch_media(info, fmt, entry.temp_dir, transcode)
+
+    def _join_inflight(self, key, info, fmt, transcode=False, est_bytes=None) -> InflightDownload:
+        entry = self._inflight.get(key)
+        if entry is None:
+            entry = InflightDownload(key, os.path.join(TEMP_DOWNLOADS_DIR, BOT_TEMP_DIRNAME, uuid.uuid4().hex))
+            if self._reserve_memory(entry, info, est_bytes, transcode):
+                print(f"[{_ts()}] [BOT] Clip pequeño: descarga en memoria ({entry.temp_dir}, "
+                      f"{self.memory.used / (1024*1024):.0f}/{self.memory.limit / (1024*1024):.0f}MB reservados)")
+            entry.task = asyncio.ensure_future(self._fetch_entry(entry, info, fmt, transcode))
+            self._inflight[key] = entry
+        else:
+            print(f"[{_ts()}] [BOT] Descarga ya en curso para {key}; esperando su resultado ({entry.waiters} en espera).")
+        entry.waiters += 1
+        return entry
+
+    def _release_inflight(self, entry: InflightDownload):
+        entry.waiters -= 1
+        if entry.waiters > 0:
+            return
+        if self._inflight.get(entry.key) is entry:
+            del self._inflight[entry.key]
+
+        def cleanup(*_):
+            try:
+                _safe_rmtree(entry.temp_dir)
+                print(f"[{_ts()}] [BOT] Limpieza temporal Telegram -> {entry.temp_dir}")
+            except Exception as e:
+                print(f"[{_ts()}] [BOT] Error limpiando temporales Telegram: {e}")
+            self.memory.release(entry.ram_bytes)
+            entry.ram_bytes = 0
+
+        # Si nadie espera pero el hilo sigue escribiendo, se limpia cuando termine
+        if entry.task is not None and not entry.task.done():
+            entry.task.add_done_callback(cleanup)
+        else:
+            cleanup()
+
+    def set_limits(self, max_concurrent, max_per_user, memory_budget_mb=None, max_per_message=None,
+                   playlist_max_entries=None):
+        """Llamable desde el hilo de la GUI: aplica los topes en el loop del bot."""
+        self.max_concurrent, self.max_per_user = max_concurrent, max_per_user
+        if max_per_message is not None:
+            self.max_per_message = max_per_message  # se lee al empezar cada mensaje
+        if playlist_max_entries is not None:
+            self.playlist_max_entries = playlist_max_entries
+        if self.slots is not None and self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.slots.set_limits, max_concurrent, max_per_user)
+        if memory_budget_mb is not None:
+            # Solo afecta a las reservas nuevas; las descargas ya en RAM terminan allí
+            self.memory.limit = max(0, int(memory_budget_mb)) * 1024 * 1024
+
+    def set_acl(self, whitelist, blacklist, whitelist_enabled, blacklist_enabled):
+        """Llamable desde el hilo de la GUI."""
+        self.acl.set_lists(whitelist, blacklist, whitelist_enabled, blacklist_enabled)
+
+    def set_quotas(self, limits):
+        """Llamable desde el hilo de la GUI; las cubetas guardadas conservan su nivel."""
+        self.quotas.set_limits(limits)
+
+    async def _acquire_slot(self, context, chat_id, update, user_id, notify=True):
+        if self.slots.try_acquire(user_id):
+            return
+        waiter = self.slots.enqueue(user_id)
+        if waiter.done():
+            return
+        position = self.slots.position(waiter)
+        print(f"[{_ts()}] [BOT] En cola user_id={user_id} posición={position}")
+        try:
+            if notify:
+                try:
+                    await context.bot.send_message(
+                        chat_id, f"⏳ Hay descargas en curso. Estás en la posición {position} de la cola; "
+                        "empezaré en cuanto haya hueco.", **self._topic_kwargs(update))
+                except telegram.error.TelegramError as e:
+                    print(f"[{_ts()}] [BOT] No se pudo avisar de la posición en cola: {e}")
+            await waiter
+        except BaseException:
+            self.slots.cancel(waiter)
+            raise
+
+    async def _send_cached(self, context, chat_id, update, file_id) -> bool:
+        """Reenvía un vídeo ya subido. Si Telegram rechaza el file_id se invalida y se descarga de nuevo."""
+        try:
+            await context.bot.send_video(chat_id, video=file_id, supports_streaming=True, **self._topic_kwargs(update))
+            return True
+        except telegram.error.BadRequest as e:
+            print(f"[{_ts()}] [BOT] file_id rechazado ({e}). Invalidando caché.")
+            self.file_cache.invalidate(self.bot_id, file_id)
+        except telegram.error.TelegramError as e:
+            print(f"[{_ts()}] [BOT] Error reenviando desde caché: {e}")
+        return False
+
+    # ------------------------------------------
+
+    def run(self):
+        """Hilo dedicado con su propio event loop y parada graceful (sin run_polling)."""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        async def lifecycle():
+            try:
+                self.stop_event = asyncio.Event()
+                self.slots = BotSlotQueue(self.max_concurrent, self.max_per_user)
+                # Updates en paralelo: el tope real de descargas lo pone self.slots
+                builder = (Application.builder().token(self.token).concurrent_updates(True)
+                           .rate_limiter(FloodControlLimiter()))
+                if self.local_mode:
+                    print(f"[{_ts()}] [BOT] Usando servidor Bot API local: {self.local_api_url} (límite {self.size_label})")
+                    builder = (builder.base_url(f"{self.local_api_url}/bot")
+                               .base_file_url(f"{self.local_api_url}/file/bot")
+                               .local_mode(True)
+                               .read_timeout(LOCAL_API_TIMEOUT).write_timeout(LOCAL_API_TIMEOUT)
+                               .media_write_timeout(LOCAL_API_TIMEOUT))
+                self.application = builder.build()
+                self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+
+                # init + start + polling manual (o receptor webhook propio)
+                await self.application.initialize()
+                await self.application.start()
+                if self.webhook:
+                    self.webhook_server = WebhookServer(self.application, self.webhook.get("port") or DEFAULT_WEBHOOK_PORT,
+                                                        self.webhook.get("path"), self.webhook.get("secret"))
+                    await self.webhook_server.start()
+                    await self.application.bot.set_webhook(url=self.webhook["url"],
+                                                           secret_token=self.webhook.get("secret") or None)
+                    print(f"[{_ts()}] [BOT] Webhook registrado: {self.webhook['url']}")
+                else:
+                    await self.application.updater.start_polling()
+
+                # esperar señal de stop
+                self._awaiting_stop = True
+                await self.stop_event.wait()
+
+                # detener ordenadamente (stop() puede haber adelantado parte de la parada)
+                if self.webhook_server is not None:
+                    await self.webhook_server.stop()
+                elif self.application.updater.running:
+                    await self.application.updater.stop()
+                if self.application.running:
+                    await self.application.stop()
+                await self.application.shutdown()
+            except Exception as e:
+                print(f"[{_ts()}] [ERROR Telegram lifecycle] {e}")
+
+        try:
+            self.loop.run_until_complete(lifecycle())
+        finally:
+            try:
+                pending = [t for t in asyncio.all_tasks(loop=self.loop) if not t.done()]
+                for t in pending:
+                    t.cancel()
+                if pending:
+                    self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            except Exception:
+                pass
+            try:
+                self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            except Exception:
+                pass
+            try:
+                if not self.loop.is_closed():
+                    self.loop.close()
+            except Exception:
+                pass
+            if self._transcode_pool is not None:
+                self._transcode_pool.shutdown(wait=False, cancel_futures=True)
+            if self._download_pool is not None:
+                self._worker_stop.set()
+                self._download_pool.shutdown(wait=False, cancel_futures=True)
+            self.file_cache.close()
+            self.quotas.close()
+            # Solo lo propio: temp_downloads/_tg lo comparte con otras instancias (GUI y demonio)
+            for entry in list(self._inflight.values()):
+                _safe_rmtree(entry.temp_dir)
+            if self.memory_dir:
+                _safe_rmtree(self.memory_dir)
+            print(f"[{_ts()}] [BOT] Loop cerrado. run() termina.")
+
+    async def handle_message(self, update, context):
+        if not self.is_running:
+            return
+
+        chat = update.effective_chat
+        msg  = update.effective_message
+        user = update.effective_user
+
+        chat_id   = chat.id
+        thread_id = getattr(msg, "message_thread_id", None)
+        text      = msg.text or ""
+
+        print(f"[{_ts()}] [BOT] Incoming text chat_id={chat_id} type={chat.type} thread_id={thread_id} user_id={user.id}")
+        print(f"[{_ts()}] [BOT] ACL: {self.acl.describe(user.id)}")
+
+        denial = self.acl.denial(user.id)
+        if denial:
+            await context.bot.send_message(chat_id, denial, **self._topic_kwargs(update))
+            return
+
+        urls = list(dict.fromkeys(re.findall(URL_REGEX, text)))
+        if not urls:
+            print(f"[{_ts()}] [BOT] No se detectaron URLs en el mensaje.")
+            return
+
+        wait = self.quotas.take_request(user.id, chat_id)
+        if wait:
+            print(f"[{_ts()}] [BOT] Cuota de peticiones agotada user_id={user.id} chat_id={chat_id} ({wait:.0f}s)")
+            await context.bot.send_message(
+                chat_id, f"⏳ Has alcanzado el límite de peticiones. Vuelve a intentarlo en {_format_wait(wait)}.",
+                **self._topic_kwargs(update))
+            return
+
+        if len(urls) == 1:
+            cached = self.file_cache.get(self.bot_id, canonical_url(urls[0]))
+            if cached and await self._send_cached(context, chat_id, update, cached):
+                print(f"[{_ts()}] [BOT] Reenviado desde caché (URL) chat_id={chat_id} thread_id={thread_id}")
+                return
+
+        await self._acquire_slot(context, chat_id, update, user.id)
+        slot_held = True
+
+        def release_slot():
+            # Solo espera el resultado de otro: su turno queda libre para el siguiente
+            nonlocal slot_held
+            if slot_held:
+                self.slots.release(user.id)
+                slot_held = False
+
+        items = []
+        progress = None
+        try:
+            if not self.is_running:
+                return
+            targets = await self._expand_targets(context, chat_id, update, urls)
+            if not targets:
+                return
+            total = len(targets)
+            if total == 1:
+                url, info = targets[0]
+                item = await self._prepare_item(context, update, url, info, release_slot=release_slot)
+                items = [item] if item else []
+            else:
+                print(f"[{_ts()}] [BOT] {total} enlaces en el mensaje; hasta {self.max_per_message} a la vez chat_id={chat_id}")
+                progress = ProgressMessage(context.bot, await context.bot.send_message(
+                    chat_id, f"✅ {total} enlaces recibidos. Descargando en paralelo…", **self._topic_kwargs(update)))
+                # Cada enlace pasa sus propias comprobaciones de tamaño; el mensaje tarda lo que el más lento.
+                # El mensaje cuenta una vez para el tope por usuario: un enlace usa su turno y los demás
+                # toman turnos solo globales, así max_per_message nunca salta max_concurrent
+                limit = asyncio.Semaphore(max(1, self.max_per_message))
+                finished = 0
+                own_free = True  # el turno del mensaje está libre para el siguiente enlace
+
+                async def prepare(index, url, info):
+                    nonlocal finished, own_free
+                    async with limit:
+                        if not self.is_running:
+                            return None
+                        own = own_free and slot_held
+                        if own:
+                            own_free = False
+                        else:
+                            await self._acquire_slot(context, chat_id, update, None, notify=False)
+                        held = True
+
+                        def release_item_slot():
+                            nonlocal held
+                            if held:
+                                held = False
+                                if own:
+                                    release_slot()
+                                else:
+                                    self.slots.release(None)
+
+                        try:
+                            if not self.is_running:
+                                return None
+                            item = await self._prepare_item(context, update, url, info, label=f"[{index}/{total}] ",
+                                                            release_slot=release_item_slot)
+                        finally:
+                            if own and held:
+                                own_free = True  # vuelve al mensaje para el siguiente enlace
+                            else:
+                                release_item_slot()
+                    finished += 1
+                    await progress.update(f"⬇️ {finished}/{total} enlaces procesados…")
+                    return item
+
+                results = await asyncio.gather(*(prepare(i, url, info) for i, (url, info) in enumerate(targets, 1)))
+                items = [item for item in results if item]
+                await progress.update(f"📤 Subiendo {len(items)} de {total} vídeos…" if items
+                                      else "😕 Ningún enlace produjo un vídeo.", force=True)
+
+            if not self.is_running:
+                print(f"[{_ts()}] [BOT] Bot desactivado durante descarga. Abortando envío.")
+                return
+            if items:
+                await self._deliver(context, update, items)
+                if progress is not None:
+                    await progress.update(f"✅ {len(items)} de {total} vídeos enviados.", force=True)
+        except Exception as e:
+            print(f"[{_ts()}] [BOT] Error general en handle_message: {e}")
+            await context.bot.send_message(chat_id, f"😕 Error al procesar: {str(e)[:1000]}", **self._topic_kwargs(update))
+        finally:
+            if slot_held:
+                self.slots.release(user.id)
+            for item in items:
+                if item.entry is not None:
+                    self._release_inflight(item.entry)
+
+    async def _expand_targets(self, context, chat_id, update, urls) -> list:
+        """[(url, info o None)] a descargar: extrae cada enlace una vez (en paralelo, con el tope por
+        mensaje) y sustituye las playlists por sus primeras playlist_max_entries entradas."""
+        limit = asyncio.Semaphore(max(1, self.max_per_message))
+
+        async def expand(url):
+            if len(urls) > 1 and self.file_cache.get(self.bot_id, canonical_url(url)):
+                return [(url, None)]  # ya subido: _prepare_item lo toma de la caché sin extraer
+            async with limit:
+                try:
+                    info = await asyncio.to_thread(self._extract_info, url)
+                except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError) as e:
+                    if len(urls) == 1:
+                        raise yt_dlp.utils.DownloadError(str(e)) from e
+                    print(f"[{_ts()}] [BOT] No se pudo extraer {url}: {e}")
+                    await context.bot.send_message(chat_id, f"😕 No pude leer {url}", **self._topic_kwargs(update))
+                    return []
+                if not self._is_playlist(info):
+                    return [(url, info)]
+                entries, truncated = await asyncio.to_thread(self._playlist_entries, info)
+                title = info.get('title') or url
+                print(f"[{_ts()}] [BOT] Playlist '{title}': {len(entries)} entradas{' (recortada)' if truncated else ''}")
+                if truncated:
+                    await context.bot.send_message(
+                        chat_id, f"ℹ️ La playlist «{title}» tiene más de {self.playlist_max_entries} vídeos; "
+                        f"envío solo los primeros {self.playlist_max_entries}.", **self._topic_kwargs(update))
+                elif not entries:
+                    await context.bot.send_message(chat_id, f"😕 La playlist «{title}» está vacía.", **self._topic_kwargs(update))
+                return entries
+
+        try:
+            expanded = await asyncio.gather(*(expand(url) for url in urls))
+        except yt_dlp.utils.DownloadError as e:
+            await self._report_download_error(context, update, urls[0], str(e))
+            return []
+        return [target for group in expanded for target in group]
+
+    def _playlist_entries(self, info):
+        """Entradas de una playlist sin procesar (hasta playlist_max_entries). Devuelve (entradas, recortada)."""
+        entries = info.get('entries') or []
+        cap = max(1, self.playlist_max_entries)
+        if isinstance(entries, yt_dlp.utils.PagedList):
+            entries = entries.getslice(0, cap + 1)
+        targets = []
+        for entry in itertools.islice(entries, cap + 1):
+            if not isinstance(entry, dict):
+                continue
+            if entry.get('_type') in ('url', 'url_transparent') or not entry.get('formats'):
+                url = entry.get('webpage_url') or entry.get('url')
+                if url:
+                    targets.append((url, None))
+            else:
+                # El extractor ya dio la entrada completa: no hace falta volver a pedirla
+                targets.append((entry.get('webpage_url') or entry.get('url') or info.get('webpage_url'), entry))
+        return targets[:cap], len(targets) > cap
+
+    async def _prepare_item(self, context, update, url, info=None, label="", release_slot=None) -> Optional[MediaItem]:
+        """Descarga (o encuentra en caché) un enlace. Los avisos y errores se envían aquí con label como
+        prefijo; devuelve None si el enlace no produce nada que enviar."""
+        chat_id = update.effective_chat.id
+        thread_id = getattr(update.effective_message, "message_thread_id", None)
+        single = not label
+
+        async def say(text, **kwargs):
+            return await context.bot.send_message(chat_id, label + text, **kwargs, **self._topic_kwargs(update))
+
+        entry = None
+        try:
+            cache_keys = [canonical_url(url)]
+            if not single:
+                cached = self.file_cache.get(self.bot_id, cache_keys[0])
+                if cached:
+                    return MediaItem(url, file_id=cached, cache_keys=cache_keys)
+            if info is None:
+                # Una sola extracción: el mismo info_dict decide playlist, tamaño y descarga
+                info = await asyncio.to_thread(self._extract_info, url)
+            cache_keys.append(FileIdCache.info_key(info))
+            cached = self.file_cache.get(self.bot_id, cache_keys[1])
+            if cached:
+                if not single:
+                    return MediaItem(url, file_id=cached, cache_keys=cache_keys)
+                if await self._send_cached(context, chat_id, update, cached):
+                    self.file_cache.put(self.bot_id, cache_keys, cached)
+                    print(f"[{_ts()}] [BOT] Reenviado desde caché ({cache_keys[1]}) chat_id={chat_id}")
+                    return None
+            if self._is_playlist(info):
+                print(f"[{_ts()}] [BOT] Playlist dentro de otra playlist. Se omite.")
+                await say("⚠️ Este enlace es otra playlist; envíamela en un mensaje aparte.")
+                return None
+
+            info, fmt = await asyncio.to_thread(self._resolve_info, info)
+            cache_keys.append(FileIdCache.info_key(info))
+            if self._is_playlist(info):
+                print(f"[{_ts()}] [BOT] Playlist detectada tras resolver la URL. Se omite.")
+                await say("⚠️ Este enlace lleva a una playlist; envíame el enlace de la playlist directamente.")
+                return None
+
+            # === Estimación previa ===
+            transcode = False
+            est_bytes = await asyncio.to_thread(self._estimate_download_size, info)
+            if est_bytes is None or est_bytes > self.size_limit:
+                # Antes de rechazar (o descargar a ciegas) se busca la mejor calidad que quepa en el límite
+                choice = await asyncio.to_thread(
+                    pick_format_under_budget, info.get('formats'), self.size_limit, self._head_content_length)
+                if choice:
+                    fmt, fit_bytes, height = choice
+                    quality = f"{height}p" if height else f"formato {fmt}"
+                    print(f"[{_ts()}] [BOT] Formato ajustado a {self.size_label}: {fmt} (~{fit_bytes / (1024*1024):.1f}MB)")
+                    if est_bytes is not None:
+                        await say(f"ℹ️ El original pesa ~{est_bytes / (1024*1024):.1f} MB; lo envío en {quality} "
+                                  f"(~{fit_bytes / (1024*1024):.1f} MB) para no superar {self.size_label}.")
+                    est_bytes = fit_bytes
+            if est_bytes is not None:
+                if est_bytes > self.size_limit:
+                    est_mb = est_bytes / (1024*1024)
+                    duration = info.get('duration')
+                    if duration and transcode_target_kbps(self.size_limit, duration) < TRANSCODE_MIN_VIDEO_KBPS:
+                        print(f"[{_ts()}] [BOT] Rechazado (~{est_mb:.1f}MB > {self.size_label}, {duration:.0f}s) chat_id={chat_id} thread_id={thread_id}")
+                        await say(f"⛔ El video pesa ~{est_mb:.1f} MB y es demasiado largo para recomprimirlo a {self.size_label}. No se descargará.")
+                        return None
+                    # Ningún formato nativo cabe: se descarga una versión modesta y se recomprime
+                    transcode, fmt = True, TRANSCODE_SOURCE_FORMAT
+                    print(f"[{_ts()}] [BOT] Sin formato < {self.size_label} (~{est_mb:.1f}MB). Se recomprimirá chat_id={chat_id}")
+                    await say(f"ℹ️ El video pesa ~{est_mb:.1f} MB. Lo recomprimiré para que quepa en {self.size_label} (puede tardar un poco).")
+            else:
+                await say(f"ℹ️ No pude estimar el tamaño previamente; intentaré descargar y cancelaré si supera {self.size_label}.")
+
+            user_id = update.effective_user.id
+            bytes_left = self.quotas.bytes_left(user_id, chat_id)
+            if bytes_left is not None and (est_bytes or 1) > bytes_left:
+                wait = self.quotas.seconds_until_bytes(user_id, chat_id, est_bytes or 1)
+                print(f"[{_ts()}] [BOT] Cuota diaria de bytes agotada user_id={user_id} chat_id={chat_id}")
+                await say(f"⛔ Cuota diaria de descarga agotada (quedan {bytes_left / (1024*1024):.1f} MB). "
+                          f"Vuelve a intentarlo en {_format_wait(wait)}.")
+                return None
+
+            print(f"[{_ts()}] [BOT] Aceptado. Iniciando descarga {label}chat_id={chat_id} thread_id={thread_id}")
+            progress = None
+            if single:
+                progress = ProgressMessage(context.bot, await say("✅ Link recibido. Descargando…"))
+
+            # Mismo vídeo ya descargándose para otro mensaje: se espera ese resultado
+            entry = self._join_inflight(cache_keys[2] or cache_keys[1] or cache_keys[0], info, fmt, transcode, est_bytes)
+            if entry.waiters > 1 and release_slot is not None:
+                release_slot()
+            if progress is not None:
+                await self._watch_download(entry, progress, None if transcode else est_bytes)
+            filepaths = await asyncio.shield(entry.task)
+            # Se cobra lo que ocupa la descarga (incluido el original si se recomprimió)
+            self.quotas.charge_bytes(user_id, chat_id, await asyncio.to_thread(_dir_size, entry.temp_dir))
+
+            if not self.is_running:
+                return None
+
+            if not filepaths:
+                await say(f"😕 No se generó ningún archivo final (posible error o excede {self.size_label}).")
+                return None
+
+            path = filepaths[0]
+            if os.path.getsize(path) > self.size_limit:
+                await say(f"⛔ El archivo final supera {self.size_label}. No puedo enviarlo por Telegram.")
+                return None
+
+            item = MediaItem(url, path=path, entry=entry, cache_keys=cache_keys, progress=progress)
+            entry = None  # la libera handle_message tras el envío
+            return item
+
+        except yt_dlp.utils.DownloadError as e:
+            await self._report_download_error(context, update, url, str(e), label)
+        except Exception as e:
+            if single:
+                raise
+            print(f"[{_ts()}] [BOT] Error procesando {url}: {e}")
+            await say(f"😕 Error al procesar: {str(e)[:1000]}")
+        finally:
+            if entry is not None:
+                self._release_inflight(entry)
+        return None
+
+    async def _watch_download(self, entry: InflightDownload, progress: ProgressMessage, est_bytes=None):
+        """Edita el mensaje de estado con lo descargado hasta que termina la descarga (lo lee del disco:
+        vale igual para hilos, procesos y tmpfs)."""
+        while not entry.task.done():
+            await asyncio.wait({entry.task}, timeout=progress.interval)
+            if entry.task.done():
+                break
+            done = await asyncio.to_thread(_dir_size, entry.temp_dir)
+            if est_bytes:
+                percent = min(99, int(done * 100 / est_bytes))
+                text = f"⬇️ Descargando… {percent}% ({done / (1024*1024):.1f}/{est_bytes / (1024*1024):.1f} MB)"
+            else:
+                text = f"⬇️ Descargando… {done / (1024*1024):.1f} MB"
+            await progress.update(text)
+
+    async def _report_download_error(self, context, update, url, msg_err, label=""):
+        chat_id = update.effective_chat.id
+        print(f"[{_ts()}] [BOT] DownloadError: {msg_err}")
+        if "recomprimir" in msg_err:
+            text = "⛔ El video original es demasiado grande para recomprimirlo. No puedo enviarlo por Telegram."
+        elif "El archivo final supera" in msg_err:
+            text = f"⛔ El archivo final supera {self.size_label}. No puedo enviarlo por Telegram."
+        elif ("facebook" in msg_err.lower() or "facebook" in url.lower()) and "Cannot parse data" in msg_err:
+            text = ("😕 Facebook devolvió una página que requiere inicio de sesión o no es pública. "
+                    "Prueba con un enlace público (p. ej. fb.watch/… o /videos/…) "
+                    "o descárgalo desde la app de Windows.")
+        else:
+            text = ("😕 Error del extractor. Probé máxima compatibilidad.\n"
+                    "Si persiste, actualiza yt-dlp y vuelve a intentar.")
+        await context.bot.send_message(chat_id, label + text, **self._topic_kwargs(update))
+
+    async def _send_item(self, context, update, item: MediaItem):
+        """Envía un solo vídeo: reenvía el file_id si ya se subió (mismo vídeo en otro mensaje)."""
+        chat_id = update.effective_chat.id
+        thread_id = getattr(update.effective_message, "message_thread_id", None)
+        if item.path is None:
+            if await self._send_cached(context, chat_id, update, item.file_id):
+                self.file_cache.put(self.bot_id, item.cache_keys, item.file_id)
+            else:
+                await context.bot.send_message(
+                    chat_id, f"😕 No pude reenviar {item.url}; mándamelo de nuevo.", **self._topic_kwargs(update))
+            return
+        entry = item.entry
+        if item.progress is not None:
+            await item.progress.update("📤 Subiendo a Telegram…", force=True)
+        async with entry.send_lock:
+            if entry.file_id and await self._send_cached(context, chat_id, update, entry.file_id):
+                print(f"[{_ts()}] [BOT] Reenviado file_id de la descarga compartida chat_id={chat_id} thread_id={thread_id}")
+            else:
+                print(f"[{_ts()}] [BOT] Enviando video chat_id={chat_id} thread_id={thread_id}")
+                if self.local_mode:
+                    # El servidor local lee el archivo de disco (file://); no se copia por HTTP
+                    sent = await context.bot.send_video(chat_id, video=Path(item.path), supports_streaming=True, **self._topic_kwargs(update))
+                else:
+                    with open(item.path, 'rb') as video_file:
+                        sent = await context.bot.send_video(chat_id, video=video_file, supports_streaming=True, **self._topic_kwargs(update))
+                self._remember_sent(item, sent)
+        if item.progress is not None:
+            await item.progress.update("✅ Enviado.", force=True)
+
+    def _remember_sent(self, item: MediaItem, sent):
+        media = getattr(sent, "video", None) or getattr(sent, "document", None)
+        file_id = getattr(media, "file_id", None) if media is not None else None
+        if not file_id:
+            return
+        if item.entry is not None:
+            item.entry.file_id = file_id
+        self.file_cache.put(self.bot_id, item.cache_keys, file_id,
+                            os.path.getsize(item.path) if item.path else None)
+
+    async def _deliver(self, context, update, items):
+        """Un vídeo: send_video. Varios: send_media_group en tandas de MEDIA_GROUP_MAX."""
+        chat_id = update.effective_chat.id
+        for start in range(0, len(items), MEDIA_GROUP_MAX):
+            batch = items[start:start + MEDIA_GROUP_MAX]
+            if len(batch) == 1:
+                await self._send_item(context, update, batch[0])
+                continue
+            print(f"[{_ts()}] [BOT] Enviando grupo de {len(batch)} vídeos chat_id={chat_id}")
+            try:
+                with contextlib.ExitStack() as stack:
+                    media = []
+                    for item in batch:
+                        if item.path is None:
+                            source = item.file_id
+                        elif item.entry.file_id:
+                            source = item.entry.file_id
+                        elif self.local_mode:
+                            source = Path(item.path)
+                        else:
+                            source = stack.enter_context(open(item.path, 'rb'))
+                        media.append(telegram.InputMediaVideo(source, supports_streaming=True))
+                    sent = await context.bot.send_media_group(chat_id, media=media, **self._topic_kwargs(update))
+                for item, message in zip(batch, sent):
+                    self._remember_sent(item, message)
+            except telegram.error.BadRequest as e:
+                # Un file_id caducado tumba el grupo entero: se reintenta vídeo a vídeo
+                print(f"[{_ts()}] [BOT] Grupo rechazado ({e}). Enviando uno a uno.")
+                for item in batch:
+                    await self._send_item(context, update, item)
+
+    def stop(self):
+        """Parada robusta: detiene polling y ciclo, y libera el hilo siempre."""
+        print("[BOT WORKER] Stop requested.")
+        self.is_running = False
+        if self._worker_stop is not None:
+            self._worker_stop.set()  # las descargas en los procesos se cortan en su siguiente progreso
+        try:
+            if self.loop and not self.loop.is_closed():
+                # Señales explícitas para salir rápido
+                if self.stop_event is not None:
+                    self.loop.call_soon_threadsafe(self.stop_event.set)
+                if self._awaiting_stop:
+                    return  # lifecycle ya en marcha: hace la parada ordenada él mismo
+                if self.application:
+                    if self.webhook_server is not None:
+                        asyncio.run_coroutine_threadsafe(self.webhook_server.stop(), self.loop)
+                    else:
+                        asyncio.run_coroutine_threadsafe(self.application.updater.stop(), self.loop)
+                    asyncio.run_coroutine_threadsafe(self.application.stop(), self.loop)
+                    asyncio.run_coroutine_threadsafe(self.application.shutdown(), self.loop)
+        except Exception as e:
+            print(f"[BOT WORKER] stop error: {e}")
+
+# ------------------------------ Configuración ------------------------------
+
+def webhook_settings_from(settings) -> Optional[dict]:
+    """Opciones del modo webhook o None (polling). Genera y guarda el secreto si falta."""
+    if not settings.value("telegram/webhook_enabled", False, type=bool):
+        return None
+    url = settings.value("telegram/webhook_url", "", type=str).strip()
+    if not url:
+        print(f"[{_ts()}] [BOT] Webhook activado sin URL pública; se usa polling.")
+        return None
+    secret = settings.value("telegram/webhook_secret", "", type=str)
+    if not secret:
+        secret = secrets.token_urlsafe(32)
+        settings.setValue("telegram/webhook_secret", secret)
+    return {
+        "url": url,
+        "port": settings.value("telegram/webhook_port", DEFAULT_WEBHOOK_PORT, type=int),
+        "path": settings.value("telegram/webhook_path", DEFAULT_WEBHOOK_PATH, type=str),
+        "secret": secret,
+    }
+
+def quota_limits_from(settings) -> dict:
+    """Capacidades de QuotaStore a partir de QSettings (0 = sin cuota)."""
+    mb = 1024 * 1024
+    return {
+        "requests_user": settings.value("telegram/quota_user_requests_per_min", 0, type=int),
+        "requests_chat": settings.value("telegram/quota_chat_requests_per_min", 0, type=int),
+        "bytes_user": settings.value("telegram/quota_user_mb_per_day", 0, type=int) * mb,
+        "bytes_chat": settings.value("telegram/quota_chat_mb_per_day", 0, type=int) * mb,
+    }
+
+def bot_settings_from(settings) -> dict:
+    """kwargs de TelegramBot leídos de un QSettings (o cualquier objeto con la misma .value())."""
+    return {
+        "token": settings.value("telegram/token", "", type=str),
+        "whitelist": json.loads(settings.value("telegram/whitelist", "[]", type=str)),
+        "blacklist": json.loads(settings.value("telegram/blacklist", "[]", type=str)),
+        "whitelist_enabled": settings.value("telegram/whitelist_enabled", False, type=bool),
+        "blacklist_enabled": settings.value("telegram/blacklist_enabled", False, type=bool),
+        "max_concurrent": settings.value("telegram/max_concurrent", DEFAULT_BOT_MAX_CONCURRENT, type=int),
+        "max_per_user": settings.value("telegram/max_per_user", DEFAULT_BOT_MAX_PER_USER, type=int),
+        "local_api_url": settings.value("telegram/local_api_url", "", type=str),
+        "webhook": webhook_settings_from(settings),
+        "worker_processes": settings.value("telegram/worker_processes", DEFAULT_BOT_WORKER_PROCESSES, type=int),
+        "memory_budget_mb": settings.value("telegram/memory_budget_mb", DEFAULT_BOT_MEMORY_BUDGET_MB, type=int),
+        "max_per_message": settings.value("telegram/max_per_message", DEFAULT_BOT_MAX_PER_MESSAGE, type=int),
+        "playlist_max_entries": settings.value("telegram/playlist_max_entries", DEFAULT_BOT_PLAYLIST_MAX, type=int),
+        "quotas": quota_limits_from(settings),
+    }